@@ -1,4 +1,5 @@
-print('''
+if __name__ == "__main__":
+    print('''
         ##############################################
         ##############################################\n
         Sentinel-1 Geocode Using SNAP Software... \n
@@ -10,11 +11,163 @@ print('''
         ##############################################\n\n
         ''')
 
-def main():
-    import warnings
-    import os
-    warnings.filterwarnings('ignore')
-    
+def geocode_lookup(args, i, external_dem=None):
+    '''
+    compute the terrain-correction lookup of the stack of reference i once
+    and return the saved path
+    '''
+    import snappy_for_oriburi as snappy
+    import manifest_for_oriburi as manifest
+
+    prod = snappy.readProduct(args.fPath, i)
+
+    if args.ml == '1':
+        prod = snappy.multi_look(prod, 'all', args.rg, args.az)
+        save_dir = args.sPath+'lookup_ml_tc.dim'
+    else:
+        save_dir = args.sPath+'lookup_tc.dim'
+
+    parameters = {k: getattr(args, k) for k in ['ml', 'az', 'rg', 'dem']}
+    parameters['external_dem'] = external_dem
+    rec = manifest.record([args.fPath+i], parameters, snappy.processingVersion())
+    if not args.force and manifest.isDone(save_dir, rec):
+        print('skip lookup: %s is up to date' %save_dir)
+        return save_dir
+    manifest.mark(save_dir, rec, 'running')
+
+    snappy.save(snappy.tc_lookup(prod, args.dem, external_dem), save_dir)
+    manifest.mark(save_dir, rec, 'done')
+    return save_dir
+
+def geocode_bands(bands, reference):
+    '''
+    bands of a stack kept by geocode_scene
+    the reference (_mst) band or the secondary (_slv) bands, all of them for a
+    batched stack, and always the incidence angle bands of terrain correction
+    '''
+    angles = [band for band in bands if 'IncidenceAngle' in band]
+    bands = [band for band in bands if band not in angles]
+    if any('_slv' in band for band in bands):
+        bands = [band for band in bands if ('_slv' in band) != reference]
+    elif reference:
+        bands = bands[0:1]
+    else:
+        bands = bands[1::]
+    return bands + angles
+
+def geocode_scene(args, i, reference=False, external_dem=None, lookup=None):
+    '''
+    geocode scene i and return the saved path
+    with args.asyncWrites a Future of the saved path, marked done when written
+    reference: True to keep the reference band of the first stack
+               otherwise the secondary bands (see geocode_bands)
+    external_dem: path of a local DEM used instead of args.dem
+    lookup: path of the lookup of geocode_lookup
+            bands are resampled through it instead of terrain correction
+    '''
+    import snappy_for_oriburi as snappy
+    import manifest_for_oriburi as manifest
+
+    if args.engine == 'numpy':
+        # multilooking and dB in NumPy straight from the .dim, no SNAP operator
+        import numpy_for_oriburi as engine
+        import dimap_for_oriburi as dimap
+
+        rg, az = 1, 1
+        if args.ml == '1':
+            # looks of the lookup grid, which SNAP derived for square ground pixels
+            rg, az = [a//b for a, b in zip(engine.dimLooks(lookup), engine.dimLooks(args.fPath+i))]
+        reader = engine.radiometryReader(args.fPath+i, rg, az, args.output == 'dB')
+        product_name = dimap.dimInfo(args.fPath+i)['Product Name']
+        if args.ml == '1':
+            product_name = product_name+'_ML'
+        if args.output == 'dB':
+            product_name = product_name+'_dB'
+        product_name = product_name+'_TC'
+        bands = list(reader['Bands'])
+    else:
+        prod = snappy.readProduct(args.fPath, i)
+
+        if args.ml == '1':
+            prod = snappy.multi_look(prod, 'all', args.rg, args.az)
+
+        if args.output == 'dB':
+            prod = snappy.Linear2dB(prod)
+
+        if lookup is None:
+            prod = snappy.terrain_correction(prod, 'all', args.dem, args.inc, external_dem)
+            product_name = prod.getName()
+        else:
+            product_name = prod.getName()+'_TC'
+
+        bands = snappy.extBandNames(prod)
+    bands = geocode_bands(bands, reference)
+    if reference:
+        name = product_name[0:4]
+    else:
+        name = product_name[4::]
+    if lookup is None and args.engine == 'snap':
+        for band in snappy.extBandNames(prod):
+            if band not in bands:
+                prod.removeBand(prod.getBand(band))
+
+    ext = {'cog': 'tif', 'zarr': 'dim'}.get(args.save_format, args.save_format)
+    cog = None
+    if args.save_format == 'cog':
+        import cog_for_oriburi
+        cog = cog_for_oriburi.cogOptions(args.compress, bigtiff='YES' if args.bigtiff else 'IF_SAFER')
+
+    if args.ml == '1':
+        save_dir = args.sPath+name+'_ml_'+args.output+'_'+'_tc.'+ext
+
+    if args.ml == '0':
+        save_dir = args.sPath+name+'_'+args.output+'_'+'_tc.'+ext
+
+    parameters = {k: getattr(args, k) for k in ['ml', 'az', 'rg', 'dem', 'output', 'inc', 'save_format']}
+    parameters['cog'] = cog
+    parameters['reference'] = reference
+    parameters['external_dem'] = external_dem
+    parameters['lookup'] = lookup
+    parameters['engine'] = args.engine
+    rec = manifest.record([args.fPath+i] + ([lookup] if lookup is not None else []), parameters, snappy.processingVersion())
+    if not args.force and manifest.isDone(save_dir, rec):
+        print('skip %s: %s is up to date' %(i, save_dir))
+        return save_dir
+    manifest.mark(save_dir, rec, 'running')
+
+    dim_dir = save_dir if ext == 'dim' else save_dir[:-4]+'.dim'
+    if lookup is None and args.asyncWrites:
+        # the chain of the next scene is built while this one is written
+        future = snappy.saveAsync(prod, save_dir, cog)
+        future.add_done_callback(lambda f: manifest.mark(save_dir, rec, 'done') if f.exception() is None else
+                                 manifest.mark(save_dir, rec, 'failed', Error=repr(f.exception())))
+        return future
+    if lookup is None:
+        snappy.save(prod, save_dir, cog)
+    elif args.engine == 'numpy':
+        import lookup_for_oriburi as lookup_tc
+        import trace_for_oriburi as trace
+        with trace.span('geocodeDim', 'write', output=dim_dir):
+            lookup_tc.geocodeDim(reader['Read'], bands, reader['Width'], reader['Height'], lookup, dim_dir)
+        print('Product saved in\n', dim_dir)
+    else:
+        snappy.tc_apply(prod, bands, lookup, dim_dir)
+    if lookup is not None and dim_dir != save_dir:
+        import os
+        import shutil
+        dim = snappy.readProduct('', dim_dir)
+        snappy.save(dim, save_dir, cog)
+        dim.dispose()
+        # the BEAM-DIMAP of the lookup path is only an intermediate of tif and cog
+        os.remove(dim_dir)
+        shutil.rmtree(dim_dir[:-4]+'.data', ignore_errors=True)
+    manifest.mark(save_dir, rec, 'done')
+    return save_dir
+
+def arg_parser():
+    '''
+    command line options of main
+    '''
     import argparse
     parser = argparse.ArgumentParser(description="Process a tif file.")
     parser.add_argument("-f", "--fPath", required=True, help="Path to the Sentinel-1 files")
@@ -25,11 +178,52 @@ def main():
     parser.add_argument("-d", "--dem", required=True, help="DEM name\n'CDEM' or 'Copernicus 30m Global DEM' or 'Copernicus 90m Global DEM' or'GETASSE30' or 'SRTM 1Sec Grid' or 'SRTM 1Sec HGT' or 'SRTM 3Sec'")
     parser.add_argument("-o", "--output", required=True, help="dB for deciBel\nInt for Intensity")
     parser.add_argument("-i", "--inc", required=False, help="Local incidence angle\nTrue of False")
-    parser.add_argument("-sf", "--save_format", required=True, help="tif for Geotiff Format\ndim for BEAM-DIMAP")
-    args = parser.parse_args()
+    parser.add_argument("-sf", "--save_format", required=True, help="tif for Geotiff Format\ncog for Cloud-Optimized GeoTIFF (needs GDAL)\ndim for BEAM-DIMAP\nzarr for BEAM-DIMAP appended to a chunked (time, y, x) store")
+    parser.add_argument("--store", required=False, help="Time-series store of -sf zarr\ndefault: sPath/stack.zarr")
+    parser.add_argument("--chunks", required=False, type=int, nargs=3, default=[1, 512, 512], metavar=('T', 'Y', 'X'), help="Chunk shape of new variables of -sf zarr (default: 1 512 512)")
+    parser.add_argument("--compress", required=False, default='DEFLATE', help="Compression of -sf cog\n'DEFLATE' or 'ZSTD' or 'LZW' (default: DEFLATE)")
+    parser.add_argument("--bigtiff", required=False, action='store_true', help="Always write BigTIFF with -sf cog, for large merged scenes")
+    parser.add_argument("--demDir", required=False, help="Directory of local DEM tiles\none cropped external DEM is built for all scenes")
+    parser.add_argument("--demCache", required=False, help="Directory of cached external DEMs\ndefault: sPath/dem_cache/")
+    parser.add_argument("--demQuota", required=False, type=int, help="Disk quota of the DEM cache in MB")
+    parser.add_argument("--lookup", required=False, action='store_true', help="Compute the terrain-correction geometry once for the stack\nand resample every date through it")
+    parser.add_argument("-e", "--engine", required=False, default='snap', choices=['snap', 'numpy'], help="snap for the Multilook and LinearToFromdB operators (default)\nnumpy for multilooking and dB in NumPy from the .dim files (implies --lookup)")
+    parser.add_argument("--asyncWrites", required=False, type=int, default=0, help="Number of scenes written in the background while the next ones are computed\n0 to write each scene before the next (default)\nin the daemon the writer threads of the daemon are shared by its jobs")
+    parser.add_argument("--force", required=False, action='store_true', help="Process scenes even if their outputs are up to date")
+    parser.add_argument("--trace", required=False, help="JSON lines file tracing every operator, write and scene\na Chrome trace (.json) and a summary table are written at the end")
+    parser.add_argument("--heap", required=False, help="Max JVM heap\nex) 16G")
+    parser.add_argument("--tileCache", required=False, type=int, help="JAI tile cache size in MB")
+    return parser
+
+def main(argv=None):
+    import warnings
+    import os
+    import daemon_for_oriburi as daemon
+    if not daemon.inJob():
+        # process-wide, a job of the daemon keeps the settings of the daemon
+        warnings.filterwarnings('ignore')
+    
+    args = arg_parser().parse_args(argv)
+
+    if argv is None:
+        # command line runs go to the daemon when one is running
+        import sys
+        handled, result = daemon.submitIfRunning('S1_Geocode', sys.argv[1:])
+        if handled:
+            return result
     
     import snappy_for_oriburi as snappy
+    if not daemon.inJob():
+        snappy.session.configure(args.heap, args.tileCache)
+        if args.asyncWrites:
+            snappy.setWriters(args.asyncWrites)
+    elif args.heap or args.tileCache:
+        print('--heap and --tileCache are those of the daemon for its jobs')
+    import trace_for_oriburi as trace
+    if args.trace is not None:
+        trace.enable(args.trace)
     from os import listdir
+    from concurrent.futures import wait
     import numpy as np
     
     files = np.sort(listdir(args.fPath))
@@ -41,41 +235,40 @@ def main():
             print(i)
     del files
     print('The Number of Scenes: %d' %len(pfiles))
-    
-    prod = snappy.readProduct(args.fPath, pfiles[0])
-
-    if args.ml == '1':
-        prod = snappy.multi_look(prod, 'all', args.rg, args.az)
-
-    if args.output == 'dB':
-        prod = snappy.Linear2dB(prod)
 
-    prod = snappy.terrain_correction(prod, 'all', args.dem, args.inc)
-    prod.removeBand(prod.getBand(snappy.extBandNames(prod)[1]))
+    external_dem = None
+    if args.demDir is not None:
+        demCache = args.demCache if args.demCache is not None else args.sPath+'dem_cache/'
+        external_dem = snappy.batchDEM([snappy.readProduct(args.fPath, i) for i in pfiles],
+                                       args.demDir, demCache, args.demQuota)
+    
+    lookup = None
+    if args.lookup or args.engine == 'numpy':
+        with trace.scene('lookup'):
+            lookup = geocode_lookup(args, pfiles[0], external_dem)
+    
+    with trace.scene(pfiles[0]+' (reference)'):
+        saved = [geocode_scene(args, pfiles[0], reference=True, external_dem=external_dem, lookup=lookup)]
 
-    if args.ml == '1':
-        snappy.save(prod, args.sPath+prod.getName()[0:4]+'_ml_'+args.output+'_'+'_tc.'+args.save_format)
+    for i in pfiles:
+        if args.asyncWrites:
+            # at most asyncWrites scenes in flight, each holds its chain until written
+            pending = [s for s in saved if not isinstance(s, str) and not s.done()]
+            if len(pending) >= args.asyncWrites:
+                wait(pending[0:len(pending)-args.asyncWrites+1])
+        with trace.scene(i):
+            saved.append(geocode_scene(args, i, external_dem=external_dem, lookup=lookup))
+    saved = [s if isinstance(s, str) else s.result() for s in saved]
 
-    if args.ml == '0':
-        snappy.save(prod, args.sPath+prod.getName()[0:4]+'_'+args.output+'_'+'_tc.'+args.save_format)
+    if args.save_format == 'zarr':
+        import zarr_for_oriburi as zarr
+        store = args.store if args.store is not None else args.sPath+'stack.zarr'
+        for save_dir in saved:
+            with trace.span('appendDim', 'write', store=store):
+                zarr.appendDim(store, save_dir, args.chunks)
 
-    for i in pfiles:
-        prod = snappy.readProduct(args.fPath, i)
-        
-        if args.ml == '1':
-            prod = snappy.multi_look(prod, 'all', args.rg, args.az)
-            
-        if args.output == 'dB':
-            prod = snappy.Linear2dB(prod)
-        
-        prod = snappy.terrain_correction(prod, 'all', args.dem, args.inc)
-        prod.removeBand(prod.getBand(snappy.extBandNames(prod)[0]))
-        
-        if args.ml == '1':
-            snappy.save(prod, args.sPath+prod.getName()[4::]+'_ml_'+args.output+'_'+'_tc.'+args.save_format)
-            
-        if args.ml == '0':
-            snappy.save(prod, args.sPath+prod.getName()[4::]+'_'+args.output+'_'+'_tc.'+args.save_format)
+    if args.trace is not None:
+        trace.finish(args.trace)
         
             
 if __name__ == "__main__":
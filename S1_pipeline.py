@@ -0,0 +1,360 @@
+if __name__ == "__main__":
+    print('''
+        ##############################################
+        ##############################################\n
+        Sentinel-1 Pipeline Using SNAP Software... \n
+        preprocessing -> co-registration -> geocoding
+        of every scene as soon as its inputs exist\n
+        Copyright: Seung Jun Lee
+                   Yonsei Univ. Dept. Earth System Science.
+                   Satellite Geosciences Lab.\n
+        ##############################################
+        ##############################################\n\n
+        ''')
+
+STAGES = ('preproc', 'stack', 'geocode')
+
+class Task:
+    '''
+    one stage of one scene, runnable when the tasks in deps are done
+    func is called with the results of deps and returns the saved path
+    '''
+    def __init__(self, stage, scene, func, deps=()):
+        self.stage = stage
+        self.scene = scene
+        self.func = func
+        self.deps = list(deps)
+        self.state = 'waiting'
+        self.result = None
+        self.error = None
+        self.time = 0.0
+
+    def __repr__(self):
+        return '%s %s' %(self.stage, self.scene)
+
+class Scheduler:
+    '''
+    run a DAG of tasks on a thread pool
+    limits: dict of stage and number of tasks of the stage running at the same time
+    memory: memory budget in MB of the running tasks, None for no budget
+    costs:  dict of stage and memory in MB of one task of the stage
+    downstream tasks are started first, so that scenes flow to the end
+    '''
+    def __init__(self, limits, memory=None, costs=None):
+        import threading
+        self.limits = dict(limits)
+        self.memory = memory
+        self.costs = dict(costs or {})
+        self.tasks = []
+        self.running = {stage: 0 for stage in self.limits}
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def add(self, stage, scene, func, deps=()):
+        task = Task(stage, scene, func, deps)
+        with self.cond:
+            self.tasks.append(task)
+            self.cond.notify()
+        return task
+
+    def _fits(self, task):
+        if self.running[task.stage] >= self.limits[task.stage]:
+            return False
+        if self.memory is None:
+            return True
+        # a task larger than the budget still runs, alone
+        return self.used + self.costs.get(task.stage, 0) <= self.memory or self.used == 0
+
+    def _next(self):
+        # tasks whose input failed or was not produced (e.g. outside of the AOI) are blocked
+        blocked = True
+        while blocked:
+            blocked = False
+            for task in self.tasks:
+                if task.state == 'waiting' and any(d.state in ('failed', 'blocked') or
+                                                   (d.state == 'done' and d.result is None) for d in task.deps):
+                    task.state = 'blocked'
+                    blocked = True
+
+        order = {stage: k for k, stage in enumerate(STAGES)}
+        waiting = [t for t in self.tasks if t.state == 'waiting']
+        for task in sorted(waiting, key=lambda t: -order.get(t.stage, 0)):
+            if all(d.state == 'done' for d in task.deps) and self._fits(task):
+                return task
+        return None
+
+    def _run(self, task):
+        import time
+        import traceback
+        import trace_for_oriburi as trace
+        t0 = time.time()
+        try:
+            with trace.scene(task.scene), trace.span(task.stage, 'stage'):
+                task.result = task.func(*[d.result for d in task.deps])
+            state = 'done'
+        except Exception as e:
+            traceback.print_exc()
+            task.error = repr(e)
+            state = 'failed'
+        with self.cond:
+            task.time = time.time() - t0
+            task.state = state
+            self.running[task.stage] -= 1
+            self.used -= self.costs.get(task.stage, 0)
+            self.cond.notify_all()
+        print('%s %s %s in %.1f s: %s' %(task.stage, task.scene, state, task.time,
+                                          task.result if state == 'done' else task.error))
+
+    def pending(self):
+        return [t for t in self.tasks if t.state in ('waiting', 'running')]
+
+    def run(self, watch=None, scan=None):
+        '''
+        run until every task is done, failed or blocked
+        watch: seconds between calls of scan() adding new tasks, None to stop when idle
+        '''
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        import trace_for_oriburi as trace
+
+        with ThreadPoolExecutor(max_workers=sum(self.limits.values())) as pool:
+            last = time.time()
+            with self.cond:
+                while True:
+                    task = self._next()
+                    if task is not None:
+                        task.state = 'running'
+                        self.running[task.stage] += 1
+                        self.used += self.costs.get(task.stage, 0)
+                        pool.submit(trace.bind(self._run), task)
+                        continue
+                    if watch is None and len(self.pending()) == 0:
+                        break
+                    if watch is not None and time.time() - last >= watch:
+                        self.cond.release()
+                        try:
+                            scan()
+                        finally:
+                            self.cond.acquire()
+                        last = time.time()
+                        continue
+                    self.cond.wait(timeout=watch if watch is not None else None)
+        return self.tasks
+
+def stage_args(module, options, fPath, sPath):
+    '''
+    parse the options of one stage with the parser of its script
+    '''
+    import os
+    import shlex
+    os.makedirs(sPath, exist_ok=True)
+    return module.arg_parser().parse_args(shlex.split(options) + ['-f', fPath, '-s', sPath])
+
+def list_scenes(args):
+    '''
+    Sentinel-1 files of args.fPath between args.sDate and args.eDate, by date
+    '''
+    import os
+    files = [i for i in os.listdir(args.fPath) if i[-1] == 'p']
+    files = [i for i in files if int(args.sDate) <= int(i[17:21]) <= int(args.eDate)]
+    return sorted(files, key=lambda i: i[17:32])
+
+class Pipeline:
+    '''
+    tasks of every scene: preproc -> stack against the reference -> geocode
+    the first scene is the reference of the stack, the stack of the second
+    scene is the reference of geocoding (and of its lookup)
+    '''
+    def __init__(self, args, scheduler):
+        import threading
+        import S1_preproc
+        import S1_stack
+        import S1_Geocode
+
+        self.args = args
+        self.scheduler = scheduler
+        self.pre = stage_args(S1_preproc, args.preproc + ' -sd %s -ed %s' %(args.sDate, args.eDate),
+                              args.fPath, args.sPath+'preproc/')
+        self.stack = stage_args(S1_stack, args.stack, args.sPath+'preproc/', args.sPath+'stack/')
+        self.geo = stage_args(S1_Geocode, args.geocode, args.sPath+'stack/', args.sPath+'geocode/')
+        if self.stack.batch > 1:
+            print('--batch of the stack options is ignored, scenes are stacked one by one')
+        for stage in (self.pre, self.stack, self.geo):
+            stage.force = stage.force or args.force
+
+        self.scenes = {}
+        self.lock = threading.Lock()
+        self.ref = None
+        self.ref_task = None
+        self.ref_stack = None
+        self.geo_ref = None
+        self.lookup = None
+        self.dem = None
+        self.store = None
+        if self.geo.save_format == 'zarr':
+            self.store = self.geo.store if self.geo.store is not None else self.geo.sPath+'stack.zarr'
+        self.store_lock = threading.Lock()
+
+    def _preproc(self, i):
+        import S1_preproc
+        status = S1_preproc._run_scene(self.pre, i)
+        if status['Status'] == 'failed':
+            raise RuntimeError(status['Error'])
+        return status['Output']
+
+    def _reference(self, ref_dir):
+        # the reference product and the local DEM are opened once
+        import os
+        import snappy_for_oriburi as snappy
+        with self.lock:
+            if self.ref is None:
+                self.ref = snappy.readProduct(os.path.dirname(ref_dir)+'/', os.path.basename(ref_dir))
+                print('Reference Product: %s' %self.ref.getName())
+                if self.stack.demDir is not None:
+                    # all scenes are cut to the same AOI, whose DEM is built from the reference
+                    demCache = self.stack.demCache if self.stack.demCache is not None else self.args.sPath+'dem_cache/'
+                    self.dem = snappy.batchDEM([self.ref], self.stack.demDir, demCache, self.stack.demQuota)
+        return self.ref
+
+    def _stack(self, ref_dir, sec_dir):
+        import os
+        import S1_stack
+        ref = self._reference(ref_dir)
+        stack_dir = S1_stack.stack_pair(self.stack, ref, os.path.basename(ref_dir), os.path.basename(sec_dir), self.dem)
+        if self.stack.coherence:
+            S1_stack.coherence_stack(self.stack, stack_dir)
+        return stack_dir
+
+    def _lookup(self, stack_dir):
+        import os
+        import S1_Geocode
+        return S1_Geocode.geocode_lookup(self.geo, os.path.basename(stack_dir), self.dem)
+
+    def _geocode(self, stack_dir, lookup=None, reference=False):
+        import os
+        import S1_Geocode
+        saved = S1_Geocode.geocode_scene(self.geo, os.path.basename(stack_dir), reference, self.dem, lookup)
+        saved = saved if isinstance(saved, str) else saved.result()
+        if self.store is not None:
+            self._append(saved)
+        return saved
+
+    def _append(self, save_dir):
+        # each geocoded date goes to the store as soon as it is written
+        import zarr_for_oriburi as zarr
+        import trace_for_oriburi as trace
+        with self.store_lock, trace.span('appendDim', 'write', store=self.store):
+            zarr.appendDim(self.store, save_dir, self.geo.chunks)
+
+    def add(self, i):
+        '''
+        add the tasks of scene i, the first scene added is the reference
+        '''
+        if i in self.scenes:
+            return False
+        add = self.scheduler.add
+        pre = add('preproc', i, lambda i=i: self._preproc(i))
+        self.scenes[i] = pre
+        if self.ref_task is None:
+            self.ref_task = pre
+            return True
+
+        stack = add('stack', i, self._stack, [self.ref_task, pre])
+        if self.ref_stack is None:
+            self.ref_stack = stack
+            if self.geo.lookup or self.geo.engine == 'numpy':
+                self.lookup = add('lookup', 'reference', self._lookup, [stack])
+            deps = [stack] + ([self.lookup] if self.lookup is not None else [])
+            self.geo_ref = add('geocode', self.ref_task.scene, lambda s, l=None: self._geocode(s, l, True), deps)
+        deps = [stack] + ([self.lookup] if self.lookup is not None else [])
+        add('geocode', i, lambda s, l=None: self._geocode(s, l), deps)
+        return True
+
+    def scan(self):
+        '''
+        add the tasks of new scenes in args.fPath
+        '''
+        added = [i for i in list_scenes(self.args) if self.add(i)]
+        for i in added:
+            print('New scene: %s' %i)
+        return added
+
+def arg_parser():
+    '''
+    command line options of main
+    '''
+    import argparse
+    parser = argparse.ArgumentParser(description="Preprocess, co-register and geocode Sentinel-1 scenes as one pipeline.")
+    parser.add_argument("-f", "--fPath", required=True, help="Path to the Sentinel-1 files")
+    parser.add_argument("-s", "--sPath", required=True, help="Path to the save file\npreproc/, stack/ and geocode/ are made in it")
+    parser.add_argument("-sd", "--sDate", required=True, help="Scene start Year")
+    parser.add_argument("-ed", "--eDate", required=True, help="Scene end Year")
+    parser.add_argument("--preproc", required=True, help="Options of S1_preproc.py without -f -s -sd -ed\nex) \"-p VV -m 1 -sn IW2 -o Complex -c 'POLYGON((...))'\"")
+    parser.add_argument("--stack", required=True, help="Options of S1_stack.py without -f -s\nex) \"-m 1 --coherence\"")
+    parser.add_argument("--geocode", required=True, help="Options of S1_Geocode.py without -f -s\nex) \"-m 1 -Az 1 -Rg 4 -d 'SRTM 3Sec' -o dB -sf tif\"")
+    parser.add_argument("--stageWorkers", required=False, type=int, nargs=3, default=[1, 1, 2], metavar=('PRE', 'STACK', 'GEO'), help="Tasks of each stage running at the same time (default: 1 1 2)")
+    parser.add_argument("--memory", required=False, type=int, help="Memory budget in MB of the running tasks\nshould stay below --heap")
+    parser.add_argument("--stageMemory", required=False, type=int, nargs=3, default=[6144, 8192, 2048], metavar=('PRE', 'STACK', 'GEO'), help="Memory in MB of one task of each stage with --memory (default: 6144 8192 2048)")
+    parser.add_argument("--watch", required=False, type=float, help="Keep running and look for new scenes in fPath every WATCH seconds")
+    parser.add_argument("--heap", required=False, help="Max JVM heap\nex) 32G")
+    parser.add_argument("--tileCache", required=False, type=int, help="JAI tile cache size in MB")
+    parser.add_argument("--trace", required=False, help="JSON lines file tracing every operator, write and task\na Chrome trace (.json) and a summary table are written at the end")
+    parser.add_argument("--force", required=False, action='store_true', help="Process every stage even if its outputs are up to date")
+    return parser
+
+def main(argv=None):
+    import warnings
+    import daemon_for_oriburi as daemon
+    if not daemon.inJob():
+        # process-wide, a job of the daemon keeps the settings of the daemon
+        warnings.filterwarnings('ignore')
+
+    args = arg_parser().parse_args(argv)
+
+    if argv is None:
+        # command line runs go to the daemon when one is running
+        import sys
+        handled, result = daemon.submitIfRunning('S1_pipeline', sys.argv[1:])
+        if handled:
+            return result
+
+    import snappy_for_oriburi as snappy
+    import trace_for_oriburi as trace
+    if not daemon.inJob():
+        snappy.session.configure(args.heap, args.tileCache)
+    elif args.heap or args.tileCache:
+        print('--heap and --tileCache are those of the daemon for its jobs')
+    if args.trace is not None:
+        trace.enable(args.trace)
+
+    limits = dict(zip(STAGES, args.stageWorkers))
+    limits['lookup'] = 1
+    costs = dict(zip(STAGES, args.stageMemory))
+    costs['lookup'] = costs['geocode']
+    scheduler = Scheduler(limits, args.memory, costs)
+    pipeline = Pipeline(args, scheduler)
+    pipeline.scan()
+    print('The Number of Scenes: %d' %len(pipeline.scenes))
+
+    try:
+        tasks = scheduler.run(args.watch, pipeline.scan)
+    except KeyboardInterrupt:
+        print('Stopped, running tasks are completed')
+        tasks = scheduler.tasks
+
+    print('')
+    for stage in STAGES + ('lookup',):
+        states = [t.state for t in tasks if t.stage == stage]
+        if len(states) > 0:
+            print('%-8s done: %d  failed: %d  blocked: %d' %(stage, states.count('done'), states.count('failed'), states.count('blocked')))
+    for task in tasks:
+        if task.state == 'failed':
+            print('failed: %s (%s)' %(task, task.error))
+
+    if args.trace is not None:
+        trace.finish(args.trace)
+    return [{'Stage': t.stage, 'Scene': t.scene, 'Status': t.state, 'Output': t.result} for t in tasks]
+
+if __name__ == "__main__":
+
+    main()
@@ -1,4 +1,5 @@
-print('''
+if __name__ == "__main__":
+    print('''
         ##############################################
         ##############################################\n
         Sentinel-1 Preproc Script for SLC Data Using SNAP Software... \n
@@ -13,114 +14,371 @@ print('''
         ##############################################\n\n
         ''')
 
-def main():
-    import warnings
+def scene_output(args, i):
+    '''
+    path of the product saved for scene i
+    '''
+    if args.mode == '1':
+        if args.output == 'Complex':
+            return args.sPath+i[17:17+8]+'_cpx_split_orb_cal.dim'
+        return args.sPath+i[17:17+8]+'-'+args.output+'_split_orb_cal.dim'
+    if args.mode == '2':
+        return args.sPath+i[17:17+8]+'_'+args.output+'_split_orb_cal_mrg.dim'
+
+def scene_record(args, i):
+    '''
+    inputs, parameters and library version that make the output of scene i
+    '''
+    import manifest_for_oriburi as manifest
+    import snappy_for_oriburi as snappy
+    parameters = {k: getattr(args, k) for k in ['mode', 'pol', 'sNum', 'burstStart', 'burstEnd', 'output', 'cut', 'orbitDir', 'orbitOrder']}
+    return manifest.record([args.fPath+i], parameters, snappy.processingVersion())
+
+def scene_orbits(args):
+    '''
+    local orbit store of args.orbitDir, None for downloading orbits
+    '''
+    if args.orbitDir is None:
+        return None
+    import orbit_for_oriburi as orbit
+    return orbit.loadOrbitIndex(args.orbitDir, args.orbitOrder.split(','))
+
+def scene_bursts(args, i):
+    '''
+    subswaths and (first_burst, last_burst) of scene i to be processed
+    with burstStart/burstEnd 'auto' only the bursts intersecting args.cut are kept
+    '''
+    swaths = ['IW1', 'IW2', 'IW3'] if args.mode == '2' else [args.sNum]
+    if args.burstStart != 'auto' and args.burstEnd != 'auto':
+        return {j: (args.burstStart, args.burstEnd) for j in swaths}
+
+    import catalogue_for_oriburi as catalogue
+    if args.cut == 'none':
+        raise ValueError('burstStart/burstEnd auto needs the AOI in --cut')
+    bursts = catalogue.burstsForAOI(args.fPath+i, args.cut, args.pol)
+    bursts = {j: (str(bursts[j][0]), str(bursts[j][1])) for j in swaths if j in bursts}
+    for j in bursts:
+        print('%s: burst %s to %s' %(j, bursts[j][0], bursts[j][1]))
+    return bursts
+
+def preproc_scene(args, i):
+    '''
+    preprocess a single scene i in args.fPath and return the saved path
+    None if no burst of the scene intersects the AOI
+    '''
+    import snappy_for_oriburi as snappy
+
+    bursts = scene_bursts(args, i)
+    if len(bursts) == 0:
+        print('%s does not intersect the AOI' %i)
+        return None
+
+    graph = None
+    if args.graph:
+        graph = snappy.Graph(q=args.parallelism, c=args.tileCache)
+    orbits = scene_orbits(args)
+
+    if args.mode == '1':
+        prod = snappy.readProduct(args.fPath,i,graph)
+        split = snappy.TOPS_split(prod, args.pol, args.sNum, *bursts[args.sNum])
+        del prod
+
+        orb = snappy.s1_orb(split, '0', orbits)
+        del split
+
+        cal = snappy.calibration(orb, 'all', args.pol, args.output)
+        del orb
+
+        if args.output == 'Complex':
+            save_dir = scene_output(args, i)
+            snappy.save(cal, save_dir)
+            del cal
+            return save_dir
+
+        deb = snappy.deburst(cal, args.pol)
+        del cal
+
+        subset = snappy.subset_wkt(deb, args.cut)
+        del deb
+
+        save_dir = scene_output(args, i)
+        snappy.save(subset, save_dir)
+        del subset
+        return save_dir
+
+    if args.mode == '2':
+        import shutil
+        import tempfile
+
+        tmp_dir = None
+        if args.swathParallel and graph is None:
+            tmp_dir = tempfile.mkdtemp(prefix='.'+i[17:17+8]+'_', dir=args.sPath)
+        try:
+            if tmp_dir is not None:
+                deb = [snappy.readProduct(tmp_dir+'/', j) for j in preproc_swaths(args, i, tmp_dir, bursts)]
+            else:
+                prod = snappy.readProduct(args.fPath,i,graph)
+                deb = []
+                for j in sorted(bursts):
+                    deb.append(_swath_chain(prod, args, j, *bursts[j], orbits))
+                del prod
+
+            if len(deb) > 1:
+                merge = snappy.TOPS_merge(*deb)
+            else:
+                merge = deb[0]
+            del deb
+
+            subset = snappy.subset_wkt(merge, args.cut)
+            del merge
+
+            save_dir = scene_output(args, i)
+            snappy.save(subset, save_dir)
+            del subset
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return save_dir
+
+def _swath_chain(prod, args, swath, first_burst, last_burst, orbits):
+    '''
+    split-orbit-calibration-deburst chain of a single subswath
+    orbits: orbit store of scene_orbits, shared by the subswaths of a scene
+    '''
+    import snappy_for_oriburi as snappy
+
+    split = snappy.TOPS_split(prod, args.pol, swath, first_burst, last_burst)
+    orb = snappy.s1_orb(split, '0', orbits)
+    del split
+    cal = snappy.calibration(orb, 'all', args.pol, args.output)
+    del orb
+    return snappy.deburst(cal, args.pol)
+
+def _preproc_swath(args, i, swath, first_burst, last_burst, tmp_dir):
+    '''
+    materialize the debursted subswath of scene i in tmp_dir
+    '''
+    import snappy_for_oriburi as snappy
+    import trace_for_oriburi as trace
+
+    with trace.scene(i+' '+swath):
+        prod = snappy.readProduct(args.fPath,i)
+        deb = _swath_chain(prod, args, swath, first_burst, last_burst, scene_orbits(args))
+        name = swath+'_split_orb_cal_deb.dim'
+        snappy.save(deb, tmp_dir+'/'+name)
+    return name
+
+def preproc_swaths(args, i, tmp_dir, bursts):
+    '''
+    run the subswath branches of scene i concurrently
+    bursts: dict of swath and (first_burst, last_burst)
+    each branch runs in its own JVM with an equal share of args.memory
+    '''
+    import os
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import trace_for_oriburi as trace
+
+    swaths = sorted(bursts)
+    heap = None
+    tile_cache = args.tileCache
+    if args.memory is not None:
+        heap = '%dm' %(args.memory//len(swaths))
+        tile_cache = args.memory//len(swaths)//2
+    parallelism = max(1, (os.cpu_count() or 1)//(len(swaths)*args.workers))
+
+    with ProcessPoolExecutor(max_workers=len(swaths),
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(heap, tile_cache, parallelism, trace.tracePath())) as pool:
+        futures = [pool.submit(_preproc_swath, args, i, j, bursts[j][0], bursts[j][1], tmp_dir) for j in swaths]
+        return [f.result() for f in futures]
+
+def _init_worker(heap, tile_cache, parallelism, trace_path=None):
+    '''
+    configure the JVM budget of a worker process, started on its first scene
+    trace_path: trace file of the parent, None when it is not traced
+    '''
+    import snappy_for_oriburi as snappy
+    snappy.session.configure(heap, tile_cache, parallelism)
+    if trace_path is not None:
+        import trace_for_oriburi as trace
+        trace.enable(trace_path, truncate=False)
+
+def _run_scene(args, i):
+    '''
+    preprocess scene i and report its status instead of raising
+    '''
     import os
-    warnings.filterwarnings('ignore')
-    
+    import time
+    import traceback
+    import manifest_for_oriburi as manifest
+    import trace_for_oriburi as trace
+    t0 = time.time()
+    i = str(i)
+    save_dir = scene_output(args, i)
+    rec = None
+    try:
+        rec = scene_record(args, i)
+        if not args.force and manifest.isDone(save_dir, rec):
+            return {'Scene': i, 'Status': 'skipped', 'Output': save_dir, 'Time': time.time()-t0}
+        previous = manifest.readManifest(save_dir)
+        if previous is not None and previous.get('Status') == 'running':
+            print('resuming unfinished scene %s' %i)
+        manifest.mark(save_dir, rec, 'running')
+        with trace.scene(i):
+            saved = preproc_scene(args, i)
+        if saved is None:
+            os.remove(manifest.manifestPath(save_dir))
+            return {'Scene': i, 'Status': 'skipped', 'Output': None, 'Time': time.time()-t0}
+        manifest.mark(save_dir, rec, 'done')
+        return {'Scene': i, 'Status': 'done', 'Output': save_dir, 'Time': time.time()-t0}
+    except Exception as e:
+        traceback.print_exc()
+        if rec is not None and os.path.exists(manifest.manifestPath(save_dir)):
+            manifest.mark(save_dir, rec, 'failed', Error=repr(e))
+        return {'Scene': i, 'Status': 'failed', 'Error': repr(e), 'Time': time.time()-t0}
+
+def _print_status(status, n, total):
+    if status['Status'] in ['done', 'skipped']:
+        print('[%d/%d] %s %s in %.1f s: %s' %(n, total, status['Scene'], status['Status'], status['Time'], status['Output']))
+    else:
+        print('[%d/%d] %s failed in %.1f s: %s' %(n, total, status['Scene'], status['Time'], status['Error']))
+
+def run_workers(args, pfiles):
+    '''
+    spread scenes over args.workers processes, each with its own JVM
+    '''
+    import os
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+    import trace_for_oriburi as trace
+
+    parallelism = max(1, (os.cpu_count() or 1)//args.workers)
+    pool = ProcessPoolExecutor(max_workers=args.workers,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker,
+                               initargs=(args.heap, args.tileCache, parallelism, trace.tracePath()))
+    futures = {pool.submit(_run_scene, args, i): i for i in pfiles}
+    statuses = []
+    for future in as_completed(futures):
+        try:
+            status = future.result()
+        except BrokenProcessPool as e:
+            status = {'Scene': futures[future], 'Status': 'failed', 'Error': repr(e), 'Time': 0.0}
+        statuses.append(status)
+        _print_status(status, len(statuses), len(pfiles))
+    pool.shutdown()
+    return statuses
+
+def arg_parser():
+    '''
+    command line options of main
+    '''
     import argparse
     parser = argparse.ArgumentParser(description="Process a tif file.")
     parser.add_argument("-f", "--fPath", required=True, help="Path to the Sentinel-1 files")
     parser.add_argument("-s", "--sPath", required=True, help="Path to the save file")
     parser.add_argument("-sd", "--sDate", required=True, help="Scene start Year")
     parser.add_argument("-ed", "--eDate", required=True, help="Scene end Year")
-    parser.add_argument("-bs", "--burstStart", required=True, help="Start Burst Number")
-    parser.add_argument("-be", "--burstEnd", required=True, help="End Burst Number")
+    parser.add_argument("-bs", "--burstStart", required=False, default='auto', help="Start Burst Number\nauto for the bursts intersecting --cut")
+    parser.add_argument("-be", "--burstEnd", required=False, default='auto', help="End Burst Number\nauto for the bursts intersecting --cut")
     parser.add_argument("-p", "--pol", required=True, help="Polarisation")
     parser.add_argument("-m", "--mode", required=True, help="mode 1: Single \nmode 2:All Swaths")
     parser.add_argument("-sn", "--sNum", required=False, help="Swath Number if mode==1\nIW1 or IW2 or IW3")
     parser.add_argument("-o", "--output", required=True, help="Complex or Sigma0 or Gamma0 or Beta0")
     parser.add_argument("-c", "--cut", required=True, help="Polygon of Subset Area (WKT)\nnone for nothing")
-    args = parser.parse_args()
-    
-    import snappy_for_oriburi as snappy
+    parser.add_argument("-w", "--workers", required=False, type=int, default=1, help="Number of scenes processed in parallel\neach worker starts its own JVM")
+    parser.add_argument("--heap", required=False, help="Max JVM heap per worker\nex) 16G")
+    parser.add_argument("--tileCache", required=False, type=int, help="JAI tile cache size per worker in MB")
+    parser.add_argument("--swathParallel", required=False, action='store_true', help="mode 2: process IW1, IW2 and IW3 concurrently before TOPSAR-Merge")
+    parser.add_argument("--memory", required=False, type=int, help="Memory budget in MB shared by the concurrent swath branches of a scene")
+    parser.add_argument("-g", "--graph", required=False, action='store_true', help="Run each scene as a single SNAP graph with gpt\nthe graph is saved next to the output")
+    parser.add_argument("--catalogue", required=False, help="SQLite scene catalogue updated from fPath and used to select scenes\nex) /path/to/catalogue.sqlite")
+    parser.add_argument("--track", required=False, type=int, help="Relative orbit number with --catalogue")
+    parser.add_argument("--passDirection", required=False, help="ASCENDING or DESCENDING with --catalogue")
+    parser.add_argument("--orbitDir", required=False, help="Directory of POEORB/RESORB .EOF files used instead of downloading orbits")
+    parser.add_argument("--orbitOrder", required=False, default='POEORB,RESORB', help="Orbit types tried in order with --orbitDir")
+    parser.add_argument("--force", required=False, action='store_true', help="Process scenes even if their outputs are up to date")
+    parser.add_argument("-q", "--parallelism", required=False, type=int, help="Number of gpt tile scheduler threads with --graph")
+    parser.add_argument("--trace", required=False, help="JSON lines file tracing every operator, write and scene\na Chrome trace (.json) and a summary table are written at the end")
+    return parser
+
+def main(argv=None):
+    import warnings
+    import os
+    import daemon_for_oriburi as daemon
+    if not daemon.inJob():
+        # process-wide, a job of the daemon keeps the settings of the daemon
+        warnings.filterwarnings('ignore')
+
+    args = arg_parser().parse_args(argv)
+
+    if argv is None:
+        # command line runs go to the daemon when one is running
+        import sys
+        handled, result = daemon.submitIfRunning('S1_preproc', sys.argv[1:])
+        if handled:
+            return result
+
+    import trace_for_oriburi as trace
+    if args.trace is not None:
+        trace.enable(args.trace)
+
     from os import listdir
     import numpy as np
-    
-    files = np.sort(listdir(args.fPath))
-    pfiles = []
-    for i in files:
-        if i[-1] == 'p':
-            if (int(i[17:21]) >= int(args.sDate)) and (int(i[17:21]) <= int(args.eDate)):
-                pfiles.append(i)
-                print(i)
-        else: continue
-    del files
-    
+
+    if args.catalogue is not None:
+        import catalogue_for_oriburi as catalogue
+        print('New or changed products in catalogue: %d' %catalogue.updateCatalogue(args.catalogue, args.fPath))
+        scenes = catalogue.selectScenes(args.catalogue, start=args.sDate+'0101', end=args.eDate+'1231',
+                                        relative_orbit=args.track, pass_direction=args.passDirection,
+                                        aoi=None if args.cut == 'none' else args.cut, directory=args.fPath)
+        pfiles = []
+        for row in scenes:
+            # the catalogue holds .zip and .SAFE products only
+            pfiles.append(row['name'])
+            print(row['name'])
+        del scenes
+    else:
+        files = np.sort(listdir(args.fPath))
+        pfiles = []
+        for i in files:
+            if i[-1] == 'p':
+                if (int(i[17:21]) >= int(args.sDate)) and (int(i[17:21]) <= int(args.eDate)):
+                    pfiles.append(i)
+                    print(i)
+            else: continue
+        del files
+
     print('\nThe Number of Scenes: %d' %(len(pfiles)))
     print('Start Year: %s' %(args.sDate))
     print('End   Year: %s' %(args.eDate))
     print('Mode: %s' %(args.mode))
-    
-    if args.mode == '1':
-        for i in pfiles:
-            prod = snappy.readProduct(args.fPath,i)
-            split = snappy.TOPS_split(prod, args.pol, args.sNum, args.burstStart, args.burstEnd)
-            del prod
-            
-            orb = snappy.s1_orb(split, '0')
-            del split
-            
-            cal = snappy.calibration(orb, 'all', args.pol, args.output)
-            del split
-            
-            if args.output == 'Complex':
-                snappy.save(cal, args.sPath+i[17:17+8]+'_cpx_split_orb_cal.dim')
-                del cal
-                continue
-            
-            deb = snappy.deburst(cal, args.pol)
-            del cal
-            
-            subset = snappy.subset_wkt(deb, args.cut)
-            del deb
-            
-            snappy.save(subset, args.sPath+i[17:17+8]+'-'+args.output+'_split_orb_cal.dim')
-            del subset
-            
-    if args.mode == '2':
-        from esa_snappy import HashMap, GPF
+    print('Workers: %d' %(args.workers))
+
+    if args.workers > 1:
+        statuses = run_workers(args, pfiles)
+    else:
+        if not daemon.inJob():
+            _init_worker(args.heap, args.tileCache, None)
+        elif args.heap or args.tileCache:
+            print('--heap and --tileCache are those of the daemon for its jobs')
+        statuses = []
         for i in pfiles:
-            prod = snappy.readProduct(args.fPath,i)
-            
-            split = []
-            split.append(snappy.TOPS_split(prod, args.pol, 'IW1', args.burstStart, args.burstEnd))
-            split.append(snappy.TOPS_split(prod, args.pol, 'IW2', args.burstStart, args.burstEnd))
-            split.append(snappy.TOPS_split(prod, args.pol, 'IW3', args.burstStart, args.burstEnd))
-            del prod
-            
-            orb = []
-            for j in range(3):
-                orb.append(snappy.s1_orb(split[j], '0'))
-            del split
-            
-            cal = []
-            for j in range(3):
-                cal.append(snappy.calibration(orb[j], 'all', args.pol, args.output))
-            del orb
-            
-            
-            deb = []
-            for j in range(3):
-                deb.append(snappy.deburst(cal[j], args.pol))
-            del cal
-            
-            sourceProducts= HashMap()
-            sourceProducts.put('masterProduct', deb[0])
-            sourceProducts.put('slaveProduct1', deb[1])
-            sourceProducts.put('slaveProduct2', deb[2])
-            parameters = HashMap()
-
-            merge = GPF.createProduct("TOPSAR-Merge", parameters, sourceProducts)
-            
-            del deb
-            
-            subset = snappy.subset_wkt(merge, args.cut)
-            del merge
-            
-            snappy.save(subset, args.sPath+i[17:17+8]+'_'+args.output+'_split_orb_cal_mrg.dim')
-            del subset
+            statuses.append(_run_scene(args, i))
+            _print_status(statuses[-1], len(statuses), len(pfiles))
+
+    failed = [s['Scene'] for s in statuses if s['Status'] == 'failed']
+    skipped = [s['Scene'] for s in statuses if s['Status'] == 'skipped']
+    print('\nProcessed: %d  Skipped: %d  Failed: %d' %(len(statuses)-len(failed)-len(skipped), len(skipped), len(failed)))
+    for i in failed:
+        print('failed: %s' %i)
+    if args.trace is not None:
+        trace.finish(args.trace)
+    return statuses
 
 if __name__ == "__main__":
-    
-    main()
\ No newline at end of file
+
+    main()
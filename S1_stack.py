@@ -1,4 +1,5 @@
-print('''
+if __name__ == "__main__":
+    print('''
         ##############################################
         ##############################################\n
         Sentinel-1 Co-Registration Using SNAP Software... \n
@@ -15,19 +16,144 @@ print('''
         ##############################################\n\n
         ''')
 
-def main():
-    import warnings
-    import os
-    warnings.filterwarnings('ignore')
-    
+def stack_pair(args, ref, ref_file, i, external_dem=None):
+    '''
+    coregister secondary i to the reference product and return the saved path
+    '''
+    import snappy_for_oriburi as snappy
+    import manifest_for_oriburi as manifest
+
+    prod = snappy.readProduct(args.fPath, i)
+    save_dir = args.sPath+ref.getName()[0:4]+'_'+prod.getName()+'_stack.dim'
+
+    rec = manifest.record([args.fPath+ref_file, args.fPath+i], {'mode': args.mode, 'dem': external_dem}, snappy.processingVersion())
+    if not args.force and manifest.isDone(save_dir, rec):
+        print('skip %s: %s is up to date' %(i, save_dir))
+        return save_dir
+    manifest.mark(save_dir, rec, 'running')
+
+    if args.mode == '1':
+        stack = snappy.backgeocoding(ref, prod, external_dem)
+
+    if args.mode == '2':
+        stack = snappy.stack_corr(ref, prod)
+
+    if args.mode == '3':
+        stack = snappy.stack_dem(ref, prod, external_dem)
+
+    snappy.save(stack, save_dir)
+    manifest.mark(save_dir, rec, 'done')
+    return save_dir
+
+def stack_batch(args, ref, ref_file, files, external_dem=None):
+    '''
+    coregister the secondaries in files to the reference in one operator call
+    and return the saved path; the reference bands are written once per batch
+    '''
+    import snappy_for_oriburi as snappy
+    import manifest_for_oriburi as manifest
+
+    prods = [snappy.readProduct(args.fPath, i) for i in files]
+    save_dir = args.sPath+ref.getName()[0:4]+'_'+prods[0].getName()+'_'+prods[-1].getName()[0:8]+'_stack.dim'
+
+    rec = manifest.record([args.fPath+ref_file]+[args.fPath+i for i in files], {'mode': args.mode, 'dem': external_dem}, snappy.processingVersion())
+    if not args.force and manifest.isDone(save_dir, rec):
+        print('skip %s: %s is up to date' %(', '.join(files), save_dir))
+        return save_dir
+    manifest.mark(save_dir, rec, 'running')
+
+    print('Coregistering %d secondaries' %len(prods))
+    if args.mode == '1':
+        stack = snappy.backgeocoding(ref, prods, external_dem)
+
+    if args.mode == '2':
+        stack = snappy.stack_corr(ref, prods)
+
+    if args.mode == '3':
+        stack = snappy.stack_dem(ref, prods, external_dem)
+
+    snappy.save(stack, save_dir)
+    manifest.mark(save_dir, rec, 'done')
+    return save_dir
+
+def coherence_stack(args, stack_dir):
+    '''
+    estimate the coherence of every secondary of a saved stack with NumPy
+    and return the saved path
+    '''
+    import snappy_for_oriburi as snappy
+    import manifest_for_oriburi as manifest
+    import numpy_for_oriburi as engine
+
+    save_dir = stack_dir[:-4]+'_coh.dim'
+    phase_dir = None
+    inputs = [stack_dir]
+    if args.phase is not None:
+        import os
+        phase_dir = os.path.join(args.phase, os.path.basename(stack_dir)[:-4]+'_phase.dim')
+        if not os.path.exists(phase_dir):
+            raise FileNotFoundError('no phase screen %s for %s' %(phase_dir, stack_dir))
+        inputs.append(phase_dir)
+    rec = manifest.record(inputs, {'cohWin': args.cohWin}, snappy.processingVersion())
+    if not args.force and manifest.isDone(save_dir, rec):
+        print('skip coherence: %s is up to date' %save_dir)
+        return save_dir
+    manifest.mark(save_dir, rec, 'running')
+
+    import trace_for_oriburi as trace
+    with trace.span('coherenceDim', 'write', output=save_dir):
+        engine.coherenceDim(stack_dir, save_dir, args.cohWin[0], args.cohWin[1], phase_dir, workers=args.workers)
+    manifest.mark(save_dir, rec, 'done')
+    return save_dir
+
+def arg_parser():
+    '''
+    command line options of main
+    '''
     import argparse
     parser = argparse.ArgumentParser(description="Process a tif file.")
     parser.add_argument("-f", "--fPath", required=True, help="Path to the Sentinel-1 files")
     parser.add_argument("-s", "--sPath", required=True, help="Path to the save file")
     parser.add_argument("-m", "--mode", required=True, help="mode 1: S1 Back-Geocoding\nmode 2:Cross-Correlation Co-registration\nmode 3:DEM-Assisted Co-registration")
-    args = parser.parse_args()
+    parser.add_argument("--demDir", required=False, help="Directory of local DEM tiles\none cropped external DEM is built for all scenes")
+    parser.add_argument("--demCache", required=False, help="Directory of cached external DEMs\ndefault: sPath/dem_cache/")
+    parser.add_argument("--demQuota", required=False, type=int, help="Disk quota of the DEM cache in MB")
+    parser.add_argument("-b", "--batch", required=False, type=int, default=1, help="Number of secondaries coregistered in one pass\n1 for one stack per pair (default)")
+    parser.add_argument("--coherence", required=False, action='store_true', help="Estimate the coherence of every stack with NumPy (numpy_for_oriburi.py)\nsaved as <stack>_coh.dim\nwithout --phase the flat-earth and topographic fringes are kept and the coherence is biased low")
+    parser.add_argument("--phase", required=False, help="Directory of phase screens for --coherence, <stack>_phase.dim per stack\nflat-earth and topographic phase in radians on the stack grid, one band per coherence band or one band for all")
+    parser.add_argument("--cohWin", required=False, type=int, nargs=2, default=[10, 3], metavar=('RG', 'AZ'), help="Coherence window size in range and azimuth (default: 10 3)")
+    parser.add_argument("--workers", required=False, type=int, help="Threads of the coherence estimation\ndefault: number of CPUs")
+    parser.add_argument("--force", required=False, action='store_true', help="Process pairs even if their outputs are up to date")
+    parser.add_argument("--trace", required=False, help="JSON lines file tracing every operator, write and scene\na Chrome trace (.json) and a summary table are written at the end")
+    parser.add_argument("--heap", required=False, help="Max JVM heap\nex) 16G")
+    parser.add_argument("--tileCache", required=False, type=int, help="JAI tile cache size in MB")
+    return parser
+
+def main(argv=None):
+    import warnings
+    import os
+    import daemon_for_oriburi as daemon
+    if not daemon.inJob():
+        # process-wide, a job of the daemon keeps the settings of the daemon
+        warnings.filterwarnings('ignore')
+    
+    args = arg_parser().parse_args(argv)
+
+    if argv is None:
+        # command line runs go to the daemon when one is running
+        import sys
+        handled, result = daemon.submitIfRunning('S1_stack', sys.argv[1:])
+        if handled:
+            return result
     
     import snappy_for_oriburi as snappy
+    if not daemon.inJob():
+        snappy.session.configure(args.heap, args.tileCache)
+    elif args.heap or args.tileCache:
+        print('--heap and --tileCache are those of the daemon for its jobs')
+    import trace_for_oriburi as trace
+    if args.trace is not None:
+        trace.enable(args.trace)
     from os import listdir
     import numpy as np
     
@@ -40,22 +166,34 @@ def main():
             print(i)
     del files
     print('The Number of Scenes: %d' %len(pfiles))
+
+    external_dem = None
+    if args.demDir is not None:
+        demCache = args.demCache if args.demCache is not None else args.sPath+'dem_cache/'
+        external_dem = snappy.batchDEM([snappy.readProduct(args.fPath, i) for i in pfiles],
+                                       args.demDir, demCache, args.demQuota)
         
+    if args.coherence and args.phase is None:
+        print('--coherence without --phase keeps the flat-earth and topographic fringes of the stacks,\n'
+              'the coherence is biased low and does not replace the Coherence operator of SNAP')
+
     ref = snappy.readProduct(args.fPath, pfiles[0])
     print('Reference Product: %s' %ref.getName())
-    for i in pfiles[1::]:
-        prod = snappy.readProduct(args.fPath, i)
-        if args.mode == '1':
-            stack = snappy.backgeocoding(ref, prod)
-            snappy.save(stack, args.sPath+ref.getName()[0:4]+'_'+prod.getName()+'_stack.dim')
-        
-        if args.mode == '2':
-            stack = snappy.stack_corr(ref, prod)
-            snappy.save(stack, args.sPath+ref.getName()[0:4]+'_'+prod.getName()+'_stack.dim')
-    
-        if args.mode == '3':
-            stack = snappy.stack_dem(ref, prod)
-            snappy.save(stack, args.sPath+ref.getName()[0:4]+'_'+prod.getName()+'_stack.dim')
+    if args.batch > 1:
+        for k in range(1, len(pfiles), args.batch):
+            with trace.scene(','.join(pfiles[k:k+args.batch])):
+                stack_dir = stack_batch(args, ref, pfiles[0], pfiles[k:k+args.batch], external_dem)
+                if args.coherence:
+                    coherence_stack(args, stack_dir)
+    else:
+        for i in pfiles[1::]:
+            with trace.scene(i):
+                stack_dir = stack_pair(args, ref, pfiles[0], i, external_dem)
+                if args.coherence:
+                    coherence_stack(args, stack_dir)
+
+    if args.trace is not None:
+        trace.finish(args.trace)
             
 if __name__ == "__main__":
     
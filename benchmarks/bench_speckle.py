@@ -0,0 +1,81 @@
+# ####################################################################
+# ####                                                               #
+# ####    bench_speckle                                              #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Speckle filters of numpy_for_oriburi against Speckle-Filter of SNAP
+# across kernel sizes. Without --dim a synthetic single-look intensity
+# image is filtered by the NumPy engine only.
+#
+# ex) python benchmarks/bench_speckle.py --dim /path/to/stack.dim --band Sigma0_VV --snap
+
+import os
+import sys
+import time
+import json
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def bench_numpy(band, filter_name, kernel_size, args):
+    out = np.empty(band.shape, np.float32)
+    t0 = time.perf_counter()
+    engine.speckle_filter(band, filter_name, kernel_size, out, args.tile, args.workers)
+    return time.perf_counter() - t0, out
+
+def bench_snap(dim, bandName, filter_name, kernel_size):
+    prod = snappy.readProduct(os.path.dirname(dim)+'/', os.path.basename(dim))
+    t0 = time.perf_counter()
+    filtered = snappy.speckle_filter(prod, bandName, filter_name, str(kernel_size))
+    out = snappy.extBand(filtered, snappy.extBandNames(filtered)[0])
+    return time.perf_counter() - t0, out
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark of the speckle filters")
+    parser.add_argument("--dim", required=False, help="BEAM-DIMAP product to filter\ndefault: synthetic 4096 x 4096 image")
+    parser.add_argument("--band", required=False, help="Intensity band of --dim")
+    parser.add_argument("--kernels", required=False, type=int, nargs='+', default=[3, 5, 7, 11, 15, 21])
+    parser.add_argument("--filters", required=False, nargs='+', default=['BOXCAR', 'Lee', 'Lee Sigma'])
+    parser.add_argument("--tile", required=False, type=int, default=512, help="Tile size of the NumPy engine")
+    parser.add_argument("--workers", required=False, type=int, help="Threads of the NumPy engine\ndefault: number of CPUs")
+    parser.add_argument("--snap", required=False, action='store_true', help="Also run Speckle-Filter of SNAP (needs esa_snappy and --dim)")
+    parser.add_argument("--json", required=False, help="Save the results as JSON")
+    args = parser.parse_args()
+
+    import numpy_for_oriburi as engine
+    if args.snap:
+        import snappy_for_oriburi as snappy
+
+    if args.dim is not None:
+        import dimap_for_oriburi as dimap
+        band = dimap.dimBand(args.dim, args.band)
+    else:
+        band = np.random.default_rng(0).gamma(1.0, 1.0, (4096, 4096)).astype(np.float32)
+    print('Image: %d x %d' %(band.shape[1], band.shape[0]))
+
+    results = []
+    print('%-10s %6s %10s %10s %10s' %('Filter', 'Kernel', 'NumPy [s]', 'SNAP [s]', 'Max diff'))
+    for filter_name in args.filters:
+        for kernel_size in args.kernels:
+            t_numpy, out = bench_numpy(band, filter_name, kernel_size, args)
+            t_snap, diff = None, None
+            if args.snap and args.dim is not None:
+                t_snap, ref = bench_snap(args.dim, args.band, filter_name, kernel_size)
+                diff = float(np.nanmax(np.abs(out - ref)))
+            results.append({'Filter': filter_name, 'Kernel': kernel_size,
+                            'NumPy': t_numpy, 'SNAP': t_snap, 'Max diff': diff})
+            print('%-10s %6d %10.3f %10s %10s' %(filter_name, kernel_size, t_numpy,
+                  '-' if t_snap is None else '%.3f' %t_snap, '-' if diff is None else '%.3g' %diff))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
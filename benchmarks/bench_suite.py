@@ -0,0 +1,282 @@
+# ####################################################################
+# ####                                                               #
+# ####    bench_suite                                                #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Time and peak memory of snappy_for_oriburi wrappers, the NumPy engines
+# and the S1_stack/S1_Geocode driver loops at several scene sizes.
+# Without --snap the stub esa_snappy of benchmarks/stub is used with
+# synthetic products, so the suite runs on any Linux box with NumPy.
+# With --snap the real esa_snappy and SNAP operators are used.
+#
+# Results are compared with a baseline file; a case slower or larger than
+# its baseline by more than --tolerance fails the run (exit code 1).
+# With --snap the radiometry of numpy_for_oriburi is also compared with the
+# Multilook and LinearToFromdB operators of SNAP, and a band outside
+# LINEAR_RTOL / DB_ATOL of numpy_for_oriburi fails the run as well.
+#
+# ex) python benchmarks/bench_suite.py --save          (record baselines of this machine)
+#     python benchmarks/bench_suite.py                 (compare with them)
+#     python benchmarks/bench_suite.py --snap --sizes 2048
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+#%% cases
+
+
+def _inputs(ctx, n, complex=False):
+    # n synthetic products written as .dim, 12 days apart
+    import esa_snappy
+    folder = os.path.join(ctx['tmp'], 'in_%s_%d_%d' %('cpx' if complex else 'int', ctx['size'], n))
+    if os.path.exists(folder):
+        return folder
+    os.makedirs(folder)
+    dates = ['12Jan2021', '24Jan2021', '05Feb2021', '17Feb2021', '01Mar2021', '13Mar2021']
+    for k in range(n):
+        date = dates[k]
+        name = '2021%s%s_cal' %({'Jan': '01', 'Feb': '02', 'Mar': '03'}[date[2:5]], date[0:2])
+        prod = esa_snappy.syntheticProduct(name, ctx['size'], ctx['size'], ('VV',) if complex else ('Sigma0_VV',),
+                                           complex, seed=k, date=date)
+        esa_snappy.ProductIO.writeProduct(prod, os.path.join(folder, name + '.dim'), 'BEAM-DIMAP')
+    return folder
+
+def _product(ctx):
+    import snappy_for_oriburi as snappy
+    folder = _inputs(ctx, 1)
+    return snappy.readProduct(folder + '/', sorted(f for f in os.listdir(folder) if f.endswith('.dim'))[0])
+
+def case_extBandNames(ctx):
+    import snappy_for_oriburi as snappy
+    prod = ctx['product']
+    for _ in range(1000):
+        snappy.extBandNames(prod)
+
+def case_extBand(ctx):
+    import snappy_for_oriburi as snappy
+    prod = ctx['product']
+    snappy.extBand(prod, snappy.extBandNames(prod)[0])
+
+def case_extTiles(ctx):
+    import snappy_for_oriburi as snappy
+    prod = ctx['product']
+    for _ in snappy.extTiles(prod, snappy.extBandNames(prod)[0], 512):
+        pass
+
+def case_extBands(ctx):
+    import snappy_for_oriburi as snappy
+    folder = _inputs(ctx, 3)
+    prods = [snappy.readProduct(folder + '/', f) for f in sorted(os.listdir(folder)) if f.endswith('.dim')]
+    snappy.extBands(prods, snappy.extBandNames(prods[0])[0])
+
+def case_save(ctx):
+    import snappy_for_oriburi as snappy
+    snappy.save(ctx['product'], os.path.join(ctx['out'], 'save.dim'))
+
+def case_dimBand(ctx):
+    import dimap_for_oriburi as dimap
+    folder = _inputs(ctx, 1)
+    dim = os.path.join(folder, sorted(f for f in os.listdir(folder) if f.endswith('.dim'))[0])
+    dimap.dimBand(dim, dimap.dimBandNames(dim)[0]).sum(dtype='f8')
+
+def case_radiometry(ctx):
+    import numpy as np
+    import dimap_for_oriburi as dimap
+    import numpy_for_oriburi as engine
+    folder = _inputs(ctx, 1, complex=True)
+    dim = os.path.join(folder, sorted(f for f in os.listdir(folder) if f.endswith('.dim'))[0])
+    out = np.empty((ctx['size']//4, ctx['size']), np.float32)
+    engine.radiometry(dimap.dimBand(dim, 'i_VV'), out, dimap.dimBand(dim, 'q_VV'), 1, 4, True)
+
+def case_speckle(ctx):
+    import dimap_for_oriburi as dimap
+    import numpy_for_oriburi as engine
+    folder = _inputs(ctx, 1)
+    dim = os.path.join(folder, sorted(f for f in os.listdir(folder) if f.endswith('.dim'))[0])
+    engine.speckle_filter(dimap.dimBand(dim, dimap.dimBandNames(dim)[0]), 'Lee', 7)
+
+def case_stack_loop(ctx):
+    import S1_stack
+    folder = _inputs(ctx, 3, complex=True)
+    out = os.path.join(ctx['out'], 'stack') + '/'
+    os.makedirs(out, exist_ok=True)
+    S1_stack.main(['-f', folder + '/', '-s', out, '-m', '1', '--force'])
+
+def case_geocode_loop(ctx):
+    import S1_Geocode
+    folder = _inputs(ctx, 3)
+    out = os.path.join(ctx['out'], 'geocode') + '/'
+    os.makedirs(out, exist_ok=True)
+    S1_Geocode.main(['-f', folder + '/', '-s', out, '-m', '0', '-d', 'SRTM 3Sec', '-o', 'dB',
+                     '-sf', 'dim', '--force'])
+
+CASES = {name[5::]: func for name, func in globals().items() if name.startswith('case_')}
+
+#%% agreement with SNAP
+
+
+def agreement(ctx, rg='4', az='1'):
+
+    '''
+    numpy_for_oriburi radiometry against SNAP Multilook and LinearToFromdB,
+    as printable lines of the bands outside the stated tolerance
+    '''
+
+    import numpy as np
+    import dimap_for_oriburi as dimap
+    import numpy_for_oriburi as engine
+    import snappy_for_oriburi as snappy
+    folder = _inputs(ctx, 1, complex=True)
+    name = sorted(f for f in os.listdir(folder) if f.endswith('.dim'))[0]
+    prod = snappy.readProduct(folder + '/', name)
+
+    outputs = {False: os.path.join(ctx['out'], 'snap_ml.dim'), True: os.path.join(ctx['out'], 'snap_ml_db.dim')}
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        linear = snappy.multi_look(prod, 'all', rg, az)
+        snappy.save(linear, outputs[False])
+        snappy.save(snappy.Linear2dB(linear), outputs[True])
+
+    failures = []
+    for dB, dim in outputs.items():
+        # SNAP may change the looks for square ground pixels, the looks it used are in the metadata
+        looks = engine.dimLooks(dim)
+        reader = engine.radiometryReader(os.path.join(folder, name), looks[0], looks[1], dB)
+        for bandName in reader['Bands']:
+            reference = np.asarray(dimap.dimBand(dim, bandName), np.float64)
+            result = reader['Read'](bandName, 0, 0, reader['Width'], reader['Height']).astype(np.float64)
+            valid = np.isfinite(reference) & np.isfinite(result)
+            if dB:
+                error = np.max(np.abs(result - reference)[valid], initial=0)
+                if error > engine.DB_ATOL:
+                    failures.append('%s@%d: %.2e dB > %.0e dB' %(bandName, ctx['size'], error, engine.DB_ATOL))
+            else:
+                error = np.max((np.abs(result - reference)/np.abs(reference))[valid & (reference != 0)], initial=0)
+                if error > engine.LINEAR_RTOL:
+                    failures.append('%s@%d: %.2e relative > %.0e' %(bandName, ctx['size'], error, engine.LINEAR_RTOL))
+            if (np.isnan(reference) != np.isnan(result)).any():
+                failures.append('%s@%d: no-data pixels differ' %(bandName, ctx['size']))
+    return failures
+
+#%% measurement
+
+
+def measure(func, ctx, repeat):
+
+    '''
+    best wall time of repeat runs, then peak Python/NumPy memory of one run
+    '''
+
+    times = []
+    for _ in range(repeat):
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            t0 = time.perf_counter()
+            func(ctx)
+            times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        func(ctx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'Time': min(times), 'Peak MB': peak/1024/1024}
+
+def compare(results, baselines, tolerance):
+
+    '''
+    regressions of results against baselines, as printable lines
+    '''
+
+    failures = []
+    for key, result in results.items():
+        base = baselines.get(key)
+        if base is None:
+            continue
+        if result['Time'] > base['Time']*(1 + tolerance) and result['Time'] - base['Time'] > 0.01:
+            failures.append('%s: time %.3f s > baseline %.3f s' %(key, result['Time'], base['Time']))
+        if result['Peak MB'] > base['Peak MB']*(1 + tolerance) + 1:
+            failures.append('%s: peak %.1f MB > baseline %.1f MB' %(key, result['Peak MB'], base['Peak MB']))
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark suite of snappy_for_oriburi and the S1_* drivers")
+    parser.add_argument("--sizes", required=False, type=int, nargs='+', default=[512, 2048], help="Scene sizes in pixels (square)")
+    parser.add_argument("--cases", required=False, nargs='+', default=list(CASES), help="Cases to run: %s" %', '.join(CASES))
+    parser.add_argument("--repeat", required=False, type=int, default=3, help="Timed runs per case, the best is kept")
+    parser.add_argument("--snap", required=False, action='store_true', help="Use the installed esa_snappy and SNAP operators instead of the stub")
+    parser.add_argument("--baseline", required=False, default=os.path.join(HERE, 'baselines.json'), help="Baseline file")
+    parser.add_argument("--save", required=False, action='store_true', help="Save the results as the new baselines")
+    parser.add_argument("--tolerance", required=False, type=float, default=0.5, help="Allowed slowdown or growth over the baseline (0.5 for 50%%)")
+    args = parser.parse_args()
+
+    if not args.snap:
+        sys.path.insert(0, os.path.join(HERE, 'stub'))
+    import esa_snappy
+    if args.snap and not hasattr(esa_snappy, 'syntheticProduct'):
+        # synthetic inputs are always written by the stub
+        sys.path.insert(0, os.path.join(HERE, 'stub'))
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('esa_snappy_stub', os.path.join(HERE, 'stub', 'esa_snappy.py'))
+        stub = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(stub)
+        esa_snappy.syntheticProduct = stub.syntheticProduct
+        esa_snappy.ProductIO.writeProduct = staticmethod(
+            lambda product, path, formatName, write=stub.ProductIO.writeProduct, real=esa_snappy.ProductIO.writeProduct:
+            write(product, path, formatName) if isinstance(product, stub.Product) else real(product, path, formatName))
+
+    backend = 'snap' if args.snap else 'stub'
+    results = {}
+    disagreements = []
+    tmp = tempfile.mkdtemp(prefix='bench_oriburi_')
+    try:
+        print('%-16s %6s %10s %10s' %('Case', 'Size', 'Time [s]', 'Peak [MB]'))
+        for size in args.sizes:
+            ctx = {'size': size, 'tmp': tmp, 'out': os.path.join(tmp, 'out_%d' %size)}
+            os.makedirs(ctx['out'])
+            ctx['product'] = _product(ctx)
+            if args.snap:
+                disagreements += agreement(ctx)
+            for name in args.cases:
+                result = measure(CASES[name], ctx, args.repeat)
+                results['%s/%s@%d' %(backend, name, size)] = result
+                print('%-16s %6d %10.3f %10.1f' %(name, size, result['Time'], result['Peak MB']))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print('Baselines saved in\n', args.baseline)
+        sys.exit(0)
+
+    failures = compare(results, baselines, args.tolerance)
+    if len(baselines) == 0:
+        print('No baseline in %s, run with --save first' %args.baseline)
+    for line in failures:
+        print('REGRESSION %s' %line)
+    for line in disagreements:
+        print('DISAGREEMENT %s' %line)
+    sys.exit(1 if failures or disagreements else 0)
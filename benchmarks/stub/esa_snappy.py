@@ -0,0 +1,418 @@
+# ####################################################################
+# ####                                                               #
+# ####    esa_snappy (stub for benchmarks)                           #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Stand-in for esa_snappy so snappy_for_oriburi and the S1_* drivers can be
+# timed without SNAP. Products are synthetic rasters or BEAM-DIMAP files
+# read through dimap_for_oriburi. ProductIO.writeProduct writes real
+# BEAM-DIMAP products. GPF operators keep the band layout of SNAP (names,
+# multilooked size, stacked bands) but compute only cheap NumPy stand-ins,
+# so timings measure the wrappers, the drivers and the I/O.
+#
+# Not for processing: the pixel values are not those of SNAP.
+
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+import dimap_for_oriburi as dimap
+
+_SUFFIX = {'Apply-Orbit-File': '_Orb', 'Calibration': '_Cal', 'TOPSAR-Split': '_split',
+           'TOPSAR-Deburst': '_deb', 'TOPSAR-Merge': '_mrg', 'Subset': '_sub',
+           'Multilook': '_ML', 'LinearToFromdB': '_dB', 'Terrain-Correction': '_TC',
+           'Speckle-Filter': '_Spk', 'Back-Geocoding': '_Stack', 'CreateStack': '_Stack',
+           'DEM-Assisted-Coregistration': '_Stack', 'Coherence': '_coh'}
+_STACK = ('Back-Geocoding', 'CreateStack', 'DEM-Assisted-Coregistration')
+
+#%% products
+
+
+class _Attributes:
+    def __init__(self, attributes):
+        self.attributes = attributes
+    def getAttributeString(self, name):
+        return str(self.attributes.get(name, ''))
+    def getAttributeDouble(self, name):
+        return float(self.attributes.get(name, 0))
+
+class _MetadataRoot:
+    def __init__(self, metadata):
+        self.metadata = metadata
+    def getElement(self, name):
+        return _Attributes(self.metadata)
+
+class _Time:
+    def __init__(self, text):
+        self.text = text
+    def format(self):
+        return self.text
+
+class _GeoPos:
+    def __init__(self, lat, lon):
+        self.lat, self.lon = lat, lon
+    def getLat(self):
+        return self.lat
+    def getLon(self):
+        return self.lon
+
+class _GeoCoding:
+    # regular 10 m grid near 37N 126E
+    def getGeoPos(self, pixel, _):
+        return _GeoPos(37.5 - pixel.y*1e-4, 126.5 + pixel.x*1e-4)
+
+class PixelPos:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+class Band:
+
+    '''
+    band of a stub product, read window by window through read(x, y, w, h)
+    '''
+
+    def __init__(self, name, width, height, read, unit=''):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.read = read
+        self.unit = unit
+
+    def getName(self):
+        return self.name
+
+    def getUnit(self):
+        return self.unit
+
+    def getRasterWidth(self):
+        return self.width
+
+    def getRasterHeight(self):
+        return self.height
+
+    def getDataType(self):
+        # ProductData.TYPE_FLOAT32
+        return 30
+
+    def isScalingApplied(self):
+        return False
+
+    def readPixels(self, x, y, w, h, buf):
+        buf[:w*h] = np.asarray(self.read(x, y, w, h), np.float32).reshape(-1)
+        return buf
+
+    def writePixels(self, x, y, w, h, buf):
+        self.writer.writeBandRasterData(self, x, y, w, h, buf)
+
+class Product:
+
+    '''
+    stub product with the methods used by snappy_for_oriburi
+    '''
+
+    def __init__(self, name, width, height, bands=None, metadata=None):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.bands = list(bands or [])
+        self.metadata = dict(metadata or {})
+
+    def getName(self):
+        return self.name
+
+    def getBandNames(self):
+        return [b.name for b in self.bands]
+
+    def getBand(self, name):
+        for b in self.bands:
+            if b.name == name:
+                return b
+        return None
+
+    def getNumBands(self):
+        return len(self.bands)
+
+    def removeBand(self, band):
+        self.bands.remove(band)
+        return True
+
+    def addBand(self, name, expression):
+        # X and Y pixel coordinates as in the band maths of SNAP
+        def read(x, y, w, h):
+            yy, xx = np.mgrid[y:y+h, x:x+w].astype(np.float32) + 0.5
+            return eval(expression, {'X': xx, 'Y': yy})
+        band = Band(name, self.width, self.height, read)
+        self.bands.append(band)
+        return band
+
+    def getSceneRasterWidth(self):
+        return self.width
+
+    def getSceneRasterHeight(self):
+        return self.height
+
+    def getMetadataRoot(self):
+        return _MetadataRoot(self.metadata)
+
+    def getStartTime(self):
+        return _Time(self.metadata.get('first_line_time', '12-JAN-2021 10:00:00.000000'))
+
+    def getEndTime(self):
+        return _Time(self.metadata.get('last_line_time', '12-JAN-2021 10:00:25.000000'))
+
+    def getSceneGeoCoding(self):
+        return _GeoCoding()
+
+    def dispose(self):
+        pass
+
+    def setProductWriter(self, writer):
+        for band in self.bands:
+            band.writer = writer
+
+def syntheticProduct (name, width, height, bands=('Sigma0_VV',), complex=False, seed=0, date='12Jan2021'):
+
+    '''
+    [Usage]  syntheticProduct(name, width, height, bands, complex, seed, date)\n
+
+    product of single-look gamma speckle over a smooth backscatter field\n
+
+    bands:    band names, each becomes an i_/q_ pair when complex
+    date:     acquisition date ddMonYYYY used for the metadata
+    '''
+
+    rng = np.random.default_rng(seed)
+    names = []
+    for band in bands:
+        names += ['i_' + band, 'q_' + band] if complex else [band]
+
+    arrays = {}
+    def reader(name, k):
+        def read(x, y, w, h):
+            if name not in arrays:
+                yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+                field = 0.05 + 0.04*np.sin(xx/97.0 + k)*np.cos(yy/61.0)
+                if complex:
+                    arrays[name] = (np.sqrt(field/2)*rng.standard_normal((height, width))).astype(np.float32)
+                else:
+                    arrays[name] = (field*rng.gamma(1.0, 1.0, (height, width))).astype(np.float32)
+            return arrays[name][y:y+h, x:x+w]
+        return read
+
+    day = '%s-%s-%s' %(date[0:2], date[2:5].upper(), date[5:9])
+    metadata = {'MISSION': 'SENTINEL-1A', 'PASS': 'ASCENDING', 'ABS_ORBIT': 36000 + seed,
+                'REL_ORBIT': 127, 'range_looks': 1, 'azimuth_looks': 1,
+                'first_line_time': day + ' 10:00:00.000000', 'last_line_time': day + ' 10:00:25.000000'}
+    return Product(name, width, height,
+                   [Band(n, width, height, reader(n, k)) for k, n in enumerate(names)], metadata)
+
+def _readDim (path):
+    info = dimap.dimInfo(path)
+    metadata = dimap.dimMetadata(path)
+    bands = []
+    for b in info['Bands']:
+        if b['Virtual'] or b['Header'] is None:
+            continue
+        data = dimap._memmap(b, 'r')
+        bands.append(Band(b['Name'], info['Width'], info['Height'],
+                          lambda x, y, w, h, data=data: data[y:y+h, x:x+w]))
+    return Product(info['Product Name'], info['Width'], info['Height'], bands, metadata)
+
+def _writeDim (product, path, rows=256, data=True):
+    name = os.path.splitext(os.path.basename(path))[0]
+    data_dir = os.path.splitext(path)[0] + '.data'
+    os.makedirs(data_dir, exist_ok=True)
+
+    root = ET.Element('Dimap_Document', name=name + '.dim')
+    ET.SubElement(ET.SubElement(root, 'Dataset_Id'), 'DATASET_NAME').text = product.name
+    dims = ET.SubElement(root, 'Raster_Dimensions')
+    ET.SubElement(dims, 'NCOLS').text = str(product.width)
+    ET.SubElement(dims, 'NROWS').text = str(product.height)
+    ET.SubElement(dims, 'NBANDS').text = str(len(product.bands))
+    access = ET.SubElement(root, 'Data_Access')
+    ET.SubElement(access, 'DATA_FILE_FORMAT').text = 'ENVI'
+    interpretation = ET.SubElement(root, 'Image_Interpretation')
+    for index, band in enumerate(product.bands):
+        data_file = ET.SubElement(access, 'Data_File')
+        ET.SubElement(data_file, 'DATA_FILE_PATH', href='%s.data/%s.hdr' %(name, band.name))
+        ET.SubElement(data_file, 'BAND_INDEX').text = str(index)
+        info = ET.SubElement(interpretation, 'Spectral_Band_Info')
+        for tag, value in (('BAND_INDEX', index), ('BAND_NAME', band.name), ('DATA_TYPE', 'float32'),
+                           ('PHYSICAL_UNIT', band.unit), ('NO_DATA_VALUE_USED', 'false'),
+                           ('NO_DATA_VALUE', '0.0')):
+            ET.SubElement(info, tag).text = str(value)
+
+        with open(os.path.join(data_dir, band.name + '.hdr'), 'w') as f:
+            f.write('ENVI\nsamples = %d\nlines = %d\nbands = 1\nheader offset = 0\n'
+                    'file type = ENVI Standard\ndata type = 4\ninterleave = bsq\nbyte order = 1\n'
+                    'band names = { %s }\n' %(product.width, product.height, band.name))
+        with open(os.path.join(data_dir, band.name + '.img'), 'wb') as f:
+            if not data:
+                f.truncate(4*product.width*product.height)
+                continue
+            for y in range(0, product.height, rows):
+                h = min(rows, product.height - y)
+                f.write(np.asarray(band.read(0, y, product.width, h), '>f4').tobytes())
+
+    sources = ET.SubElement(ET.SubElement(root, 'Dataset_Sources'), 'MDElem', name='metadata')
+    abstracted = ET.SubElement(sources, 'MDElem', name='Abstracted_Metadata')
+    for key, value in product.metadata.items():
+        ET.SubElement(abstracted, 'MDATTR', name=key, type='ascii').text = str(value)
+
+    ET.indent(root)
+    ET.ElementTree(root).write(path, encoding='ISO-8859-1', xml_declaration=True)
+
+class _DimWriter:
+
+    '''
+    BEAM-DIMAP writer of writeProductNodes / Band.writePixels
+    '''
+
+    def writeProductNodes(self, product, path):
+        _writeDim(product, path, data=False)
+        data_dir = os.path.splitext(path)[0] + '.data'
+        self.images = {band.name: np.memmap(os.path.join(data_dir, band.name + '.img'), '>f4', 'r+',
+                                            shape=(product.height, product.width)) for band in product.bands}
+
+    def shouldWrite(self, band):
+        return True
+
+    def writeBandRasterData(self, band, x, y, w, h, buf):
+        self.images[band.name][y:y+h, x:x+w] = np.asarray(buf).reshape(h, w)
+
+    def close(self):
+        for image in self.images.values():
+            image.flush()
+        self.images = {}
+
+class ProductIO:
+
+    @staticmethod
+    def readProduct(path):
+        if not os.path.exists(path):
+            raise IOError('No such product: %s' %path)
+        return _readDim(path)
+
+    @staticmethod
+    def getProductWriter(formatName):
+        if formatName != 'BEAM-DIMAP':
+            raise ValueError('the esa_snappy stub writes BEAM-DIMAP only, not %s' %formatName)
+        return _DimWriter()
+
+    @staticmethod
+    def writeProduct(product, path, formatName):
+        if formatName != 'BEAM-DIMAP':
+            raise ValueError('the esa_snappy stub writes BEAM-DIMAP only, not %s' %formatName)
+        _writeDim(product, path)
+
+#%% operators
+
+
+class HashMap(dict):
+    def put(self, key, value):
+        self[key] = value
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+class WKTReader:
+    def read(self, wkt):
+        return wkt
+
+def _sourceList (sources):
+    if isinstance(sources, dict):
+        return list(sources.values())
+    if isinstance(sources, (list, tuple)):
+        return list(sources)
+    return [sources]
+
+def _date (product):
+    date = product.metadata.get('first_line_time', '12-JAN-2021')[0:11]
+    return date[0:2] + date[3:6].capitalize() + date[7:11]
+
+def _looked (read, rg, az):
+    def looked(x, y, w, h):
+        window = np.asarray(read(x*rg, y*az, w*rg, h*az), np.float32)
+        return window.reshape(h, az, w, rg).mean(axis=(1, 3))
+    return looked
+
+def _createProduct (operator, parameters, sources):
+    src = _sourceList(sources)
+    first = src[0]
+    bands = first.bands
+    if parameters.get('sourceBands'):
+        selected = str(parameters['sourceBands']).split(',')
+        bands = [b for b in bands if b.name in selected]
+    width, height = first.width, first.height
+    metadata = dict(first.metadata)
+
+    if operator == 'Multilook':
+        rg, az = int(parameters.get('nRgLooks', 1)), int(parameters.get('nAzLooks', 1))
+        width, height = width//rg, height//az
+        metadata['range_looks'], metadata['azimuth_looks'] = rg, az
+        if parameters.get('outputIntensity'):
+            # i_X and q_X of complex products become Intensity_X
+            names = [b.name for b in bands]
+            bands = [Band('Intensity_' + b.name[2:], b.width, b.height,
+                          lambda x, y, w, h, i=b.read, q=bands[names.index('q_' + b.name[2:])].read:
+                          np.square(i(x, y, w, h).astype(np.float64)) + np.square(q(x, y, w, h).astype(np.float64)))
+                     if b.name.startswith('i_') and 'q_' + b.name[2:] in names else b
+                     for b in bands if not (b.name.startswith('q_') and 'i_' + b.name[2:] in names)]
+        out = [Band(b.name, width, height, _looked(b.read, rg, az)) for b in bands]
+    elif operator == 'LinearToFromdB':
+        out = [Band(b.name + '_db', width, height,
+                    lambda x, y, w, h, read=b.read: 10*np.log10(np.maximum(read(x, y, w, h), 1e-10)), 'dB')
+               for b in bands]
+    elif operator in _STACK:
+        out = [Band('%s_mst_%s' %(b.name, _date(first)), width, height, b.read) for b in bands]
+        for k, secondary in enumerate(src[1::]):
+            out += [Band('%s_slv%d_%s' %(b.name, k+1, _date(secondary)), width, height, b.read)
+                    for b in secondary.bands]
+    else:
+        out = [Band(b.name, width, height, b.read, b.unit) for b in bands]
+
+    return Product(first.name + _SUFFIX.get(operator, '_' + operator), width, height, out, metadata)
+
+class _Registry:
+    def loadOperatorSpis(self):
+        pass
+
+class GPF:
+
+    @staticmethod
+    def getDefaultInstance():
+        return GPF()
+
+    def getOperatorSpiRegistry(self):
+        return _Registry()
+
+    @staticmethod
+    def createProduct(operator, parameters, sources):
+        return _createProduct(operator, parameters, sources)
+
+#%% jpy
+
+
+class _Anything:
+    # JAI and other Java singletons, every call is accepted
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+class jpy:
+
+    @staticmethod
+    def get_type(name):
+        if name.endswith('.PixelPos'):
+            return PixelPos
+        return _Anything()
+
+    @staticmethod
+    def array(type_name, n):
+        return [None]*n
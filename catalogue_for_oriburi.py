@@ -0,0 +1,410 @@
+# ####################################################################
+# ####                                                               #
+# ####    catalogue_for_oriburi                                      #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Persistent SQLite catalogue of Sentinel-1 SAFE products (.zip or .SAFE).
+# The manifest and annotation files of each product are parsed once and
+# stored with mission, acquisition time, relative orbit, pass direction,
+# polarisations, burst counts per swath and footprint. Scenes are then
+# selected by date range, track and AOI with indexed queries.
+# Products are keyed by path, so one catalogue can index several
+# directories holding the same product (e.g. an archive and a mirror).
+
+import os
+import re
+import json
+import sqlite3
+import zipfile
+import xml.etree.ElementTree as ET
+
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?(?:[eE]-?\d+)?')
+_ANNOTATION = re.compile(r'annotation/s1[a-d]-(iw\d|ew\d|s\d)-slc-([a-z]{2})-[^/]*\.xml$')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scenes (
+    path TEXT PRIMARY KEY,
+    directory TEXT,
+    name TEXT,
+    size INTEGER,
+    mtime REAL,
+    mission TEXT,
+    start TEXT,
+    stop TEXT,
+    relative_orbit INTEGER,
+    pass TEXT,
+    polarisations TEXT,
+    bursts TEXT,
+    footprint TEXT,
+    min_lon REAL,
+    min_lat REAL,
+    max_lon REAL,
+    max_lat REAL
+);
+CREATE INDEX IF NOT EXISTS scenes_start ON scenes (start);
+CREATE INDEX IF NOT EXISTS scenes_track ON scenes (relative_orbit, pass, start);
+CREATE INDEX IF NOT EXISTS scenes_lon ON scenes (min_lon, max_lon);
+CREATE INDEX IF NOT EXISTS scenes_directory ON scenes (directory, start);
+'''
+
+#%% geometry
+
+
+def wktPoints (wkt):
+
+    '''
+    [Usage]  wktPoints(wkt)\n
+
+    (lon, lat) points of the first ring of a WKT polygon\n
+    '''
+
+    ring = wkt[wkt.index('('):].lstrip('(').split(')')[0]
+    values = [float(v) for v in _NUMBER.findall(ring)]
+    return list(zip(values[0::2], values[1::2]))
+
+def _cross (o, a, b):
+    return (a[0]-o[0])*(b[1]-o[1]) - (a[1]-o[1])*(b[0]-o[0])
+
+def _onSegment (p, q, r):
+    return (min(p[0], r[0]) <= q[0] <= max(p[0], r[0]) and
+            min(p[1], r[1]) <= q[1] <= max(p[1], r[1]))
+
+def _segmentsIntersect (p1, p2, q1, q2):
+    d1 = _cross(q1, q2, p1)
+    d2 = _cross(q1, q2, p2)
+    d3 = _cross(p1, p2, q1)
+    d4 = _cross(p1, p2, q2)
+    if ((d1 > 0 and d2 < 0) or (d1 < 0 and d2 > 0)) and ((d3 > 0 and d4 < 0) or (d3 < 0 and d4 > 0)):
+        return True
+    # collinear end points
+    return ((d1 == 0 and _onSegment(q1, p1, q2)) or (d2 == 0 and _onSegment(q1, p2, q2)) or
+            (d3 == 0 and _onSegment(p1, q1, p2)) or (d4 == 0 and _onSegment(p1, q2, p2)))
+
+def pointInPolygon (point, polygon):
+
+    '''
+    [Usage]  pointInPolygon(point, polygon)\n
+
+    True if (x, y) lies inside a polygon given as a list of (x, y)\n
+    '''
+
+    x, y = point
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        xi, yi = polygon[i]
+        xj, yj = polygon[j]
+        if (yi > y) != (yj > y) and x < (xj-xi)*(y-yi)/(yj-yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+def polygonsIntersect (a, b):
+
+    '''
+    [Usage]  polygonsIntersect(a, b)\n
+
+    True if two polygons given as lists of (x, y) overlap or touch\n
+    '''
+
+    for i in range(len(a)):
+        for j in range(len(b)):
+            if _segmentsIntersect(a[i-1], a[i], b[j-1], b[j]):
+                return True
+    return pointInPolygon(a[0], b) or pointInPolygon(b[0], a)
+
+def _bounds (points):
+    lons = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    return min(lons), min(lats), max(lons), max(lats)
+
+#%% manifest
+
+
+def _local (tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _find (root, name):
+    for element in root.iter():
+        if _local(element.tag) == name:
+            return element
+    return None
+
+def _findall (root, name):
+    return [element for element in root.iter() if _local(element.tag) == name]
+
+def _members (path):
+    if os.path.isdir(path):
+        names = []
+        for root, _, files in os.walk(path):
+            for f in files:
+                names.append(os.path.relpath(os.path.join(root, f), path).replace(os.sep, '/'))
+        return names, lambda name: open(os.path.join(path, name), 'rb'), None
+    z = zipfile.ZipFile(path)
+    return z.namelist(), z.open, z
+
+def parseSafe (path):
+
+    '''
+    [Usage]  parseSafe(path)\n
+
+    read the metadata of a Sentinel-1 SAFE product\n
+
+    path:     /path/to/S1A_IW_SLC__....zip or /path/to/S1A_IW_SLC__....SAFE
+
+    returns dict with 'Mission', 'Start', 'Stop' ('YYYYMMDDTHHMMSS'),
+    'Relative Orbit', 'Pass', 'Polarisations', 'Bursts' and 'Footprint' (WKT)
+    '''
+
+    names, read, z = _members(path)
+    try:
+        return _parseSafe(names, read)
+    finally:
+        if z is not None:
+            z.close()
+
+def _parseSafe (names, read):
+
+    manifest = [n for n in names if n.endswith('manifest.safe')][0]
+    with read(manifest) as f:
+        root = ET.parse(f).getroot()
+
+    mission = 'S1' + _find(root, 'number').text.strip()
+    start = re.sub(r'[-:]', '', _find(root, 'startTime').text.strip())[0:15]
+    stop = re.sub(r'[-:]', '', _find(root, 'stopTime').text.strip())[0:15]
+    relative_orbit = int([e for e in _findall(root, 'relativeOrbitNumber')
+                          if e.get('type', 'start') == 'start'][0].text)
+    pass_direction = _find(root, 'pass').text.strip().upper()
+    polarisations = sorted(e.text.strip() for e in _findall(root, 'transmitterReceiverPolarisation'))
+
+    coordinates = _find(root, 'coordinates').text.split()
+    points = []
+    for c in coordinates:
+        lat, lon = c.split(',')
+        points.append((float(lon), float(lat)))
+    points.append(points[0])
+    footprint = 'POLYGON((%s))' %', '.join('%f %f' %p for p in points)
+
+    bursts = {}
+    for name in sorted(names):
+        m = _ANNOTATION.search(name)
+        if m is None or m.group(1).upper() in bursts:
+            continue
+        with read(name) as f:
+            annotation = ET.parse(f).getroot()
+        burst_list = _find(annotation, 'burstList')
+        bursts[m.group(1).upper()] = int(burst_list.get('count')) if burst_list is not None else 0
+
+    return {'Mission': mission, 'Start': start, 'Stop': stop, 'Relative Orbit': relative_orbit,
+            'Pass': pass_direction, 'Polarisations': polarisations, 'Bursts': bursts,
+            'Footprint': footprint}
+
+def _burstPolygons (annotation):
+    lines_per_burst = int(_find(annotation, 'linesPerBurst').text)
+    burst_list = _find(annotation, 'burstList')
+    n = int(burst_list.get('count')) if burst_list is not None else 0
+
+    grid = {}
+    for point in _findall(annotation, 'geolocationGridPoint'):
+        values = {_local(e.tag): e.text for e in point}
+        grid.setdefault(int(values['line']), []).append(
+            (int(values['pixel']), float(values['longitude']), float(values['latitude'])))
+    rows = sorted(grid)
+
+    polygons = []
+    for k in range(n):
+        # grid rows nearest to the first and last line of the burst
+        top = min(rows, key=lambda r: abs(r - k*lines_per_burst))
+        bottom = min(rows, key=lambda r: abs(r - (k+1)*lines_per_burst))
+        if top == bottom:
+            bottom = rows[min(rows.index(top)+1, len(rows)-1)]
+        upper = [(lon, lat) for _, lon, lat in sorted(grid[top])]
+        lower = [(lon, lat) for _, lon, lat in sorted(grid[bottom], reverse=True)]
+        polygons.append(upper + lower + upper[:1])
+
+    return polygons
+
+def burstsForAOI (path, aoi, pol=None):
+
+    '''
+    [Usage]  burstsForAOI(path, aoi, pol)\n
+
+    subswaths and bursts of a SLC product that intersect an AOI\n
+
+    path:     /path/to/S1A_IW_SLC__....zip or /path/to/S1A_IW_SLC__....SAFE
+    aoi:      WKT polygon
+    pol:      polarisation of the annotation to read
+              'VV' or 'VH' or 'HV' or 'HH', None for any
+
+    returns dict of swath and (first_burst, last_burst), burst numbers start at 1
+    swaths without any burst in the AOI are left out
+    '''
+
+    aoi_points = wktPoints(aoi)
+    names, read, z = _members(path)
+    try:
+        annotations = {}
+        for name in sorted(names):
+            m = _ANNOTATION.search(name)
+            if m is None:
+                continue
+            swath = m.group(1).upper()
+            if swath not in annotations or (pol is not None and m.group(2).upper() == pol.upper()):
+                annotations[swath] = name
+
+        swaths = {}
+        for swath in sorted(annotations):
+            with read(annotations[swath]) as f:
+                annotation = ET.parse(f).getroot()
+            hits = [k+1 for k, polygon in enumerate(_burstPolygons(annotation))
+                    if polygonsIntersect(polygon, aoi_points)]
+            if hits:
+                swaths[swath] = (min(hits), max(hits))
+    finally:
+        if z is not None:
+            z.close()
+
+    return swaths
+
+#%% catalogue
+
+
+def openCatalogue (db):
+
+    '''
+    [Usage]  openCatalogue(db)\n
+
+    open or create a scene catalogue\n
+
+    db:       /path/to/catalogue.sqlite
+    '''
+
+    con = sqlite3.connect(db)
+    con.row_factory = sqlite3.Row
+    columns = [row['name'] for row in con.execute('PRAGMA table_info(scenes)')]
+    if columns and 'directory' not in columns:
+        # catalogue keyed by file name, rebuilt from the products by updateCatalogue
+        print('Rebuilding the catalogue %s keyed by path' %db)
+        con.execute('DROP TABLE scenes')
+    con.executescript(_SCHEMA)
+    return con
+
+def updateCatalogue (db, directory):
+
+    '''
+    [Usage]  updateCatalogue(db, directory)\n
+
+    add new or changed products of a directory to the catalogue\n
+
+    db:        /path/to/catalogue.sqlite
+    directory: /path/to/your/sat_data/
+
+    products removed from the directory are removed from the catalogue
+    returns number of parsed products
+    '''
+
+    con = openCatalogue(db)
+    directory = os.path.abspath(directory)
+    known = {row['name']: (row['size'], row['mtime'])
+             for row in con.execute('SELECT name, size, mtime FROM scenes WHERE directory = ?', (directory,))}
+
+    found = set()
+    parsed = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.startswith('S1') or not name.endswith(('.zip', '.SAFE')):
+            continue
+        path = os.path.join(directory, name)
+        st = os.stat(path)
+        found.add(name)
+        if known.get(name) == (st.st_size, st.st_mtime):
+            continue
+        try:
+            info = parseSafe(path)
+        except Exception as e:
+            print('skip %s: %r' %(name, e))
+            continue
+        min_lon, min_lat, max_lon, max_lat = _bounds(wktPoints(info['Footprint']))
+        con.execute('INSERT OR REPLACE INTO scenes VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                    (path, directory, name, st.st_size, st.st_mtime, info['Mission'], info['Start'],
+                     info['Stop'], info['Relative Orbit'], info['Pass'],
+                     ','.join(info['Polarisations']), json.dumps(info['Bursts']),
+                     info['Footprint'], min_lon, min_lat, max_lon, max_lat))
+        parsed += 1
+
+    for name in set(known) - found:
+        con.execute('DELETE FROM scenes WHERE path = ?', (os.path.join(directory, name),))
+    con.commit()
+    con.close()
+
+    return parsed
+
+def selectScenes (db, start=None, end=None, relative_orbit=None, pass_direction=None,
+                  aoi=None, mission=None, directory=None):
+
+    '''
+    [Usage]  selectScenes(db, start, end, relative_orbit, pass_direction, aoi, mission, directory)\n
+
+    select scenes of the catalogue in order of acquisition time\n
+
+    db:             /path/to/catalogue.sqlite
+    start:          first acquisition time 'YYYYMMDD' or 'YYYYMMDDTHHMMSS'
+    end:            last acquisition time 'YYYYMMDD' or 'YYYYMMDDTHHMMSS'
+    relative_orbit: relative orbit number
+    pass_direction: 'ASCENDING' or 'DESCENDING'
+    aoi:            WKT polygon that scenes must intersect
+    mission:        'S1A' or 'S1B' or 'S1C'
+    directory:      /path/to/your/sat_data/ the scenes must be in
+                    (a catalogue can index several directories)
+
+    returns list of dicts with the catalogue columns
+    None for any condition means no restriction
+    '''
+
+    where = []
+    values = []
+    if start is not None:
+        where.append('start >= ?')
+        values.append(start)
+    if end is not None:
+        where.append('start <= ?')
+        values.append(end if 'T' in end else end + 'T999999')
+    if relative_orbit is not None:
+        where.append('relative_orbit = ?')
+        values.append(int(relative_orbit))
+    if pass_direction is not None:
+        where.append('pass = ?')
+        values.append(pass_direction.upper())
+    if mission is not None:
+        where.append('mission = ?')
+        values.append(mission)
+    if directory is not None:
+        where.append('directory = ?')
+        values.append(os.path.abspath(directory))
+    if aoi is not None:
+        aoi_points = wktPoints(aoi)
+        min_lon, min_lat, max_lon, max_lat = _bounds(aoi_points)
+        where.append('max_lon >= ? AND min_lon <= ? AND max_lat >= ? AND min_lat <= ?')
+        values += [min_lon, max_lon, min_lat, max_lat]
+
+    query = 'SELECT * FROM scenes'
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY start'
+
+    con = openCatalogue(db)
+    rows = [dict(row) for row in con.execute(query, values)]
+    con.close()
+
+    for row in rows:
+        row['bursts'] = json.loads(row['bursts'])
+    if aoi is not None:
+        rows = [row for row in rows if polygonsIntersect(wktPoints(row['footprint']), aoi_points)]
+
+    return rows
@@ -0,0 +1,91 @@
+# ####################################################################
+# ####                                                               #
+# ####    cog_for_oriburi                                            #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Cloud-Optimized GeoTIFF output of snappy_for_oriburi.save. SNAP writes a
+# plain GeoTIFF, which is rewritten by the COG driver of GDAL (3.1 or later)
+# with internal tiles, compression, overviews and the IFDs at the start of
+# the file, so that it can be read with HTTP range requests.
+# GDAL (osgeo.gdal) is needed.
+
+import os
+
+COMPRESSIONS = ('DEFLATE', 'ZSTD', 'LZW', 'LZMA', 'NONE')
+
+#%% functions
+
+
+def cogOptions (compress='DEFLATE', predictor='YES', level=None, blocksize=512,
+                overviews='AUTO', resampling='AVERAGE', bigtiff='IF_SAFER', threads='ALL_CPUS'):
+
+    '''
+    [Usage]  cogOptions(compress, predictor, level, blocksize, overviews, resampling, bigtiff, threads)\n
+
+    creation options of the GDAL COG driver\n
+
+    compress:   'DEFLATE' or 'ZSTD' or 'LZW' or 'LZMA' or 'NONE'
+    predictor:  'YES' for the predictor matching the data type
+                (floating point predictor for float32 bands), 'NO' for none
+    level:      compression level, None for the GDAL default
+    blocksize:  internal tile size in pixels
+    overviews:  'AUTO' to build overviews, 'NONE' for none
+    resampling: resampling of the overviews, 'AVERAGE' or 'NEAREST' or 'BILINEAR' ...
+    bigtiff:    'IF_SAFER' or 'YES' or 'NO'
+                'YES' for large merged scenes beyond 4 GB
+    threads:    'ALL_CPUS' or number of threads compressing blocks in parallel
+
+    returns list of 'KEY=VALUE' creation options
+    '''
+
+    compress = compress.upper()
+    if compress not in COMPRESSIONS:
+        raise ValueError('%s is not one of %s' %(compress, ', '.join(COMPRESSIONS)))
+
+    options = ['COMPRESS=%s' %compress,
+               'BLOCKSIZE=%d' %int(blocksize),
+               'OVERVIEWS=%s' %overviews,
+               'RESAMPLING=%s' %resampling,
+               'BIGTIFF=%s' %bigtiff,
+               'NUM_THREADS=%s' %threads]
+    if compress != 'NONE':
+        options.append('PREDICTOR=%s' %predictor)
+    if level is not None:
+        options.append('LEVEL=%d' %int(level))
+
+    return options
+
+def toCOG (src, save_dir, options=None, remove=False):
+
+    '''
+    [Usage]  toCOG(src, save_dir, options, remove)\n
+
+    rewrite a raster as Cloud-Optimized GeoTIFF\n
+
+    src:      /path/to/raster readable by GDAL (GeoTIFF of SNAP)
+    save_dir: /path/to/save/directory/productname.tif
+    options:  list of creation options, see cogOptions
+              None for cogOptions()
+    remove:   True to delete src afterwards
+    '''
+
+    from osgeo import gdal
+
+    if options is None:
+        options = cogOptions()
+
+    gdal.UseExceptions()
+    tmp = save_dir + '.tmp.tif'
+    gdal.Translate(tmp, src, format='COG', creationOptions=options)
+    os.replace(tmp, save_dir)
+    if remove:
+        os.remove(src)
+
+    return save_dir
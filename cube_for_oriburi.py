@@ -0,0 +1,251 @@
+# ####################################################################
+# ####                                                               #
+# ####    cube_for_oriburi                                           #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Lazy (time, y, x) data cube over products on one grid, such as the
+# geocoded outputs of S1_Geocode.py (BEAM-DIMAP or a zarr_for_oriburi store).
+# Opening a cube only maps the files; pixels are read when a window is
+# requested. Temporal reductions run window by window in a thread pool,
+# with the window size chosen so that the windows in flight stay below a
+# memory ceiling, and write into a preallocated (y, x) output.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import dimap_for_oriburi as dimap
+import trace_for_oriburi as trace
+from tiles_for_oriburi import tileWindows
+
+REDUCTIONS = ('mean', 'median', 'std', 'min', 'max', 'percentile', 'count')
+
+#%% functions
+
+
+class Cube:
+
+    '''
+    [Usage]  cube = Cube(read, shape, dates)\n
+
+    lazily evaluated (time, y, x) float32 array\n
+
+    read:     function read(y, x, h, w, times) returning a (T, h, w) window
+              times is a slice of time indexes
+    shape:    (T, H, W)
+    dates:    list of per-date metadata (e.g. acquisition dates)
+
+    ex) cube  = dimCube(['/path/20210112_tc.dim', '/path/20210124_tc.dim', ...])
+        win   = cube[:, 1000:1100, 2000:2100]
+        mean  = cube.reduce('mean', memory=2048)
+        ratio = cube.changeRatio(slice(0, 10), slice(10, 20))
+    '''
+
+    def __init__(self, read, shape, dates=None):
+        self._read = read
+        self.shape = tuple(shape)
+        self.dates = list(dates) if dates is not None else [None]*self.shape[0]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read(self, y, x, h, w, times=None):
+
+        '''
+        read a (T, h, w) window, touching only the files and rows it covers\n
+        '''
+
+        return self._read(y, x, h, w, times if times is not None else slice(None))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),)*(3 - len(key))
+        t, ys, xs = key
+        if isinstance(t, int):
+            t = slice(t, t+1 if t != -1 else None)
+        y0, y1, ystep = ys.indices(self.shape[1])
+        x0, x1, xstep = xs.indices(self.shape[2])
+        if ystep != 1 or xstep != 1:
+            raise IndexError('Cube supports contiguous windows only')
+        window = self.read(y0, x0, y1 - y0, x1 - x0, t)
+        return window[0] if isinstance(key[0], int) else window
+
+    def windowShape(self, memory, workers, copies):
+
+        '''
+        square window size keeping workers windows of all dates under memory MB\n
+        '''
+
+        per_pixel = self.shape[0] * 4 * copies * workers
+        side = int((memory*1024*1024 / per_pixel) ** 0.5)
+        if side < 16:
+            raise MemoryError('%d dates do not fit in %d MB with %d workers' %(self.shape[0], memory, workers))
+        return min(side, self.shape[1]), min(side, self.shape[2])
+
+    def apply(self, func, out=None, memory=1024, workers=None, copies=3, times=None):
+
+        '''
+        [Usage]  cube.apply(func, out, memory, workers, copies, times)\n
+
+        apply a temporal function window by window in parallel\n
+
+        func:     function of a (T, h, w) window returning an (h, w) result
+        out:      preallocated (H, W) float32 array or writable np.memmap
+                  new array is allocated when None
+        memory:   memory ceiling of the windows in flight in MB
+        workers:  number of threads, None for the number of CPUs
+        copies:   number of window-sized arrays func needs, for the ceiling
+        times:    slice of time indexes, None for all dates
+
+        returns out
+        '''
+
+        workers = workers or os.cpu_count()
+        if out is None:
+            out = np.empty(self.shape[1:], np.float32)
+        tile = self.windowShape(memory, workers, copies)
+
+        def run(window):
+            row_off, col_off, rows, cols = window[0:4]
+            out[row_off:row_off+rows, col_off:col_off+cols] = func(self.read(row_off, col_off, rows, cols, times))
+
+        with ThreadPoolExecutor(workers) as pool:
+            # at most 2 windows per worker are submitted ahead, to hold the ceiling
+            pending = []
+            for window in tileWindows(self.shape[2], self.shape[1], tile):
+                pending.append(pool.submit(trace.bind(run), window))
+                if len(pending) >= 2*workers:
+                    pending.pop(0).result()
+            for future in pending:
+                future.result()
+
+        return out
+
+    def reduce(self, name, q=None, out=None, memory=1024, workers=None, times=None):
+
+        '''
+        [Usage]  cube.reduce(name, q, out, memory, workers, times)\n
+
+        temporal reduction ignoring NaN\n
+
+        name:     'mean' or 'median' or 'std' or 'min' or 'max' or 'percentile' or 'count'
+        q:        percentile in 0-100 for 'percentile'
+        out, memory, workers, times: see apply
+
+        returns (H, W) float32 array
+        '''
+
+        if name not in REDUCTIONS:
+            raise ValueError('%s is not one of %s' %(name, ', '.join(REDUCTIONS)))
+
+        def func(window):
+            if name == 'percentile':
+                return np.nanpercentile(window, q, axis=0)
+            if name == 'count':
+                return np.sum(np.isfinite(window), axis=0)
+            return getattr(np, 'nan' + name)(window, axis=0)
+
+        # median and percentile sort a copy of the window
+        # windows without valid date give NaN (and a RuntimeWarning of NumPy)
+        return self.apply(func, out, memory, workers, 3 if name in ('median', 'percentile') else 2, times)
+
+    def changeRatio(self, before, after, dB=False, out=None, memory=1024, workers=None):
+
+        '''
+        [Usage]  cube.changeRatio(before, after, dB, out, memory, workers)\n
+
+        ratio of the temporal means of two periods, after / before\n
+
+        before:   slice of time indexes of the first period
+        after:    slice of time indexes of the second period
+        dB:       True if the cube is in dB, the ratio is then the difference in dB
+
+        returns (H, W) float32 array
+        '''
+
+        def func(window):
+            if dB:
+                window = np.power(10, window/10)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ratio = np.nanmean(window[after], axis=0) / np.nanmean(window[before], axis=0)
+                return 10*np.log10(ratio) if dB else ratio
+
+        return self.apply(func, out, memory, workers, 3)
+
+def arrayCube (bands, dates=None):
+
+    '''
+    [Usage]  arrayCube(bands, dates)\n
+
+    cube over a list of (H, W) arrays or np.memmap on one grid\n
+    '''
+
+    shape = bands[0].shape
+    for band in bands:
+        if band.shape != shape:
+            raise ValueError('%s does not match the grid %s' %(band.shape, shape))
+
+    def read(y, x, h, w, times):
+        selected = bands[times]
+        window = np.empty((len(selected), h, w), np.float32)
+        for t, band in enumerate(selected):
+            window[t] = band[y:y+h, x:x+w]
+        return window
+
+    return Cube(read, (len(bands),) + tuple(shape), dates)
+
+def dimCube (dims, bandName=None):
+
+    '''
+    [Usage]  dimCube(dims, bandName)\n
+
+    cube over BEAM-DIMAP products on one grid, one band per product\n
+
+    dims:     list of /path/to/product.dim in time order
+              e.g. geocoded outputs of S1_Geocode.py on the same lookup
+    bandName: name of the band in every product
+              None for the first band with image data of each product
+
+    dates of the cube are the product names
+    '''
+
+    bands = []
+    names = []
+    for dim in dims:
+        info = dimap.dimInfo(dim)
+        if bandName is None:
+            band = [b for b in info['Bands'] if not b['Virtual'] and b['Header'] is not None][0]
+            bands.append(dimap._memmap(band, 'r'))
+        else:
+            bands.append(dimap.dimBand(dim, bandName))
+        names.append(info['Product Name'])
+
+    return arrayCube(bands, names)
+
+def storeCube (store, variable):
+
+    '''
+    [Usage]  storeCube(store, variable)\n
+
+    cube over a variable of a zarr_for_oriburi store\n
+
+    dates of the cube are the per-date metadata of the store
+    '''
+
+    import zarr_for_oriburi as zarr
+
+    info = zarr.storeInfo(store, variable)
+
+    def read(y, x, h, w, times):
+        return zarr.readWindow(store, variable, y, x, h, w, times)
+
+    return Cube(read, info['Shape'], info['Dates'])
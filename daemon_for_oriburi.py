@@ -0,0 +1,452 @@
+# ####################################################################
+# ####                                                               #
+# ####    daemon_for_oriburi                                         #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Processing daemon keeping one warm snappy_for_oriburi session (JVM,
+# operator SPIs, tile cache) alive between jobs. Jobs are the main(argv)
+# of S1_preproc.py, S1_stack.py, S1_Geocode.py and S1_pipeline.py, sent
+# over a local UNIX socket as JSON lines and run by a bounded pool of
+# threads in the daemon.
+# The output of a job, including the threads it starts through
+# trace_for_oriburi.bind, is streamed back to the client while it runs.
+# Process-wide settings (warnings, JVM heap, tile cache, parallelism and
+# the writers of saveAsync) are those of the daemon; the S1_* scripts leave
+# them alone when they run as a job (inJob).
+#
+# The S1_* scripts submit to the daemon by themselves when it is running
+# (socket $ORIBURI_DAEMON, default /tmp/oriburi-<uid>.sock); set
+# ORIBURI_DAEMON=off to always run locally.
+#
+# ex) python daemon_for_oriburi.py serve --workers 2 --heap 32G --tileCache 16384 &
+#     python S1_Geocode.py -f ... -s ... (runs in the daemon)
+#     python daemon_for_oriburi.py jobs
+#     python daemon_for_oriburi.py stop
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import tempfile
+import threading
+import traceback
+import importlib
+
+SCRIPTS = ('S1_preproc', 'S1_stack', 'S1_Geocode', 'S1_pipeline')
+
+# options of the S1_* scripts taking a path, made absolute before submitting
+PATH_OPTIONS = ('-f', '--fPath', '-s', '--sPath', '--demDir', '--demCache', '--store',
+                '--catalogue', '--orbitDir', '--trace')
+
+_ENV = 'ORIBURI_DAEMON'
+
+#%% client
+
+
+def socketPath ():
+
+    '''
+    [Usage]  socketPath()\n
+
+    path of the daemon socket, None if the daemon is disabled\n
+    '''
+
+    path = os.environ.get(_ENV)
+    if path is not None and path.lower() in ('off', 'none', '0', ''):
+        return None
+    return path or os.path.join(tempfile.gettempdir(), 'oriburi-%d.sock' %os.getuid())
+
+def _connect (path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+def _request (path, message):
+    # one request, iterator of the reply messages
+    with _connect(path) as sock, sock.makefile('rw') as f:
+        f.write(json.dumps(message) + '\n')
+        f.flush()
+        for line in f:
+            yield json.loads(line)
+
+def running (path=None):
+
+    '''
+    [Usage]  running(path)\n
+
+    True if a daemon answers on the socket\n
+    '''
+
+    path = path or socketPath()
+    if path is None or not os.path.exists(path):
+        return False
+    try:
+        with _connect(path):
+            return True
+    except OSError:
+        return False
+
+def absArgv (argv, cwd=None):
+
+    '''
+    [Usage]  absArgv(argv, cwd)\n
+
+    argv with the paths of PATH_OPTIONS made absolute, keeping a trailing /\n
+    '''
+
+    cwd = cwd or os.getcwd()
+    out = list(argv)
+    for k in range(len(out) - 1):
+        if out[k] in PATH_OPTIONS:
+            out[k+1] = os.path.join(cwd, out[k+1])
+    for k, value in enumerate(out):
+        for option in PATH_OPTIONS:
+            if option.startswith('--') and value.startswith(option + '='):
+                out[k] = option + '=' + os.path.join(cwd, value[len(option)+1::])
+    return out
+
+def submit (script, argv, path=None, wait=True):
+
+    '''
+    [Usage]  submit(script, argv, path, wait)\n
+
+    run main(argv) of a S1_* script in the daemon\n
+
+    script:   'S1_preproc' or 'S1_stack' or 'S1_Geocode' or 'S1_pipeline'
+    argv:     command line arguments, relative paths are resolved here
+    path:     daemon socket, None for socketPath()
+    wait:     True to stream the output and return the result of main
+              False to return the job id at once
+
+    raises SystemExit or RuntimeError when the job fails
+    '''
+
+    path = path or socketPath()
+    message = {'Op': 'run' if wait else 'submit', 'Script': script, 'Argv': absArgv(argv)}
+    for reply in _request(path, message):
+        if 'Output' in reply:
+            sys.stdout.write(reply['Output'])
+            sys.stdout.flush()
+            continue
+        if not wait:
+            return reply['Job']
+        if reply['Status'] == 'exit':
+            raise SystemExit(reply['Code'])
+        if reply['Status'] == 'failed':
+            raise RuntimeError('job %s failed in the daemon: %s' %(reply['Job'], reply['Error']))
+        return reply.get('Result')
+    raise RuntimeError('the daemon closed the connection')
+
+def submitIfRunning (script, argv):
+
+    '''
+    [Usage]  handled, result = submitIfRunning(script, argv)\n
+
+    submit to the daemon if one is running, for the main() of the S1_* scripts\n
+
+    returns (True, result of main) when the daemon ran the job
+            (False, None) when the job should run locally
+    '''
+
+    if not running():
+        return False, None
+    print('Submitting to the daemon on %s' %socketPath())
+    return True, submit(script, argv)
+
+def jobs (path=None):
+
+    '''
+    [Usage]  jobs(path)\n
+
+    list of dict of the jobs of the daemon\n
+    '''
+
+    return next(_request(path or socketPath(), {'Op': 'jobs'}))['Jobs']
+
+def status (job, path=None):
+
+    '''
+    [Usage]  status(job, path)\n
+
+    status, result and output so far of one job\n
+    '''
+
+    return next(_request(path or socketPath(), {'Op': 'status', 'Job': job}))
+
+def inJob ():
+
+    '''
+    [Usage]  inJob()\n
+
+    True if the calling thread runs a job of the daemon\n
+    '''
+
+    return _currentJob() is not None
+
+def stop (path=None):
+
+    '''
+    [Usage]  stop(path)\n
+
+    stop the daemon after its running jobs\n
+    '''
+
+    return next(_request(path or socketPath(), {'Op': 'stop'}))
+
+#%% daemon
+
+
+class _ThreadOutput:
+    # sys.stdout/sys.stderr of the daemon, writes of a job thread go to its job
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        job = getattr(self.local, 'job', None)
+        if job is None:
+            return self.stream.write(text)
+        job.output(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def _currentJob ():
+    # job of the calling thread; the daemon may run as __main__, so the
+    # streams are recognised by their thread-local, not by their class
+    local = getattr(sys.stdout, 'local', None)
+    return getattr(local, 'job', None)
+
+def _setJob (job):
+    for stream in (sys.stdout, sys.stderr):
+        if isinstance(getattr(stream, 'local', None), threading.local):
+            stream.local.job = job
+
+class Job:
+
+    '''
+    one main(argv) run of the daemon\n
+    '''
+
+    def __init__(self, job_id, script, argv):
+        self.id = job_id
+        self.script = script
+        self.argv = argv
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.code = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.text = []
+        self.chunks = queue.Queue()
+        self.done = threading.Event()
+
+    def output(self, text):
+        self.text.append(text)
+        self.chunks.put(text)
+
+    def reply(self):
+        reply = {'Job': self.id, 'Script': self.script, 'Status': self.status, 'Submitted': self.submitted,
+                 'Started': self.started, 'Finished': self.finished}
+        if self.status == 'done':
+            reply['Result'] = self.result
+        if self.status == 'failed':
+            reply['Error'] = self.error
+        if self.status == 'exit':
+            reply['Code'] = self.code
+        return reply
+
+class Daemon:
+
+    '''
+    [Usage]  Daemon(path, workers, heap, tile_cache, parallelism).serve()\n
+
+    serve jobs on a UNIX socket with a warm session\n
+
+    path:        socket path, None for socketPath()
+    workers:     number of jobs run at the same time, more jobs wait in the queue
+    heap:        max JVM heap, e.g. '32G'
+    tile_cache:  JAI tile cache size in MB, shared by the jobs
+    parallelism: number of threads computing tiles
+    '''
+
+    def __init__(self, path=None, workers=1, heap=None, tile_cache=None, parallelism=None):
+        self.path = path or socketPath()
+        self.workers = workers
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.queue = queue.Queue()
+
+        import snappy_for_oriburi as snappy
+        snappy.session.configure(heap, tile_cache, parallelism)
+        self.session = snappy.session
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started = time.time()
+        _setJob(job)
+        try:
+            module = importlib.import_module(job.script)
+            job.result = json.loads(json.dumps(module.main(job.argv), default=str))
+            job.status = 'done'
+        except SystemExit as e:
+            # argparse errors and explicit exits of main
+            job.code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            job.status = 'done' if job.code == 0 else 'exit'
+        except BaseException as e:
+            job.output(traceback.format_exc())
+            job.error = repr(e)
+            job.status = 'failed'
+        finally:
+            # a job failing before trace.finish must not trace into later jobs
+            import trace_for_oriburi as trace
+            trace.disable()
+            _setJob(None)
+            job.finished = time.time()
+            job.chunks.put(None)
+            job.done.set()
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            self._run(job)
+
+    def submit(self, script, argv):
+        if script not in SCRIPTS:
+            raise ValueError('%s is not one of %s' %(script, ', '.join(SCRIPTS)))
+        with self.lock:
+            job = Job('%d' %(len(self.jobs) + 1), script, list(argv))
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def _handle(self, conn):
+        with conn, conn.makefile('rw') as f:
+            def send(message):
+                f.write(json.dumps(message, default=str) + '\n')
+                f.flush()
+            line = f.readline()
+            if not line:
+                return
+            try:
+                message = json.loads(line)
+                op = message.get('Op')
+                if op in ('run', 'submit'):
+                    if self.stopping.is_set():
+                        raise RuntimeError('the daemon is stopping')
+                    job = self.submit(message['Script'], message['Argv'])
+                    if op == 'submit':
+                        send(job.reply())
+                        return
+                    while True:
+                        text = job.chunks.get()
+                        if text is None:
+                            break
+                        send({'Output': text})
+                    send(job.reply())
+                elif op == 'status':
+                    job = self.jobs[message['Job']]
+                    reply = job.reply()
+                    reply['Text'] = ''.join(job.text)
+                    send(reply)
+                elif op == 'jobs':
+                    send({'Jobs': [job.reply() for job in self.jobs.values()]})
+                elif op == 'stop':
+                    self.stopping.set()
+                    send({'Status': 'stopping'})
+                else:
+                    raise ValueError('unknown operation %s' %op)
+            except (BrokenPipeError, ConnectionResetError):
+                # the client went away, the job keeps running
+                pass
+            except Exception as e:
+                send({'Status': 'failed', 'Job': None, 'Error': repr(e)})
+
+    def serve(self):
+
+        '''
+        start the session and serve until stop()\n
+        '''
+
+        if running(self.path):
+            raise RuntimeError('a daemon is already running on %s' %self.path)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        # the JVM starts once, before the first job
+        self.session.start()
+        # set once for all jobs, as the S1_* scripts do when they run alone
+        import warnings
+        warnings.filterwarnings('ignore')
+        sys.stdout = _ThreadOutput(sys.stdout)
+        sys.stderr = _ThreadOutput(sys.stderr)
+        # threads started by a job through trace.bind write to the job
+        import trace_for_oriburi as trace
+        trace.addBinding(_currentJob, _setJob)
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for worker in workers:
+            worker.start()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen()
+        server.settimeout(0.5)
+        print('Daemon serving on %s with %d workers' %(self.path, self.workers))
+        try:
+            while not self.stopping.is_set():
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            os.remove(self.path)
+            for _ in workers:
+                self.queue.put(None)
+            for worker in workers:
+                worker.join()
+            sys.stdout = sys.stdout.stream
+            sys.stderr = sys.stderr.stream
+        print('Daemon stopped')
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Processing daemon with a warm SNAP session")
+    parser.add_argument("command", choices=['serve', 'jobs', 'stop'], help="serve: run the daemon\njobs: list the jobs\nstop: stop the daemon")
+    parser.add_argument("--socket", required=False, help="Socket path\ndefault: $ORIBURI_DAEMON or /tmp/oriburi-<uid>.sock")
+    parser.add_argument("-w", "--workers", required=False, type=int, default=1, help="Number of jobs run at the same time")
+    parser.add_argument("--heap", required=False, help="Max JVM heap\nex) 32G")
+    parser.add_argument("--tileCache", required=False, type=int, help="JAI tile cache size in MB")
+    parser.add_argument("-q", "--parallelism", required=False, type=int, help="Number of threads computing tiles")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.command == 'serve':
+        Daemon(args.socket, args.workers, args.heap, args.tileCache, args.parallelism).serve()
+    elif args.command == 'jobs':
+        for job in jobs(args.socket):
+            print('%-4s %-11s %-8s %s' %(job['Job'], job['Script'], job['Status'],
+                                         time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['Submitted']))))
+    else:
+        print(stop(args.socket)['Status'])
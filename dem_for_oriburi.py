@@ -0,0 +1,210 @@
+# ####################################################################
+# ####                                                               #
+# ####    dem_for_oriburi                                            #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Shared external DEM for a batch of scenes. The union of the scene
+# footprints is mosaicked and cropped once from a local directory of
+# 1x1 degree DEM tiles (Copernicus DSM GeoTIFF or SRTM .hgt) and cached.
+# Cached DEMs are evicted least recently used first under a disk quota.
+# GDAL (osgeo.gdal) is needed to build the mosaic.
+
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+# no-data value of the mosaicked DEM, passed as externalDEMNoDataValue
+NODATA = -32768.0
+
+_TILE = re.compile(r'([NS])(\d{2})(?:_00)?_?([EW])(\d{3})')
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?(?:[eE]-?\d+)?')
+
+#%% functions
+
+
+def wktBounds (wkt):
+
+    '''
+    [Usage]  wktBounds(wkt)\n
+
+    bounding box of a WKT POLYGON or MULTIPOLYGON\n
+
+    returns (min_lon, min_lat, max_lon, max_lat)
+    '''
+
+    values = [float(v) for v in _NUMBER.findall(wkt)]
+    lons = values[0::2]
+    lats = values[1::2]
+    return min(lons), min(lats), max(lons), max(lats)
+
+def footprintBounds (wkts, margin=0.05):
+
+    '''
+    [Usage]  footprintBounds(wkts, margin)\n
+
+    bounding box of the union of scene footprints\n
+
+    wkts:     list of footprints in WKT
+    margin:   margin added on each side in degrees
+    '''
+
+    bounds = [wktBounds(wkt) for wkt in wkts]
+    return (min(b[0] for b in bounds) - margin, min(b[1] for b in bounds) - margin,
+            max(b[2] for b in bounds) + margin, max(b[3] for b in bounds) + margin)
+
+def demTiles (tile_dir):
+
+    '''
+    [Usage]  demTiles(tile_dir)\n
+
+    DEM tiles in tile_dir keyed by the lower left corner (lat, lon)\n
+
+    tile_dir: /path/to/dem/tiles/ (searched recursively)
+              Copernicus_DSM_COG_10_N37_00_E126_00_DEM.tif or N37E126.hgt
+    '''
+
+    tiles = {}
+    for root, _, names in os.walk(tile_dir):
+        for name in names:
+            if not name.lower().endswith(('.tif', '.tiff', '.hgt')):
+                continue
+            m = _TILE.search(name)
+            if m is None:
+                continue
+            lat = int(m.group(2)) * (1 if m.group(1) == 'N' else -1)
+            lon = int(m.group(4)) * (1 if m.group(3) == 'E' else -1)
+            tiles[(lat, lon)] = os.path.join(root, name)
+
+    return tiles
+
+def _readCache (cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'dem_cache.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@contextmanager
+def _cacheLock (cache_dir):
+    # read-modify-write of dem_cache.json by one run at a time, also
+    # between processes sharing the cache
+    import fcntl
+    with open(os.path.join(cache_dir, 'dem_cache.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _writeCache (cache_dir, cache):
+    path = os.path.join(cache_dir, 'dem_cache.json')
+    with open('%s.%d' %(path, os.getpid()), 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace('%s.%d' %(path, os.getpid()), path)
+
+def evictDEM (cache_dir, quota, keep=None):
+
+    '''
+    [Usage]  evictDEM(cache_dir, quota, keep)\n
+
+    remove least recently used DEMs until the cache fits in quota\n
+
+    cache_dir: /path/to/dem/cache/
+    quota:     disk quota in MB
+    keep:      key of a DEM that is never evicted
+    '''
+
+    with _cacheLock(cache_dir):
+        cache = _readCache(cache_dir)
+        total = sum(entry['Size'] for entry in cache.values())
+        for key in sorted(cache, key=lambda k: cache[k]['Used']):
+            if total <= quota*1024*1024:
+                break
+            if key == keep:
+                continue
+            total -= cache[key]['Size']
+            try:
+                os.remove(cache[key]['File'])
+            except OSError:
+                pass
+            print('DEM evicted: %s' %cache[key]['File'])
+            del cache[key]
+        _writeCache(cache_dir, cache)
+
+def prepareDEM (wkts, tile_dir, cache_dir, quota=None, margin=0.05):
+
+    '''
+    [Usage]  prepareDEM(wkts, tile_dir, cache_dir, quota, margin)\n
+
+    cropped external DEM covering all footprints of a batch\n
+
+    wkts:      list of scene footprints or AOI in WKT
+    tile_dir:  /path/to/dem/tiles/
+    cache_dir: /path/to/dem/cache/
+    quota:     disk quota of cache_dir in MB
+               None for no eviction
+    margin:    margin added around the footprints in degrees
+
+    returns path of the cached GeoTIFF to pass as external_dem
+    '''
+
+    min_lon, min_lat, max_lon, max_lat = footprintBounds(wkts, margin)
+    # snap the AOI to a 0.01 degree grid so nearby batches share a DEM
+    min_lon = math.floor(min_lon*100)/100
+    min_lat = math.floor(min_lat*100)/100
+    max_lon = math.ceil(max_lon*100)/100
+    max_lat = math.ceil(max_lat*100)/100
+
+    tiles = demTiles(tile_dir)
+    needed = [tiles[(lat, lon)]
+              for lat in range(math.floor(min_lat), math.ceil(max_lat))
+              for lon in range(math.floor(min_lon), math.ceil(max_lon))
+              if (lat, lon) in tiles]
+    if len(needed) == 0:
+        raise FileNotFoundError('no DEM tile in %s covers %s' %(tile_dir, (min_lon, min_lat, max_lon, max_lat)))
+
+    key = hashlib.md5(json.dumps([os.path.abspath(tile_dir), min_lon, min_lat, max_lon, max_lat,
+                                  sorted(needed)]).encode()).hexdigest()
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, 'dem_%s.tif' %key)
+
+    if not os.path.exists(path):
+        from osgeo import gdal
+
+        print('Mosaicking %d DEM tiles' %len(needed))
+        # own temporary file per run, the last one to finish replaces an equal mosaic
+        tmp = '%s.%d.%d.tmp.tif' %(path, os.getpid(), threading.get_ident())
+        try:
+            vrt = gdal.BuildVRT('', needed, VRTNodata=NODATA)
+            gdal.Translate(tmp, vrt, format='GTiff',
+                           projWin=[min_lon, max_lat, max_lon, min_lat],
+                           outputType=gdal.GDT_Float32, noData=NODATA,
+                           creationOptions=['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+            vrt = None
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    with _cacheLock(cache_dir):
+        cache = _readCache(cache_dir)
+        cache[key] = {'File': path, 'Size': os.path.getsize(path), 'Used': time.time(),
+                      'Bounds': [min_lon, min_lat, max_lon, max_lat]}
+        _writeCache(cache_dir, cache)
+    if quota is not None:
+        evictDEM(cache_dir, quota, keep=key)
+
+    print('External DEM: %s' %path)
+    return path
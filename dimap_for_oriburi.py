@@ -0,0 +1,314 @@
+# ####################################################################
+# ####                                                               #
+# ####    dimap_for_oriburi                                          #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Reading BEAM-DIMAP products written by snappy_for_oriburi.save(..., '.dim')
+# without esa_snappy. Every band is stored as a raw ENVI .img file with
+# an .hdr sidecar in the <product>.data directory. New products on the
+# grid of an existing one are written with writeDim.
+
+import os
+import copy
+import shutil
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+# ENVI data type codes
+ENVI_DTYPES = {1: 'u1', 2: 'i2', 3: 'i4', 4: 'f4', 5: 'f8', 6: 'c8', 9: 'c16',
+               12: 'u2', 13: 'u4', 14: 'i8', 15: 'u8'}
+
+#%% functions
+
+
+def readHdr (hdr):
+
+    '''
+    [Usage]  readHdr(hdr)\n
+
+    read ENVI header file\n
+
+    hdr:      /path/to/band.hdr
+
+    returns dict of header entries with lower case keys
+    '''
+
+    entries = {}
+    with open(hdr) as f:
+        text = f.read()
+
+    key = None
+    for line in text.splitlines():
+        if key is not None:
+            entries[key] += ' ' + line.strip()
+            if '}' in line:
+                key = None
+            continue
+        if '=' not in line:
+            continue
+        k, v = line.split('=', 1)
+        k = k.strip().lower()
+        v = v.strip()
+        entries[k] = v
+        if v.startswith('{') and '}' not in v:
+            key = k
+
+    return entries
+
+def hdrDtype (entries):
+
+    '''
+    [Usage]  hdrDtype(entries)\n
+
+    numpy dtype of an ENVI header including byte order\n
+
+    entries:  dict returned by readHdr
+    '''
+
+    dtype = np.dtype(ENVI_DTYPES[int(entries['data type'])])
+    if int(entries.get('byte order', 1)) == 1:
+        return dtype.newbyteorder('>')
+    return dtype.newbyteorder('<')
+
+def dimInfo (dim):
+
+    '''
+    [Usage]  dimInfo(dim)\n
+
+    read band information of a BEAM-DIMAP product\n
+
+    dim:      /path/to/product.dim
+
+    returns dict with 'Product Name', 'Width', 'Height' and 'Bands'
+    'Bands' is a list of dicts in band index order with
+    'Name', 'Index', 'Header', 'Image', 'Virtual'
+    '''
+
+    root = ET.parse(dim).getroot()
+    base = os.path.dirname(os.path.abspath(dim))
+
+    name = root.findtext('Dataset_Id/DATASET_NAME')
+    if name is None:
+        name = os.path.splitext(os.path.basename(dim))[0]
+    width = int(root.findtext('Raster_Dimensions/NCOLS'))
+    height = int(root.findtext('Raster_Dimensions/NROWS'))
+
+    files = {}
+    for data_file in root.iter('Data_File'):
+        href = data_file.find('DATA_FILE_PATH').get('href')
+        files[int(data_file.findtext('BAND_INDEX'))] = os.path.join(base, href)
+
+    bands = []
+    for info in root.iter('Spectral_Band_Info'):
+        index = int(info.findtext('BAND_INDEX'))
+        hdr = files.get(index)
+        bands.append({'Name': info.findtext('BAND_NAME'),
+                      'Index': index,
+                      'Header': hdr,
+                      'Image': None if hdr is None else os.path.splitext(hdr)[0] + '.img',
+                      'Virtual': info.findtext('VIRTUAL_BAND', 'false').strip() == 'true'})
+    bands.sort(key=lambda b: b['Index'])
+
+    return {'Product Name': name, 'Width': width, 'Height': height, 'Bands': bands}
+
+def dimMetadata (dim, element='Abstracted_Metadata'):
+
+    '''
+    [Usage]  dimMetadata(dim, element)\n
+
+    attributes of a metadata element of a BEAM-DIMAP product\n
+
+    dim:      /path/to/product.dim
+    element:  name of the MDElem, 'Abstracted_Metadata' for the reference
+
+    returns dict of attribute name and text, empty if there is no such element
+    '''
+
+    for elem in ET.parse(dim).getroot().iter('MDElem'):
+        if elem.get('name') == element:
+            return {attr.get('name'): (attr.text or '').strip() for attr in elem.findall('MDATTR')}
+
+    return {}
+
+def dimSecondaryMetadata (dim):
+
+    '''
+    [Usage]  dimSecondaryMetadata(dim)\n
+
+    abstracted metadata of every secondary of a coregistered stack\n
+
+    dim:      /path/to/stack.dim
+
+    returns list of dicts as dimMetadata, one per element of Slave_Metadata
+    '''
+
+    for elem in ET.parse(dim).getroot().iter('MDElem'):
+        if elem.get('name') == 'Slave_Metadata':
+            return [{attr.get('name'): (attr.text or '').strip() for attr in child.findall('MDATTR')}
+                    for child in elem.findall('MDElem')]
+
+    return []
+
+def dimBandNames (dim):
+
+    '''
+    [Usage]  dimBandNames(dim)\n
+
+    band names of a BEAM-DIMAP product, same as extBandNames\n
+
+    dim:      /path/to/product.dim
+    '''
+
+    return [b['Name'] for b in dimInfo(dim)['Bands']]
+
+def dimBand (dim, bandName, mode='r'):
+
+    '''
+    [Usage]  dimBand(dim, bandName)\n
+
+    zero-copy view of band data of a BEAM-DIMAP product\n
+
+    dim:      /path/to/product.dim
+    bandName: name of target band data
+    mode:     'r' for read only or 'r+' for in-place modification
+
+    returns (h, w) np.memmap in the native dtype and byte order of the .img
+    scaling factor and no-data value are not applied
+    '''
+
+    for b in dimInfo(dim)['Bands']:
+        if b['Name'] != bandName:
+            continue
+        if b['Virtual'] or b['Header'] is None:
+            raise ValueError('%s is a virtual band without image data' %bandName)
+        return _memmap(b, mode)
+
+    raise KeyError('%s is not in %s' %(bandName, dim))
+
+def _memmap (band, mode):
+    entries = readHdr(band['Header'])
+    shape = (int(entries['lines']), int(entries['samples']))
+    return np.memmap(band['Image'], dtype=hdrDtype(entries), mode=mode,
+                     offset=int(entries.get('header offset', 0)), shape=shape)
+
+def dimBandForOriburi (dim, bandName):
+
+    '''
+    [Usage]  dimBandForOriburi(dim, bandName)\n
+
+    same as extBandForOriburi without esa_snappy\n
+
+    dim:      /path/to/product.dim
+    bandName: name of target band data
+    '''
+
+    return {'Band' : dimBand(dim, bandName), 'Product Name' : dimInfo(dim)['Product Name']}
+
+def dimBands (dim):
+
+    '''
+    [Usage]  dimBands(dim)\n
+
+    zero-copy views of all bands with image data\n
+
+    dim:      /path/to/product.dim
+
+    returns dict of band name and (h, w) np.memmap
+    '''
+
+    return {b['Name']: _memmap(b, 'r')
+            for b in dimInfo(dim)['Bands'] if not b['Virtual'] and b['Header'] is not None}
+
+def writeDim (template, save_dir, bandNames):
+
+    '''
+    [Usage]  writeDim(template, save_dir, bandNames)\n
+
+    create a float32 BEAM-DIMAP product on the grid of an existing product\n
+
+    template:  /path/to/product.dim with the raster size and geocoding to copy
+    save_dir:  /path/to/save/directory/productname.dim
+    bandNames: list of band names of the new product
+
+    returns dict of band name and writable (h, w) np.memmap
+    no-data value of every band is NaN
+    '''
+
+    tree = ET.parse(template)
+    root = tree.getroot()
+    info = dimInfo(template)
+    width, height = info['Width'], info['Height']
+    first = [b for b in info['Bands'] if b['Header'] is not None][0]
+    entries = readHdr(first['Header'])
+
+    name = os.path.splitext(os.path.basename(save_dir))[0]
+    data_dir = os.path.splitext(save_dir)[0] + '.data'
+    os.makedirs(data_dir, exist_ok=True)
+
+    dataset = root.find('Dataset_Id/DATASET_NAME')
+    if dataset is not None:
+        dataset.text = name
+    root.find('Raster_Dimensions/NBANDS').text = str(len(bandNames))
+
+    access = root.find('Data_Access')
+    for data_file in access.findall('Data_File'):
+        access.remove(data_file)
+    # tie-point grids (geocoding of radar products) are copied along
+    base = os.path.dirname(os.path.abspath(template))
+    for path in access.iter('TPG_FILE_PATH'):
+        href = path.get('href')
+        os.makedirs(os.path.join(data_dir, 'tie_point_grids'), exist_ok=True)
+        for ext in ('.hdr', '.img'):
+            shutil.copyfile(os.path.join(base, os.path.splitext(href)[0] + ext),
+                            os.path.join(data_dir, 'tie_point_grids', os.path.splitext(os.path.basename(href))[0] + ext))
+        path.set('href', '%s.data/tie_point_grids/%s' %(name, os.path.basename(href)))
+    interpretation = root.find('Image_Interpretation')
+    band_info = interpretation.find('Spectral_Band_Info')
+    for element in interpretation.findall('Spectral_Band_Info'):
+        interpretation.remove(element)
+    for tag in ('EXPRESSION', 'VIRTUAL_BAND', 'VALID_MASK_TERM', 'ANCILLARY_BAND'):
+        for element in band_info.findall(tag):
+            band_info.remove(element)
+
+    bands = {}
+    for index, bandName in enumerate(bandNames):
+        data_file = ET.SubElement(access, 'Data_File')
+        ET.SubElement(data_file, 'DATA_FILE_PATH', href='%s.data/%s.hdr' %(name, bandName))
+        ET.SubElement(data_file, 'BAND_INDEX').text = str(index)
+
+        element = copy.deepcopy(band_info)
+        for tag, value in (('BAND_INDEX', str(index)), ('BAND_NAME', bandName),
+                           ('DESCRIPTION', ''), ('PHYSICAL_UNIT', ''), ('DATA_TYPE', 'float32'),
+                           ('SCALING_FACTOR', '1.0'), ('SCALING_OFFSET', '0.0'),
+                           ('LOG10_SCALED', 'false'),
+                           ('NO_DATA_VALUE_USED', 'true'), ('NO_DATA_VALUE', 'NaN')):
+            child = element.find(tag)
+            if child is None:
+                child = ET.SubElement(element, tag)
+            child.text = value
+        interpretation.append(element)
+
+        header = dict(entries)
+        header.update({'description': '{%s}' %bandName, 'samples': str(width), 'lines': str(height),
+                       'bands': '1', 'header offset': '0', 'data type': '4',
+                       'interleave': 'bsq', 'byte order': '1', 'band names': '{ %s }' %bandName})
+        with open(os.path.join(data_dir, bandName + '.hdr'), 'w') as f:
+            f.write('ENVI\n')
+            for key, value in header.items():
+                f.write('%s = %s\n' %(key, value))
+
+        bands[bandName] = np.memmap(os.path.join(data_dir, bandName + '.img'), dtype='>f4',
+                                    mode='w+', shape=(height, width))
+
+    ET.indent(root)
+    tree.write(save_dir, encoding='ISO-8859-1', xml_declaration=True)
+
+    return bands
@@ -0,0 +1,156 @@
+# ####################################################################
+# ####                                                               #
+# ####    lookup_for_oriburi                                         #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Geocoding a coregistered stack through a cached geometric lookup.
+# snappy_for_oriburi.tc_lookup terrain-corrects two bands holding the
+# pixel coordinates of the reference grid, which gives the source pixel
+# of every map pixel. All dates share that grid, so each of them is
+# geocoded by bilinear resampling through the lookup, tile by tile.
+
+import numpy as np
+
+from tiles_for_oriburi import tileWindows
+
+# lookup bands, 1-based so that the no-data value 0 of Terrain-Correction
+# is never a valid coordinate
+LOOKUP_X = 'lookup_x'
+LOOKUP_Y = 'lookup_y'
+LOOKUP_EXPRESSIONS = {LOOKUP_X: 'X + 0.5', LOOKUP_Y: 'Y + 0.5'}
+
+#%% functions
+
+
+def lookupWindow (lx, ly, width, height):
+
+    '''
+    [Usage]  lookupWindow(lx, ly, width, height)\n
+
+    source pixels needed to resample one tile of the lookup\n
+
+    lx, ly:   lookup tile as stored (1-based source column and row)
+    width:    source raster width
+    height:   source raster height
+
+    returns (x, y, w, h) of the source window or None if the tile has no valid pixel
+    '''
+
+    valid = (lx > 0) & (ly > 0)
+    if not valid.any():
+        return None
+    x = max(int(np.floor(lx[valid].min())) - 1, 0)
+    y = max(int(np.floor(ly[valid].min())) - 1, 0)
+    w = min(int(np.floor(lx[valid].max())) + 1, width) - x
+    h = min(int(np.floor(ly[valid].max())) + 1, height) - y
+
+    return x, y, w, h
+
+def bilinear (window, sx, sy, out=None):
+
+    '''
+    [Usage]  bilinear(window, sx, sy, out)\n
+
+    bilinear resampling of a source window at fractional pixel positions\n
+
+    window:   (h, w) source window
+    sx, sy:   0-based column and row of each target pixel in the window
+              NaN for target pixels without source
+    out:      preallocated float32 array with the shape of sx
+              new array is allocated when None
+
+    returns out with NaN outside the window
+    '''
+
+    if out is None:
+        out = np.empty(sx.shape, np.float32)
+    h, w = window.shape
+
+    valid = np.isfinite(sx) & np.isfinite(sy) & (sx >= 0) & (sy >= 0) & (sx <= w-1) & (sy <= h-1)
+    x = sx[valid]
+    y = sy[valid]
+    x0 = np.minimum(np.floor(x).astype(np.intp), max(w-2, 0))
+    y0 = np.minimum(np.floor(y).astype(np.intp), max(h-2, 0))
+    x1 = np.minimum(x0 + 1, w-1)
+    y1 = np.minimum(y0 + 1, h-1)
+    fx = x - x0
+    fy = y - y0
+
+    top = window[y0, x0] * (1-fx) + window[y0, x1] * fx
+    bottom = window[y1, x0] * (1-fx) + window[y1, x1] * fx
+
+    out[...] = np.nan
+    out[valid] = top * (1-fy) + bottom * fy
+
+    return out
+
+def applyLookup (lx, ly, read, bandNames, width, height, bands, tile_size=1024):
+
+    '''
+    [Usage]  applyLookup(lx, ly, read, bandNames, width, height, bands, tile_size)\n
+
+    geocode bands of one date through a lookup, tile by tile\n
+
+    lx, ly:    (H, W) lookup bands on the map grid, e.g. np.memmap of dimap_for_oriburi
+    read:      function read(bandName, x, y, w, h) returning a (h, w) source window
+    bandNames: source bands to geocode
+    width:     source raster width
+    height:    source raster height
+    bands:     dict of band name and (H, W) writable output array
+               see dimap_for_oriburi.writeDim
+    tile_size: int for square tiles or (rows, cols) of the map grid
+    '''
+
+    H, W = lx.shape
+    for row_off, col_off, rows, cols, _, _, _, _ in tileWindows(W, H, tile_size):
+        tx = np.asarray(lx[row_off:row_off+rows, col_off:col_off+cols], np.float32)
+        ty = np.asarray(ly[row_off:row_off+rows, col_off:col_off+cols], np.float32)
+        window = lookupWindow(tx, ty, width, height)
+        if window is None:
+            for bandName in bandNames:
+                bands[bandName][row_off:row_off+rows, col_off:col_off+cols] = np.nan
+            continue
+
+        x, y, w, h = window
+        invalid = (tx <= 0) | (ty <= 0)
+        sx = tx - 1 - x
+        sy = ty - 1 - y
+        sx[invalid] = np.nan
+        sy[invalid] = np.nan
+
+        out = np.empty((rows, cols), np.float32)
+        for bandName in bandNames:
+            bilinear(read(bandName, x, y, w, h), sx, sy, out)
+            bands[bandName][row_off:row_off+rows, col_off:col_off+cols] = out
+
+def geocodeDim (read, bandNames, width, height, lookup_dim, save_dir, tile_size=1024):
+
+    '''
+    [Usage]  geocodeDim(read, bandNames, width, height, lookup_dim, save_dir, tile_size)\n
+
+    geocode bands through a saved lookup into a BEAM-DIMAP product\n
+
+    read:       function read(bandName, x, y, w, h) returning a (h, w) source window
+    bandNames:  source bands to geocode
+    width:      source raster width
+    height:     source raster height
+    lookup_dim: /path/to/lookup.dim saved from snappy_for_oriburi.tc_lookup
+    save_dir:   /path/to/save/directory/productname.dim
+    '''
+
+    import dimap_for_oriburi as dimap
+
+    lx = dimap.dimBand(lookup_dim, LOOKUP_X)
+    ly = dimap.dimBand(lookup_dim, LOOKUP_Y)
+    bands = dimap.writeDim(lookup_dim, save_dir, bandNames)
+
+    applyLookup(lx, ly, read, bandNames, width, height, bands, tile_size)
+    for band in bands.values():
+        band.flush()
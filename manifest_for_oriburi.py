@@ -0,0 +1,104 @@
+# ####################################################################
+# ####                                                               #
+# ####    manifest_for_oriburi                                       #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Run manifests written next to every output as <output>.manifest.json.
+# A scene is skipped when its manifest is 'done' and records the same
+# inputs, operator parameters and library version. A crashed run leaves
+# 'running' manifests behind, which are processed again on restart.
+
+import os
+import json
+import time
+
+#%% functions
+
+
+def manifestPath (save_dir):
+
+    '''
+    [Usage]  manifestPath(save_dir)\n
+
+    path of the manifest of an output\n
+    '''
+
+    return save_dir + '.manifest.json'
+
+def record (inputs, parameters, version):
+
+    '''
+    [Usage]  record(inputs, parameters, version)\n
+
+    describe how an output is made\n
+
+    inputs:     list of input files
+    parameters: dict of processing parameters
+    version:    library version
+    '''
+
+    files = []
+    for f in inputs:
+        st = os.stat(f)
+        files.append({'File': os.path.abspath(str(f)), 'Size': st.st_size, 'Mtime': st.st_mtime})
+
+    return {'Inputs': files, 'Parameters': parameters, 'Version': version}
+
+def readManifest (save_dir):
+
+    '''
+    [Usage]  readManifest(save_dir)\n
+
+    manifest of an output, None if there is none\n
+    '''
+
+    try:
+        with open(manifestPath(save_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def isDone (save_dir, rec):
+
+    '''
+    [Usage]  isDone(save_dir, rec)\n
+
+    True if save_dir was completed from the same record\n
+    '''
+
+    manifest = readManifest(save_dir)
+    if manifest is None or manifest.get('Status') != 'done':
+        return False
+    if not os.path.exists(save_dir):
+        return False
+
+    rec = json.loads(json.dumps(rec))
+    return all(manifest.get(key) == rec[key] for key in ('Inputs', 'Parameters', 'Version'))
+
+def mark (save_dir, rec, status, **extra):
+
+    '''
+    [Usage]  mark(save_dir, rec, status)\n
+
+    write the manifest of an output\n
+
+    status:   'running' or 'done' or 'failed'
+    '''
+
+    manifest = dict(rec)
+    manifest['Output'] = os.path.abspath(save_dir)
+    manifest['Status'] = status
+    manifest['Time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    manifest.update(extra)
+
+    path = manifestPath(save_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
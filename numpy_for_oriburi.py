@@ -0,0 +1,622 @@
+# ####################################################################
+# ####                                                               #
+# ####    numpy_for_oriburi                                          #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# NumPy radiometric engine replacing the Multilook and LinearToFromdB
+# operators of SNAP: intensity from i/q, block averaging of nAzLooks x
+# nRgLooks pixels and 10*log10. Input is read chunk by chunk from
+# np.memmap (dimap_for_oriburi) into reused buffers and written into a
+# preallocated output, so no full-size temporary is created.
+#
+# Boxcar, Lee and Lee Sigma speckle filters use summed-area tables of
+# halo-padded tiles, so their cost per pixel does not grow with the
+# kernel size. Tiles are filtered in a thread pool; NumPy releases the GIL.
+#
+# Coherence of coregistered stacks is estimated from separable moving sums
+# of halo tiles, reading each reference tile once for all secondaries.
+#
+# Agreement with SNAP (Multilook with outputIntensity, LinearToFromdB):
+# linear output within LINEAR_RTOL relative, dB output within DB_ATOL dB.
+# Block means are accumulated in float64 like SNAP; no-data pixels (0) are
+# averaged like any other pixel and 0 becomes NaN in dB.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import dimap_for_oriburi as dimap
+import trace_for_oriburi as trace
+from tiles_for_oriburi import tileWindows
+
+SPECKLE_FILTERS = ('BOXCAR', 'Lee', 'Lee Sigma')
+
+# agreement with SNAP, checked by tests/test_numpy_engine.py against the
+# formulas of the operators and by benchmarks/bench_suite.py --snap against SNAP
+LINEAR_RTOL = 1e-5
+DB_ATOL = 1e-4
+
+#%% functions
+
+
+def dimLooks (dim):
+
+    '''
+    [Usage]  dimLooks(dim)\n
+
+    range and azimuth looks recorded in the Abstracted_Metadata of a product\n
+
+    dim:      /path/to/product.dim
+
+    returns (range_looks, azimuth_looks)
+    '''
+
+    metadata = dimap.dimMetadata(dim)
+    return (int(round(float(metadata.get('range_looks', 1)))),
+            int(round(float(metadata.get('azimuth_looks', 1)))))
+
+def _buffer (buffers, key, n, dtype=np.float32):
+    # reused flat buffer with at least n elements
+    if key not in buffers or buffers[key].size < n:
+        buffers[key] = np.empty(n, dtype)
+    return buffers[key][:n]
+
+def looked (i, q, x, y, w, h, rg=1, az=1, dB=False, out=None, buffers=None):
+
+    '''
+    [Usage]  looked(i, q, x, y, w, h, rg, az, dB, out, buffers)\n
+
+    one window of intensity, multilooking and dB\n
+
+    i:        (H, W) band, e.g. np.memmap of dimap_for_oriburi.dimBand
+    q:        (H, W) imaginary band of a complex pair
+              None when i is already intensity
+    x, y:     upper left pixel of the window in multilooked pixels
+    w, h:     width and height of the window in multilooked pixels
+    rg, az:   number of looks in range and azimuth
+    dB:       True to convert to 10*log10
+    out:      preallocated float32 array of shape (h, w)
+              new array is allocated when None
+    buffers:  dict of reused buffers, pass the same dict for every window
+
+    returns out
+    '''
+
+    if out is None:
+        out = np.empty((h, w), np.float32)
+    if buffers is None:
+        buffers = {}
+
+    rows = slice(y*az, (y+h)*az)
+    cols = slice(x*rg, (x+w)*rg)
+    full = _buffer(buffers, 'full', h*az * w*rg).reshape(h*az, w*rg)
+    if q is None:
+        full[...] = i[rows, cols]
+    else:
+        np.square(i[rows, cols], out=full)
+        square = _buffer(buffers, 'square', h*az * w*rg).reshape(h*az, w*rg)
+        np.square(q[rows, cols], out=square)
+        full += square
+
+    if rg == 1 and az == 1:
+        out[...] = full
+    else:
+        acc = _buffer(buffers, 'acc', h*w, np.float64).reshape(h, w)
+        full.reshape(h, az, w, rg).sum(axis=(1, 3), dtype=np.float64, out=acc)
+        acc /= rg*az
+        out[...] = acc
+
+    if dB:
+        invalid = ~(out > 0)
+        np.log10(out, out=out, where=~invalid)
+        out *= 10
+        out[invalid] = np.nan
+
+    return out
+
+def radiometry (i, out, q=None, rg=1, az=1, dB=False, chunk_rows=1024):
+
+    '''
+    [Usage]  radiometry(i, out, q, rg, az, dB, chunk_rows)\n
+
+    intensity, multilooking and dB of a whole band, chunk by chunk\n
+
+    i:          (H, W) band, e.g. np.memmap of dimap_for_oriburi.dimBand
+    out:        preallocated (H//az, W//rg) float32 array or writable np.memmap
+    q:          (H, W) imaginary band of a complex pair, None for intensity input
+    rg, az:     number of looks in range and azimuth
+    dB:         True to convert to 10*log10
+    chunk_rows: number of output rows per chunk
+    '''
+
+    h, w = i.shape[0]//az, i.shape[1]//rg
+    if out.shape != (h, w):
+        raise ValueError('output shape %s does not match %s' %(out.shape, (h, w)))
+
+    buffers = {}
+    chunk = _buffer(buffers, 'out', chunk_rows*w).reshape(chunk_rows, w)
+    for y in range(0, h, chunk_rows):
+        rows = min(chunk_rows, h - y)
+        looked(i, q, 0, y, w, rows, rg, az, dB, chunk[:rows], buffers)
+        out[y:y+rows] = chunk[:rows]
+
+    return out
+
+def linear2dB (src, out, chunk_rows=1024):
+
+    '''
+    [Usage]  linear2dB(src, out, chunk_rows)\n
+
+    same as Linear2dB of snappy_for_oriburi on arrays\n
+    '''
+
+    return radiometry(src, out, dB=True, chunk_rows=chunk_rows)
+
+def intensity (i, q, out, chunk_rows=1024):
+
+    '''
+    [Usage]  intensity(i, q, out, chunk_rows)\n
+
+    i*i + q*q of a complex pair\n
+    '''
+
+    return radiometry(i, out, q=q, chunk_rows=chunk_rows)
+
+def multilook (src, out, rg, az, q=None, chunk_rows=1024):
+
+    '''
+    [Usage]  multilook(src, out, rg, az, q, chunk_rows)\n
+
+    same as multi_look of snappy_for_oriburi on arrays (outputIntensity)\n
+    '''
+
+    return radiometry(src, out, q=q, rg=rg, az=az, chunk_rows=chunk_rows)
+
+def radiometryBands (dim, dB=False):
+
+    '''
+    [Usage]  radiometryBands(dim, dB)\n
+
+    output bands of the engine for a BEAM-DIMAP product, named as SNAP does\n
+
+    dim:      /path/to/product.dim
+    dB:       True for dB output
+
+    returns list of (output name, i band, q band or None)
+    i_X/q_X pairs become Intensity_X, dB output bands end with _db
+    virtual bands are skipped
+    '''
+
+    info = dimap.dimInfo(dim)
+    names = [b['Name'] for b in info['Bands'] if not b['Virtual'] and b['Header'] is not None]
+
+    bands = []
+    for name in names:
+        if name.startswith('q_') and 'i_' + name[2::] in names:
+            continue
+        if name.startswith('i_') and 'q_' + name[2::] in names:
+            bands.append(['Intensity_' + name[2::], name, 'q_' + name[2::]])
+        else:
+            bands.append([name, name, None])
+    if dB:
+        for band in bands:
+            band[0] = band[0] + '_db'
+
+    return [tuple(band) for band in bands]
+
+def radiometryReader (dim, rg=1, az=1, dB=False):
+
+    '''
+    [Usage]  radiometryReader(dim, rg, az, dB)\n
+
+    window reader of a product after intensity, multilooking and dB\n
+
+    dim:      /path/to/product.dim
+    rg, az:   number of looks in range and azimuth
+    dB:       True for dB output
+
+    returns dict with 'Bands', 'Width', 'Height' and 'Read'
+    'Read' is read(bandName, x, y, w, h) as used by lookup_for_oriburi.geocodeDim
+    '''
+
+    bands = {name: (dimap.dimBand(dim, i), None if q is None else dimap.dimBand(dim, q))
+             for name, i, q in radiometryBands(dim, dB)}
+    info = dimap.dimInfo(dim)
+    buffers = {}
+
+    def read(bandName, x, y, w, h):
+        i, q = bands[bandName]
+        out = _buffer(buffers, 'out', h*w).reshape(h, w)
+        return looked(i, q, x, y, w, h, rg, az, dB, out, buffers)
+
+    return {'Bands': list(bands), 'Width': info['Width']//rg, 'Height': info['Height']//az,
+            'Read': read}
+
+def _sat (tile):
+    # summed-area table with a leading row and column of zeros
+    sat = np.zeros((tile.shape[0]+1, tile.shape[1]+1), np.float64)
+    np.cumsum(tile, axis=0, dtype=np.float64, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+def _boxBounds (n, size, start, stop):
+    # window bounds of positions start..stop-1, clipped to 0..n
+    half = size//2
+    pos = np.arange(start, stop)
+    return np.maximum(pos - half, 0), np.minimum(pos + half + 1, n)
+
+def _boxSum (sat, r0, r1, c0, c1):
+    return (sat[np.ix_(r1, c1)] - sat[np.ix_(r0, c1)] - sat[np.ix_(r1, c0)] + sat[np.ix_(r0, c0)])
+
+def boxStats (tile, kernel_size, rows, cols):
+
+    '''
+    [Usage]  boxStats(tile, kernel_size, rows, cols)\n
+
+    local mean and variance of a tile from summed-area tables\n
+
+    tile:        (h, w) tile including halo
+    kernel_size: size of the square kernel
+    rows, cols:  (start, stop) of the output pixels in the tile
+                 windows are clipped at the tile border
+
+    returns (count, mean, variance) of shape (stop-start) for rows and cols
+    '''
+
+    r0, r1 = _boxBounds(tile.shape[0], kernel_size, *rows)
+    c0, c1 = _boxBounds(tile.shape[1], kernel_size, *cols)
+    count = ((r1 - r0)[:, None] * (c1 - c0)[None, :]).astype(np.float64)
+
+    mean = _boxSum(_sat(tile), r0, r1, c0, c1) / count
+    square = _boxSum(_sat(np.square(tile, dtype=np.float64)), r0, r1, c0, c1) / count
+    variance = np.maximum(square - mean*mean, 0)
+
+    return count, mean, variance
+
+def _lee (center, mean, variance, enl):
+    # minimum mean square error estimate of Lee for multiplicative noise
+    cu2 = 1.0 / enl
+    signal = np.maximum((variance - mean*mean*cu2) / (1 + cu2), 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b = np.where(variance > 0, signal / variance, 0)
+    return mean + b * (center - mean)
+
+def sigmaRange (enl, sigma=0.9):
+
+    '''
+    [Usage]  sigmaRange(enl, sigma)\n
+
+    interval of normalized speckle intensity holding sigma of its probability\n
+
+    enl:      equivalent number of looks, speckle ~ Gamma(enl, 1/enl)
+    sigma:    probability inside the interval, 0.5 to 0.95
+
+    returns (I1, I2) chosen so that the mean inside the interval is 1
+    as in the improved Lee Sigma filter (Lee et al., 2009)
+    '''
+
+    u = np.linspace(1e-6, 20, 200001)
+    # unnormalized Gamma density, normalized by the cumulative sums
+    pdf = np.exp((enl-1)*np.log(u) - enl*u)
+    cdf = np.cumsum(pdf)
+    moment = np.cumsum(pdf*u)
+    moment /= cdf[-1]
+    cdf /= cdf[-1]
+
+    lower = np.linspace(0, 1-sigma, 1001)
+    i1 = np.interp(lower, cdf, u)
+    i2 = np.interp(lower+sigma, cdf, u)
+    mean = (np.interp(i2, u, moment) - np.interp(i1, u, moment)) / sigma
+    best = np.argmin(np.abs(mean - 1))
+
+    return float(i1[best]), float(i2[best])
+
+def _tileRange (band, window):
+    # min of the positive values and max of the core of a tile
+    row_off, col_off, rows, cols = window[0:4]
+    core = np.asarray(band[row_off:row_off+rows, col_off:col_off+cols])
+    valid = core[core > 0]
+    if valid.size == 0:
+        return None
+    return float(valid.min()), float(valid.max())
+
+def _sigmaEdges (band, windows, bins, pool):
+    # intensity bins of the whole band, the same for every tile so that
+    # the result does not depend on the tiling
+    ranges = [r for r in pool.map(trace.bind(lambda window: _tileRange(band, window)), windows) if r is not None]
+    if len(ranges) == 0:
+        return None
+    low = min(r[0] for r in ranges)
+    high = max(r[1] for r in ranges)
+    return np.geomspace(low, high*(1+1e-6), bins+1)
+
+def _leeSigma (tile, kernel_size, rows, cols, enl, sigma_range, edges):
+    # a priori mean from a 3x3 Lee filter, then the Lee estimate over the
+    # pixels of the window inside the sigma range of that mean; the range
+    # test uses intensity bins so that every bin is one summed-area table
+    _, mean3, var3 = boxStats(tile, 3, rows, cols)
+    center = tile[rows[0]:rows[1], cols[0]:cols[1]].astype(np.float64)
+    prior = _lee(center, mean3, var3, enl)
+    i1, i2 = sigma_range
+
+    if edges is None:
+        return center
+    bins = len(edges) - 1
+    index = np.clip(np.searchsorted(edges, tile, side='right') - 1, -1, bins-1)
+
+    r0, r1 = _boxBounds(tile.shape[0], kernel_size, *rows)
+    c0, c1 = _boxBounds(tile.shape[1], kernel_size, *cols)
+    lo = np.clip(np.searchsorted(edges, prior*i1, side='right') - 1, 0, bins-1)
+    hi = np.clip(np.searchsorted(edges, prior*i2, side='right') - 1, 0, bins-1)
+
+    count = np.zeros(center.shape)
+    total = np.zeros(center.shape)
+    square = np.zeros(center.shape)
+    for b in range(bins):
+        inside = (lo <= b) & (hi >= b)
+        if not inside.any():
+            continue
+        member = (index == b)
+        values = np.where(member, tile, 0).astype(np.float64)
+        count += inside * _boxSum(_sat(member), r0, r1, c0, c1)
+        total += inside * _boxSum(_sat(values), r0, r1, c0, c1)
+        square += inside * _boxSum(_sat(values*values), r0, r1, c0, c1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, total / count, prior)
+        variance = np.where(count > 1, np.maximum(square / count - mean*mean, 0), 0)
+
+    return _lee(center, mean, variance, enl)
+
+def _filterTile (band, out, filter_name, kernel_size, enl, sigma_range, edges, window):
+    row_off, col_off, rows, cols, y, x, h, w = window
+    tile = np.asarray(band[y:y+h, x:x+w], np.float32)
+    core_rows = (row_off - y, row_off - y + rows)
+    core_cols = (col_off - x, col_off - x + cols)
+
+    if filter_name == 'BOXCAR':
+        _, result, _ = boxStats(tile, kernel_size, core_rows, core_cols)
+    elif filter_name == 'Lee':
+        _, mean, variance = boxStats(tile, kernel_size, core_rows, core_cols)
+        center = tile[core_rows[0]:core_rows[1], core_cols[0]:core_cols[1]]
+        result = _lee(center, mean, variance, enl)
+    else:
+        result = _leeSigma(tile, kernel_size, core_rows, core_cols, enl, sigma_range, edges)
+
+    out[row_off:row_off+rows, col_off:col_off+cols] = result
+
+def speckle_filter (band, filter_name, kernel_size, out=None, tile_size=512, workers=None,
+                    enl=1.0, sigma=0.9, bins=32):
+
+    '''
+    [Usage]  speckle_filter(band, filter_name, kernel_size, out, tile_size, workers)\n
+
+    speckle filtering of an intensity band in NumPy, see speckle_filter of snappy_for_oriburi\n
+
+    band:        (H, W) intensity band, e.g. np.memmap of dimap_for_oriburi.dimBand
+    filter_name: 'BOXCAR' or 'Lee' or 'Lee Sigma'
+                 other filters are only available in snappy_for_oriburi
+    kernel_size: size of kernel, same size in each x and y direction
+    out:         preallocated (H, W) float32 array or writable np.memmap
+                 new array is allocated when None
+    tile_size:   int for square tiles or (rows, cols)
+    workers:     number of threads, None for the number of CPUs
+    enl:         equivalent number of looks of the band (Lee and Lee Sigma)
+    sigma:       probability of the sigma range (Lee Sigma)
+    bins:        number of intensity bins of the sigma range test (Lee Sigma)
+
+    returns out
+    '''
+
+    if filter_name not in SPECKLE_FILTERS:
+        raise ValueError('%s is not one of %s, use snappy_for_oriburi.speckle_filter'
+                         %(filter_name, ', '.join(SPECKLE_FILTERS)))
+    kernel_size = int(kernel_size)
+    if out is None:
+        out = np.empty(band.shape, np.float32)
+
+    height, width = band.shape
+    windows = list(tileWindows(width, height, tile_size, kernel_size//2))
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        sigma_range, edges = None, None
+        if filter_name == 'Lee Sigma':
+            # once per band, not per tile
+            sigma_range = sigmaRange(float(enl), sigma)
+            edges = _sigmaEdges(band, windows, bins, pool)
+        for future in [pool.submit(trace.bind(_filterTile), band, out, filter_name, kernel_size,
+                                   float(enl), sigma_range, edges, window) for window in windows]:
+            future.result()
+
+    return out
+
+def _movingSum (a, size, axis, start, stop):
+    # moving sums of size along axis for positions start..stop-1,
+    # windows clipped at the border of a
+    n = a.shape[axis]
+    half = size//2
+    pos = np.arange(start, stop)
+    lo = np.maximum(pos - half, 0)
+    hi = np.minimum(pos - half + size, n)
+    shape = list(a.shape)
+    shape[axis] = n + 1
+    csum = np.zeros(shape, np.complex128 if np.iscomplexobj(a) else np.float64)
+    np.cumsum(a, axis=axis, dtype=csum.dtype, out=csum[1:] if axis == 0 else csum[:, 1:])
+    return np.take(csum, hi, axis=axis) - np.take(csum, lo, axis=axis)
+
+def boxSum (a, win_rg, win_az, rows, cols):
+
+    '''
+    [Usage]  boxSum(a, win_rg, win_az, rows, cols)\n
+
+    sums over win_az x win_rg windows as two separable moving sums\n
+
+    a:           (h, w) real or complex tile including halo
+    rows, cols:  (start, stop) of the output pixels in the tile
+    '''
+
+    return _movingSum(_movingSum(a, win_az, 0, *rows), win_rg, 1, *cols)
+
+def coherencePairs (dim):
+
+    '''
+    [Usage]  coherencePairs(dim)\n
+
+    reference/secondary pairs of complex bands of a stack of S1_stack.py\n
+
+    dim:      /path/to/stack.dim
+
+    returns list of (coherence band name, i_ref, q_ref, i_sec, q_sec)
+    named as SNAP does: coh_<swath_pol>_<reference date>_<secondary date>
+    '''
+
+    names = [b['Name'] for b in dimap.dimInfo(dim)['Bands'] if not b['Virtual']]
+    refs = {}
+    for name in names:
+        if name.startswith('i_') and '_mst_' in name and 'q_' + name[2::] in names:
+            prefix, date = name[2::].split('_mst_')
+            refs[prefix] = (name, 'q_' + name[2::], date)
+
+    pairs = []
+    for name in names:
+        if not (name.startswith('i_') and '_slv' in name and 'q_' + name[2::] in names):
+            continue
+        prefix, rest = name[2::].split('_slv', 1)
+        if prefix not in refs:
+            continue
+        i_ref, q_ref, ref_date = refs[prefix]
+        date = rest.split('_', 1)[1]
+        pairs.append(('coh_%s_%s_%s' %(prefix, ref_date, date), i_ref, q_ref, name, 'q_' + name[2::]))
+
+    return pairs
+
+def _coherenceTile (bands, pairs, out, win_rg, win_az, phase, window):
+    row_off, col_off, rows, cols, y, x, h, w = window
+    core_rows = (row_off - y, row_off - y + rows)
+    core_cols = (col_off - x, col_off - x + cols)
+
+    # reference tiles are read once for all secondaries of the tile
+    refs = {}
+    for name, i_ref, q_ref, i_sec, q_sec in pairs:
+        if (i_ref, q_ref) not in refs:
+            s1 = np.empty((h, w), np.complex64)
+            s1.real = bands[i_ref][y:y+h, x:x+w]
+            s1.imag = bands[q_ref][y:y+h, x:x+w]
+            refs[(i_ref, q_ref)] = (s1, boxSum(np.square(np.abs(s1), dtype=np.float64), win_rg, win_az, core_rows, core_cols))
+        s1, p1 = refs[(i_ref, q_ref)]
+
+        s2 = np.empty((h, w), np.complex64)
+        s2.real = bands[i_sec][y:y+h, x:x+w]
+        s2.imag = bands[q_sec][y:y+h, x:x+w]
+        p2 = boxSum(np.square(np.abs(s2), dtype=np.float64), win_rg, win_az, core_rows, core_cols)
+
+        interferogram = s1 * np.conj(s2)
+        screen = phase.get(name) if isinstance(phase, dict) else phase
+        if screen is not None:
+            interferogram *= np.exp(-1j * np.asarray(screen[y:y+h, x:x+w], np.float32))
+        numerator = np.abs(boxSum(interferogram, win_rg, win_az, core_rows, core_cols))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coh = numerator / np.sqrt(p1 * p2)
+        coh[~np.isfinite(coh)] = 0
+        out[name][row_off:row_off+rows, col_off:col_off+cols] = coh
+
+def coherence (bands, pairs, out, win_rg=10, win_az=3, phase=None, tile_size=512, workers=None):
+
+    '''
+    [Usage]  coherence(bands, pairs, out, win_rg, win_az, phase, tile_size, workers)\n
+
+    |<s1 s2*>| / sqrt(<|s1|^2><|s2|^2>) of coregistered pairs, tile by tile\n
+
+    bands:     dict of band name and (H, W) array, e.g. dimap_for_oriburi.dimBands
+    pairs:     list of (coherence band name, i_ref, q_ref, i_sec, q_sec)
+               see coherencePairs
+    out:       dict of coherence band name and (H, W) writable array
+    win_rg:    coherence window size in range
+    win_az:    coherence window size in azimuth
+    phase:     (H, W) phase screen in radians removed from every interferogram,
+               dict of coherence band name and phase screen, or None
+               e.g. flat-earth and topographic phase
+    tile_size: int for square tiles or (rows, cols)
+    workers:   number of threads, None for the number of CPUs
+
+    memory is bounded by the tiles in flight, whatever the number of pairs
+    '''
+
+    height, width = bands[pairs[0][1]].shape
+    halo = max(int(win_rg), int(win_az))//2 + 1
+    windows = tileWindows(width, height, tile_size, halo)
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        for future in [pool.submit(trace.bind(_coherenceTile), bands, pairs, out, int(win_rg), int(win_az), phase, window)
+                       for window in windows]:
+            future.result()
+
+    return out
+
+def phaseScreen (phase_dim, pairs, shape):
+
+    '''
+    [Usage]  phaseScreen(phase_dim, pairs, shape)\n
+
+    phase screens of a BEAM-DIMAP product for the pairs of a stack\n
+
+    phase_dim: /path/to/phase.dim on the grid of the stack, in radians
+               bands named after the coherence bands (coh_IW1_VV_12Jan2021_24Jan2021)
+               or a single band removed from every pair
+    pairs:     list of coherencePairs
+    shape:     (H, W) of the stack
+
+    returns phase argument of coherence
+    '''
+
+    bands = dimap.dimBands(phase_dim)
+    for name, band in bands.items():
+        if band.shape != tuple(shape):
+            raise ValueError('%s of %s does not match the grid %s' %(name, phase_dim, tuple(shape)))
+
+    if len(bands) == 1:
+        return next(iter(bands.values()))
+    missing = [pair[0] for pair in pairs if pair[0] not in bands]
+    if len(missing) > 0:
+        raise ValueError('%s has no phase band %s' %(phase_dim, ', '.join(missing)))
+    return {pair[0]: bands[pair[0]] for pair in pairs}
+
+def coherenceDim (dim, save_dir, win_rg=10, win_az=3, phase=None, tile_size=512, workers=None):
+
+    '''
+    [Usage]  coherenceDim(dim, save_dir, win_rg, win_az, phase, tile_size, workers)\n
+
+    coherence of every secondary of a stack against its reference\n
+
+    dim:       /path/to/stack.dim of S1_stack.py with complex bands
+    save_dir:  /path/to/save/directory/productname_coh.dim
+               written on the grid and with the metadata of dim
+    phase:     phase argument of coherence or /path/to/phase.dim (see phaseScreen)
+               without it the flat-earth and topographic fringes of a
+               back-geocoded stack stay in the interferograms and bias the
+               coherence low
+
+    returns list of coherence band names
+    '''
+
+    pairs = coherencePairs(dim)
+    if len(pairs) == 0:
+        raise ValueError('%s has no complex reference/secondary pair' %dim)
+
+    bands = dimap.dimBands(dim)
+    if isinstance(phase, str):
+        phase = phaseScreen(phase, pairs, next(iter(bands.values())).shape)
+    out = dimap.writeDim(dim, save_dir, [pair[0] for pair in pairs])
+    coherence(bands, pairs, out, win_rg, win_az, phase, tile_size, workers)
+    for band in out.values():
+        band.flush()
+
+    print('Product saved in\n', save_dir)
+    return [pair[0] for pair in pairs]
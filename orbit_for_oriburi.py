@@ -0,0 +1,226 @@
+# ####################################################################
+# ####                                                               #
+# ####    orbit_for_oriburi                                          #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Local store of Sentinel-1 POEORB/RESORB orbit files for s1_orb.
+# A directory of .EOF files is scanned once into orbit_index.json, keyed by
+# mission and orbit type and sorted by validity start. The matching file
+# of a scene is found by bisection and staged in the SNAP auxdata folder,
+# where Apply-Orbit-File finds it without downloading.
+# The index is checked against the directory once per process and again
+# only when no file of the index matches a scene.
+
+import os
+import re
+import json
+import shutil
+import bisect
+
+ORBIT_TYPES = {'POEORB': 'Sentinel Precise (Auto Download)',
+               'RESORB': 'Sentinel Restituted (Auto Download)'}
+
+_EOF = re.compile(r'^(S1[A-D])_OPER_AUX_(POEORB|RESORB)_OPOD_\d{8}T\d{6}_V(\d{8}T\d{6})_(\d{8}T\d{6})\.EOF(\.zip)?$')
+_SCENE = re.compile(r'^(S1[A-D])_.{12}_(\d{8}T\d{6})_(\d{8}T\d{6})_')
+
+_indexes = {}
+
+#%% functions
+
+
+def parseOrbitName (name):
+
+    '''
+    [Usage]  parseOrbitName(name)\n
+
+    mission, orbit type and validity of an orbit file name\n
+
+    name:     S1A_OPER_AUX_POEORB_OPOD_20210101T121212_V20201211T225942_20201213T005942.EOF
+
+    returns (mission, type, start, stop) or None
+    start and stop are 'YYYYMMDDTHHMMSS'
+    '''
+
+    m = _EOF.match(name)
+    if m is None:
+        return None
+    return m.group(1), m.group(2), m.group(3), m.group(4)
+
+def sceneTimes (name):
+
+    '''
+    [Usage]  sceneTimes(name)\n
+
+    mission and sensing start/stop of a Sentinel-1 SAFE/zip name\n
+
+    returns (mission, start, stop) or None
+    '''
+
+    m = _SCENE.match(os.path.basename(name))
+    if m is None:
+        return None
+    return m.group(1), m.group(2), m.group(3)
+
+def _scanDirs (orbit_dir):
+    # number of orbit files per directory, to notice added files
+    return {root: sum(1 for name in names if '.EOF' in name)
+            for root, _, names in os.walk(orbit_dir)}
+
+def buildOrbitIndex (orbit_dir):
+
+    '''
+    [Usage]  buildOrbitIndex(orbit_dir)\n
+
+    scan a directory of .EOF files and save orbit_index.json in it\n
+
+    orbit_dir: /path/to/orbit/files/ (searched recursively)
+    '''
+
+    files = {}
+    for root, _, names in os.walk(orbit_dir):
+        for name in names:
+            parsed = parseOrbitName(name)
+            if parsed is None:
+                continue
+            mission, orbit_type, start, stop = parsed
+            files.setdefault(mission, {}).setdefault(orbit_type, []).append(
+                [start, stop, os.path.join(root, name)])
+
+    for mission in files:
+        for orbit_type in files[mission]:
+            files[mission][orbit_type].sort()
+
+    index = {'Dirs': _scanDirs(orbit_dir), 'Files': files}
+    path = os.path.join(orbit_dir, 'orbit_index.json')
+    with open('%s.%d' %(path, os.getpid()), 'w') as f:
+        json.dump(index, f)
+    os.replace('%s.%d' %(path, os.getpid()), path)
+
+    return index
+
+def loadOrbitIndex (orbit_dir, order=('POEORB', 'RESORB'), aux_dir=None):
+
+    '''
+    [Usage]  loadOrbitIndex(orbit_dir, order, aux_dir)\n
+
+    load the orbit index of orbit_dir, rebuilding it when files were added\n
+
+    orbit_dir: /path/to/orbit/files/
+    order:     orbit types in order of preference
+               ('POEORB', 'RESORB') for precise then restituted
+    aux_dir:   SNAP auxdata folder
+               None for ~/.snap/auxdata
+
+    returns orbit store to pass to s1_orb
+
+    the directory is scanned on the first call of a process only,
+    later calls reuse the index (see refreshOrbitIndex)
+    '''
+
+    path = os.path.join(orbit_dir, 'orbit_index.json')
+    index = _indexes.get(path)
+    if index is None:
+        if os.path.exists(path):
+            with open(path) as f:
+                index = json.load(f)
+        if index is None or index['Dirs'] != _scanDirs(orbit_dir):
+            index = buildOrbitIndex(orbit_dir)
+        _indexes[path] = index
+
+    if aux_dir is None:
+        aux_dir = os.path.join(os.path.expanduser('~'), '.snap', 'auxdata')
+
+    return {'Index': index, 'Order': list(order), 'AuxDir': aux_dir, 'OrbitDir': orbit_dir}
+
+def refreshOrbitIndex (orbits):
+
+    '''
+    [Usage]  refreshOrbitIndex(orbits)\n
+
+    rebuild the index of an orbit store if files were added since it was loaded\n
+
+    returns True if the index changed
+    '''
+
+    orbit_dir = orbits['OrbitDir']
+    if orbits['Index']['Dirs'] == _scanDirs(orbit_dir):
+        return False
+    index = buildOrbitIndex(orbit_dir)
+    _indexes[os.path.join(orbit_dir, 'orbit_index.json')] = index
+    orbits['Index'] = index
+    return True
+
+def findOrbit (orbits, mission, start, stop):
+
+    '''
+    [Usage]  findOrbit(orbits, mission, start, stop)\n
+
+    orbit file valid for the whole acquisition\n
+
+    orbits:   orbit store of loadOrbitIndex
+    mission:  'S1A' or 'S1B' or 'S1C'
+    start:    sensing start 'YYYYMMDDTHHMMSS'
+    stop:     sensing stop 'YYYYMMDDTHHMMSS'
+
+    returns (orbit type, path) of the first type in orbits['Order'] or None
+    the orbit directory is scanned again for new files when nothing matches
+    '''
+
+    for _ in range(2):
+        for orbit_type in orbits['Order']:
+            entries = orbits['Index']['Files'].get(mission, {}).get(orbit_type, [])
+            i = bisect.bisect_right(entries, [start, '99999999T999999', ''])
+            # latest file starting before the acquisition, then the one before it
+            for j in (i-1, i-2):
+                if j >= 0 and entries[j][0] <= start and entries[j][1] >= stop:
+                    return orbit_type, entries[j][2]
+        if not refreshOrbitIndex(orbits):
+            break
+
+    return None
+
+def stageOrbit (orbits, orbit_type, path, mission, start):
+
+    '''
+    [Usage]  stageOrbit(orbits, orbit_type, path, mission, start)\n
+
+    link an orbit file into the SNAP auxdata folder of the acquisition month\n
+    '''
+
+    folder = os.path.join(orbits['AuxDir'], 'Orbits', 'Sentinel-1', orbit_type,
+                          mission, start[0:4], start[4:6])
+    os.makedirs(folder, exist_ok=True)
+    target = os.path.join(folder, os.path.basename(path))
+    if not os.path.exists(target):
+        try:
+            os.symlink(os.path.abspath(path), target)
+        except OSError:
+            shutil.copy(path, target)
+
+    return target
+
+def prepareOrbit (orbits, mission, start, stop):
+
+    '''
+    [Usage]  prepareOrbit(orbits, mission, start, stop)\n
+
+    stage the orbit file of an acquisition and return its orbitType\n
+
+    returns orbitType parameter of Apply-Orbit-File or None if no file matches
+    '''
+
+    found = findOrbit(orbits, mission, start, stop)
+    if found is None:
+        return None
+    orbit_type, path = found
+    stageOrbit(orbits, orbit_type, path, mission, start)
+    print('Orbit file: %s' %os.path.basename(path))
+
+    return ORBIT_TYPES[orbit_type]
@@ -12,19 +12,222 @@
 # ####                                                               #
 # ####################################################################
 
-from esa_snappy import ProductIO
-from esa_snappy import WKTReader
-from esa_snappy import HashMap
-from esa_snappy import GPF
-from esa_snappy import jpy
+import os
+import threading
 
 import numpy as np
-import matplotlib.pyplot as plt
+
+from tiles_for_oriburi import tileWindows, tileBufferSize
+import trace_for_oriburi as trace
+
+__version__ = '1.0'
+
+# modules whose code changes the processed outputs
+_PROCESSING_MODULES = ('snappy_for_oriburi', 'numpy_for_oriburi', 'dimap_for_oriburi', 'dem_for_oriburi',
+                       'orbit_for_oriburi', 'lookup_for_oriburi', 'cog_for_oriburi', 'tiles_for_oriburi',
+                       'S1_preproc', 'S1_stack', 'S1_Geocode')
+_processingVersion = None
+
+#%% session
+
+
+class Session:
+
+    '''
+    [Usage]  session.configure(heap, tile_cache, parallelism, options)\n
+
+    esa_snappy and the JVM of this process, started on first use\n
+
+    heap:        max JVM heap, e.g. '16G'
+    tile_cache:  JAI tile cache size in MB
+    parallelism: number of threads computing tiles
+    options:     list of other JVM options, e.g. ['-Dsnap.dataio.bigtiff.compression.type=LZW']
+
+    importing snappy_for_oriburi does not start the JVM; the first function
+    that needs SNAP does, with the options configured so far, and loads the
+    operator SPIs once. heap and options are kept after the start.
+
+    ex) import snappy_for_oriburi as snappy
+        snappy.session.configure(heap='16G', tile_cache=8192, parallelism=8)
+        prod = snappy.readProduct(path, file)     (starts the JVM)
+    '''
+
+    _SNAP = ('ProductIO', 'GPF', 'HashMap', 'WKTReader', 'jpy')
+
+    def __init__(self):
+        self.heap = None
+        self.tile_cache = None
+        self.parallelism = None
+        self.options = []
+        self.module = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self):
+        return self.module is not None
+
+    def configure(self, heap=None, tile_cache=None, parallelism=None, options=None):
+
+        '''
+        set JVM options before the start, tile cache and parallelism at any time\n
+        '''
+
+        if self.started and ((heap is not None and str(heap) != self.heap) or options):
+            # e.g. a job of the daemon, which runs in the JVM it already started
+            print('The JVM is already running, heap and options are kept')
+            heap, options = None, None
+        if heap is not None:
+            self.heap = str(heap)
+        if options:
+            self.options = self.options + list(options)
+        if tile_cache is not None:
+            self.tile_cache = int(tile_cache)
+        if parallelism is not None:
+            self.parallelism = int(parallelism)
+        if self.started:
+            self._tileCache()
+
+    def jvmOptions(self):
+
+        '''
+        options passed to the JVM at the start\n
+        '''
+
+        options = []
+        if self.heap is not None:
+            options.append('-Xmx'+self.heap)
+        if self.tile_cache is not None:
+            options.append('-Dsnap.jai.tileCacheSize=%d' %self.tile_cache)
+        if self.parallelism is not None:
+            options.append('-Dsnap.parallelism=%d' %self.parallelism)
+        return options + self.options
+
+    def start(self):
+
+        '''
+        import esa_snappy and load the operator SPIs, once per process\n
+
+        returns the esa_snappy module
+        '''
+
+        if self.module is not None:
+            return self.module
+        with self._lock:
+            if self.module is None:
+                # the JVM reads JAVA_TOOL_OPTIONS when esa_snappy creates it
+                options = ' '.join(self.jvmOptions())
+                if options:
+                    os.environ['JAVA_TOOL_OPTIONS'] = (os.environ.get('JAVA_TOOL_OPTIONS', '')+' '+options).strip()
+                import esa_snappy
+                esa_snappy.GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
+                self.module = esa_snappy
+                self._tileCache()
+        return self.module
+
+    def _tileCache(self):
+        JAI = self.module.jpy.get_type('javax.media.jai.JAI')
+        if self.tile_cache is not None:
+            JAI.getDefaultInstance().getTileCache().setMemoryCapacity(self.tile_cache*1024*1024)
+        if self.parallelism is not None:
+            JAI.getDefaultInstance().getTileScheduler().setParallelism(self.parallelism)
+
+    def __getattr__(self, name):
+        # session.ProductIO, session.GPF, ... start the JVM
+        if name in Session._SNAP:
+            return getattr(self.start(), name)
+        raise AttributeError(name)
+
+session = Session()
 
 #%% functions
 
 
-def readProduct (path, product):
+def processingVersion ():
+
+    '''
+    [Usage]  processingVersion()\n
+
+    version recorded in the run manifests\n
+
+    __version__, the esa_snappy version and a hash of the processing modules,
+    so that upgrading SNAP or editing the code processes done outputs again
+    '''
+
+    global _processingVersion
+    if _processingVersion is not None:
+        return _processingVersion
+
+    import hashlib
+    import importlib.util
+    import importlib.metadata
+
+    try:
+        esa_snappy = importlib.metadata.version('esa_snappy')
+    except importlib.metadata.PackageNotFoundError:
+        # esa_snappy copied into site-packages by the SNAP installer
+        spec = importlib.util.find_spec('esa_snappy')
+        esa_snappy = None
+        if spec is not None and spec.origin is not None:
+            esa_snappy = '%d' %os.stat(spec.origin).st_mtime
+
+    digest = hashlib.sha1()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in _PROCESSING_MODULES:
+        try:
+            with open(os.path.join(here, name + '.py'), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            pass
+
+    _processingVersion = '%s esa_snappy=%s code=%s' %(__version__, esa_snappy, digest.hexdigest()[0:12])
+    return _processingVersion
+
+def _createProduct (operator, parameters, sourceProducts):
+
+    '''
+    create the target product of a GPF operator\n
+
+    operator:       operator name
+    parameters:     dict of operator parameters
+    sourceProducts: product, list of products or dict of source name and product
+
+    when the source is a Node, the operator is recorded in its Graph instead
+    with tracing enabled (trace_for_oriburi.enable) every call is traced
+    '''
+
+    if isinstance(sourceProducts, dict):
+        first = list(sourceProducts.values())[0]
+    elif isinstance(sourceProducts, list):
+        first = sourceProducts[0]
+    else:
+        first = sourceProducts
+    if isinstance(first, Node):
+        return first.graph.add(operator, parameters, sourceProducts)
+
+    params = session.HashMap()
+    for key, value in parameters.items():
+        if key == 'geoRegion' and isinstance(value, str):
+            value = session.WKTReader().read(value)
+        elif key == 'externalDEMFile' and isinstance(value, str):
+            # a java.io.File parameter, graphs keep the path as text
+            value = session.jpy.get_type('java.io.File')(value)
+        params.put(key, value)
+
+    if isinstance(sourceProducts, dict):
+        sources = session.HashMap()
+        for key, value in sourceProducts.items():
+            sources.put(key, value)
+    elif isinstance(sourceProducts, list):
+        sources = session.jpy.array('org.esa.snap.core.datamodel.Product', len(sourceProducts))
+        for i in range (len(sourceProducts)):
+            sources[i] = sourceProducts[i]
+    else:
+        sources = sourceProducts
+
+    with trace.span(operator, 'operator'):
+        return session.GPF.createProduct(operator, params, sources)
+
+def readProduct (path, product, graph=None):
 
     '''
     [Usage]  deadProduct(path, product)\n
@@ -35,9 +238,14 @@ def readProduct (path, product):
 
     path:     /path/to/your/sat_sata/
     product:  product file name including format
+    graph:    Graph to record the processing chain in
+              None for reading with esa_snappy
     '''
 
-    return ProductIO.readProduct(path+product)
+    if graph is not None:
+        return graph.read(path+product)
+
+    return session.ProductIO.readProduct(path+product)
 
 def TOPS_split (product, pol, swath, first_burst, last_burst):
 
@@ -60,19 +268,19 @@ def TOPS_split (product, pol, swath, first_burst, last_burst):
     print('')
     print('TOPSSAR-Split\n')
 
-    parameters = HashMap()
+    parameters = {}
     if pol == 'VV' or pol == 'VH':
-        parameters.put('selectedPolarisations', pol)
-    parameters.put('subswath', swath)
-    parameters.put('firstBurstIndex', first_burst)
-    parameters.put('lastBurstIndex', last_burst)
+        parameters['selectedPolarisations'] = pol
+    parameters['subswath'] = swath
+    parameters['firstBurstIndex'] = first_burst
+    parameters['lastBurstIndex'] = last_burst
 
-    return GPF.createProduct("TOPSAR-Split", parameters, product)
+    return _createProduct("TOPSAR-Split", parameters, product)
 
-def s1_orb (product, polynomial):
+def s1_orb (product, polynomial, orbits=None):
 
     '''
-    [Usage]  s1_orb(product, polynomial)\n
+    [Usage]  s1_orb(product, polynomial, orbits)\n
 
     apply precise orbit for Sentinel-1A/B\n
 
@@ -82,18 +290,51 @@ def s1_orb (product, polynomial):
     polynomial: polynomial degree
                 it can be set from '0' to '5'
                 '0' is for defualt
+    orbits:   orbit store of orbit_for_oriburi.loadOrbitIndex(orbit_dir, order)
+              the matching orbit file is used without downloading
+              None for downloading precise orbit
     '''
 
     if polynomial == '0':
         polynomial = '3'
+
+    orbitType = 'Sentinel Precise (Auto Download)'
+    if orbits is not None:
+        import orbit_for_oriburi as orbit
+        found = orbit.prepareOrbit(orbits, *_sceneTimes(product))
+        if found is None:
+            print('No orbit file in the orbit store, trying to download precise orbit')
+        else:
+            orbitType = found
     
-    parameters = HashMap()
-    GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
-    parameters.put('orbitType', 'Sentinel Precise (Auto Download)')
-    parameters.put('polyDegree', polynomial)
-    parameters.put('continueOnFail', 'false')
+    parameters = {}
+    parameters['orbitType'] = orbitType
+    parameters['polyDegree'] = polynomial
+    parameters['continueOnFail'] = 'false'
+
+    return _createProduct('Apply-Orbit-File', parameters, product)
+
+def _sceneTimes (product):
+
+    '''
+    mission and sensing start/stop ('YYYYMMDDTHHMMSS') of a product\n
+    '''
+
+    import datetime
+    import orbit_for_oriburi as orbit
 
-    return GPF.createProduct('Apply-Orbit-File', parameters, product)
+    if isinstance(product, Node):
+        read = [n for n in product.graph.nodes if n['operator'] == 'Read'][0]
+        times = orbit.sceneTimes(read['parameters']['file'])
+        if times is None:
+            raise ValueError('%s is not a Sentinel-1 product name' %read['parameters']['file'])
+        return times
+
+    mission = product.getMetadataRoot().getElement('Abstracted_Metadata').getAttributeString('MISSION')
+    start = datetime.datetime.strptime(product.getStartTime().format(), '%d-%b-%Y %H:%M:%S.%f')
+    stop = datetime.datetime.strptime(product.getEndTime().format(), '%d-%b-%Y %H:%M:%S.%f')
+
+    return 'S1'+mission[-1], start.strftime('%Y%m%dT%H%M%S'), stop.strftime('%Y%m%dT%H%M%S')
 
 def thermal_noise_removal (product, pol):
 
@@ -107,20 +348,20 @@ def thermal_noise_removal (product, pol):
               'VV' or 'VH' or 'HV' or 'HH'
     '''
 
-    parameters = HashMap()
-    parameters.put('removeThermalNoise', True)
-    parameters.put('selectedPolarisations', pol)
-    parameters.put('removeThermalNoise', True)
+    parameters = {}
+    parameters['removeThermalNoise'] = True
+    parameters['selectedPolarisations'] = pol
+    parameters['removeThermalNoise'] = True
 
-    return GPF.createProduct('ThermalNoiseRemoval', parameters, product)
+    return _createProduct('ThermalNoiseRemoval', parameters, product)
 
 def remove_GRD_border_noise(product):
 
-    parameters = HashMap()
-    parameters.put('borderLimit', 500)
-    parameters.put('trimThreshold', 0.5)
+    parameters = {}
+    parameters['borderLimit'] = 500
+    parameters['trimThreshold'] = 0.5
 
-    return GPF.createProduct('Remove-GRD-Border-Noise', parameters, product)
+    return _createProduct('Remove-GRD-Border-Noise', parameters, product)
 
 def calibration (product, band, pol, output):
     
@@ -141,26 +382,26 @@ def calibration (product, band, pol, output):
               'Sigma0' or 'Gamma0' or 'Beta0' or 'Complex'
     '''
 
-    parameters = HashMap()
+    parameters = {}
     if output == 'Sigma0':
-        parameters.put('outputSigmaBand', True)
+        parameters['outputSigmaBand'] = True
     if output == 'Gamma0':
-        parameters.put('outputGammaBand', True)
-        parameters.put('outputSigmaBand', False)
+        parameters['outputGammaBand'] = True
+        parameters['outputSigmaBand'] = False
     if output == 'Beta0':
-        parameters.put('outputBetaBand', True)
+        parameters['outputBetaBand'] = True
     if output == 'Complex':
-        parameters.put('outputImageInComplex', True)
+        parameters['outputImageInComplex'] = True
     
     if band == 'all':
         print('all source bands')
     else:
-        parameters.put('sourceBands', band)
+        parameters['sourceBands'] = band
     if pol == 'VV' or pol == 'VH':
-        parameters.put('selectedPolarisations', pol)
-    parameters.put('outputImageScaleInDb', False)
+        parameters['selectedPolarisations'] = pol
+    parameters['outputImageScaleInDb'] = False
 
-    return GPF.createProduct("Calibration", parameters, product)
+    return _createProduct("Calibration", parameters, product)
 
 def subset_wkt (product, wkt):
     
@@ -176,14 +417,10 @@ def subset_wkt (product, wkt):
               'POLYGON((72.80 19.05, 72.80 19.00, 72.90 19.00, 72.90 19.05, 72.80 19.05))'
     '''
     
-    SubsetOp = jpy.get_type('org.esa.snap.core.gpf.common.SubsetOp')
-    geometry = WKTReader().read(wkt)
-    HashMap = jpy.get_type('java.util.HashMap')
-    GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
-    parameters = HashMap()
-    parameters.put('copyMetadata', True)
-    parameters.put('geoRegion', geometry)
-    return GPF.createProduct('Subset', parameters, product)
+    parameters = {}
+    parameters['copyMetadata'] = True
+    parameters['geoRegion'] = wkt
+    return _createProduct('Subset', parameters, product)
 
 def deburst (product, pol):
 
@@ -199,167 +436,155 @@ def deburst (product, pol):
               'VV' or 'VH' or 'HV' or 'HH'
     '''
     
-    parameters = HashMap()
+    parameters = {}
     if pol == 'VV' or pol == 'VH':
-        parameters.put("Polarisations", pol)
-    return GPF.createProduct("TOPSAR-Deburst", parameters, product)
+        parameters["Polarisations"] = pol
+    return _createProduct("TOPSAR-Deburst", parameters, product)
 
-def TOPS_merge (product1, product2):
-    sourceProducts= HashMap()
-    sourceProducts.put('masterProduct', product1)
-    sourceProducts.put('slaveProduct', product2)
+def TOPS_merge (product1, product2, *products):
+    sourceProducts = {}
+    sourceProducts['masterProduct'] = product1
+    sourceProducts['slaveProduct'] = product2
+    for i in range (len(products)):
+        sourceProducts['slaveProduct%d' %(i+2)] = products[i]
 
-    parameters = HashMap()
+    parameters = {}
     
-    return GPF.createProduct("TOPSAR-Merge", parameters, sourceProducts)
+    return _createProduct("TOPSAR-Merge", parameters, sourceProducts)
 
 def TOPS_deramp (product):
 
-    parameters = HashMap()
+    parameters = {}
+
+    return _createProduct("TOPSAR-DerampDemod", parameters, product)
+
+def _externalDEM (parameters, external_dem):
+
+    '''
+    use a local DEM file instead of an (Auto Download) DEM\n
+
+    external_dem: path of the DEM GeoTIFF, see dem_for_oriburi.prepareDEM
+                  None keeps the DEM of the operator
+    '''
+
+    if external_dem is None:
+        return
+    import dem_for_oriburi as dem
+    parameters['demName'] = 'External DEM'
+    parameters['externalDEMFile'] = external_dem
+    parameters['externalDEMNoDataValue'] = dem.NODATA
 
-    return GPF.createProduct("TOPSAR-DerampDemod", parameters, product)
+def _stackSources (product_ref, product_sec):
 
-def backgeocoding (product_ref, product_sec):
     '''
-    for i in range (len(product_sec)):
-        product_ref.append(product_sec[i])
+    source products of a coregistration operator\n
+
+    product_sec: secondary product or list of secondary products
+                 a list is coregistered to the reference in a single operator,
+                 which computes the reference geometry and writes its bands once
     '''
-    sourceProducts = HashMap()
-    sourceProducts.put('masterProduct', product_ref)
-    sourceProducts.put('slaveProduct', product_sec)
 
-    parameters = HashMap()
-    parameters.put("Digital Elevation Model", "Copernicus 30m Global DEM")
-    parameters.put("demResamplingMethod", "BICUBIC_INTERPOLATION")
-    parameters.put("Resampling Type", "BISINC_5_POINT_INTERPOLATION")
-    parameters.put("Output Deramp and Demod Phase", False)
-    parameters.put('nodataValueAtSea',False)
-    parameters.put('maskOutAreaWithoutElevation', False)
+    if isinstance(product_sec, (list, tuple)):
+        return [product_ref] + list(product_sec)
+
+    sourceProducts = {}
+    sourceProducts['masterProduct'] = product_ref
+    sourceProducts['slaveProduct'] = product_sec
+    return sourceProducts
+
+def backgeocoding (product_ref, product_sec, external_dem=None):
+
+    sourceProducts = _stackSources(product_ref, product_sec)
+
+    parameters = {}
+    parameters["demResamplingMethod"] = "BICUBIC_INTERPOLATION"
+    parameters['nodataValueAtSea'] = False
+    parameters['maskOutAreaWithoutElevation'] = False
+    _externalDEM(parameters, external_dem)
     
-    return GPF.createProduct("Back-Geocoding", parameters, sourceProducts)
+    return _createProduct("Back-Geocoding", parameters, sourceProducts)
 
 def ESD (product):
     
-    parameters = HashMap()
-    parameters.put("Registration Window Width", 512)
-    parameters.put("Registration Window Height", 512)
-    parameters.put("Search Window Accuracy in Azimuth Direction", 16)
-    parameters.put("Search Window Accuracy in Range Direction", 16)
-    parameters.put("Window oversampling factor", 128)
-    parameters.put("Cross-Correlation Threshold", 0.1)
-    parameters.put("cohThreshold", 0.3)
-    parameters.put("esdEstimator", 'Periodogram')
-    parameters.put("weightFunc", 'Inv Quadratic')
-    parameters.put("temporalBaselineType", 'Number of images')
-    parameters.put("integrationMethod", 'L1 and L2')
-    parameters.put("doNotWriteTargetBands", False)
-    parameters.put("useSuppliedRangeShift", False)
-    parameters.put("overallRangeShift", 0.0)
-    parameters.put("useSuppliedAzimuthShift",False)
-    parameters.put("overallAzimuthShift",0.0)
-    
-    return GPF.createProduct("Enhanced-Spectral-Diversity", parameters, product)
+    parameters = {}
+    parameters["cohThreshold"] = 0.3
+    parameters["esdEstimator"] = 'Periodogram'
+    parameters["weightFunc"] = 'Inv Quadratic'
+    parameters["temporalBaselineType"] = 'Number of images'
+    parameters["integrationMethod"] = 'L1 and L2'
+    parameters["doNotWriteTargetBands"] = False
+    parameters["useSuppliedRangeShift"] = False
+    parameters["overallRangeShift"] = 0.0
+    parameters["useSuppliedAzimuthShift"] = False
+    parameters["overallAzimuthShift"] = 0.0
+    
+    return _createProduct("Enhanced-Spectral-Diversity", parameters, product)
 
 def stack_corr (mProduct, sProduct):
     
-    sourceProducts = HashMap()
-    sourceProducts.put('masterProduct', mProduct)
-    sourceProducts.put('slaveProduct', sProduct)
+    sourceProducts = _stackSources(mProduct, sProduct)
 
     print('\n\nGenerating stack ...')
     parameters = ""
-    parameters = HashMap()
-    parameters.put('Initial Offset Method', 'Product Geolocation')
-    parameters.put('Output Extents', 'Master')
-    product_stack = GPF.createProduct("CreateStack", parameters, sourceProducts)
+    parameters = {}
+    product_stack = _createProduct("CreateStack", parameters, sourceProducts)
 
     print('\n\nCalculating Cross Correlation ...')
     parameters = ""
-    parameters = HashMap()
-    parameters.put('Test GCPs are on  land', True)
-    parameters.put('Apply Fine Registration for SLCs', True)
-    parameters.put('Number of GCPs', 100000)
-    parameters.put('Coarse Window Width', 128)
-    parameters.put('Coarse Window height', 128)
-    parameters.put('Row Interpolation Factor', 4)
-    parameters.put('Column Interpolation Factor', 4)
-    parameters.put('Max Interations', 30)
-    parameters.put('Fine Window Width', 32)
-    parameters.put('Fine Window Height', 32)
-    parameters.put('Coherence based registration', False)
-    product_stack = GPF.createProduct("Cross-Correlation", parameters, product_stack)
+    parameters = {}
+    product_stack = _createProduct("Cross-Correlation", parameters, product_stack)
 
     print('\n\nApplying Warp ...')
     parameters = ""
-    parameters = HashMap()
-    parameters.put('RMS Threshold (pixel accuracy)', 0.05)
-    parameters.put('Warp polynomial Order', 6)
-    parameters.put('Interpolation Method', 'Cubic convolution (6 points)')
+    parameters = {}
     
-    return GPF.createProduct("Warp", parameters, product_stack)
+    return _createProduct("Warp", parameters, product_stack)
 
-def stack_dem (product_ref, product_sec):
+def stack_dem (product_ref, product_sec, external_dem=None):
 
     
     print('\n\tProcessing DEM-Assisted-Coregistration ...\n')
     
-    sourceProducts = HashMap()
-    sourceProducts.put('masterProduct', product_ref)
-    sourceProducts.put('slaveProduct', product_sec)
+    sourceProducts = _stackSources(product_ref, product_sec)
 
-    parameters = HashMap()
-    parameters.put('digitalElevationModel', 'Copernicus 30m Global DEM (Auto Download)')
-    parameters.put('nodataValueAtSea',False)
-    parameters.put('maskOutAreaWithoutElevation', False)
+    parameters = {}
+    parameters['nodataValueAtSea'] = False
+    parameters['maskOutAreaWithoutElevation'] = False
+    _externalDEM(parameters, external_dem)
     
-    return GPF.createProduct("DEM-Assisted-Coregistration", parameters, sourceProducts)
+    return _createProduct("DEM-Assisted-Coregistration", parameters, sourceProducts)
 
-def stack_dem_corr (mProduct, sProduct):
+def stack_dem_corr (mProduct, sProduct, external_dem=None):
 
     
-    sourceProducts = HashMap()
-    sourceProducts.put('masterProduct', mProduct)
-    sourceProducts.put('slaveProduct', sProduct)    
+    sourceProducts = _stackSources(mProduct, sProduct)
         
-    parameters = HashMap()
-    parameters.put('digitalElevationModel', 'Copernicus 30m Global DEM (Auto Download)')
-    parameters.put('nodataValueAtSea',False)
-    parameters.put('maskOutAreaWithoutElevation', False)
+    parameters = {}
+    parameters['nodataValueAtSea'] = False
+    parameters['maskOutAreaWithoutElevation'] = False
+    _externalDEM(parameters, external_dem)
 
-    product_stack = GPF.createProduct("DEM-Assisted-Coregistration", parameters, sourceProducts)
+    product_stack = _createProduct("DEM-Assisted-Coregistration", parameters, sourceProducts)
 
     print('\n\nCalculating Cross Correlation ...')
     parameters = ""
-    parameters = HashMap()
-    parameters.put('Number of GCPs', 50000)
-    parameters.put('Coarse Window Width', 128)
-    parameters.put('Coarse Window height', 128)
-    parameters.put('Row Interpolation Factor', 4)
-    parameters.put('Column Interpolation Factor', 4)
-    parameters.put('Max Interations', 10)
-    parameters.put('Fine Window Width', 8)
-    parameters.put('Fine Window Height', 8)
-    product_stack = GPF.createProduct("Cross-Correlation", parameters, product_stack)
+    parameters = {}
+    product_stack = _createProduct("Cross-Correlation", parameters, product_stack)
 
     print('\n\nApplying Warp ...')
     parameters = ""
-    parameters = HashMap()
-    parameters.put('RMS Threshold (pixel accuracy)', 0.05)
-    parameters.put('Warp polynomial Order', 3)
-    parameters.put('Interpolation Method', 'Cubic convolution (6 points)')
+    parameters = {}
     
-    return GPF.createProduct("Warp", parameters, product_stack)
+    return _createProduct("Warp", parameters, product_stack)
 
-def coherence_estimation (product, band):
+def coherence_estimation (product, band, external_dem=None):
   
 
-    parameters = HashMap()
-    parameters.put('sourceBands', band)
-    parameters.put('Subtract flat-earth phase', True)
-    parameters.put('Subtract topogrphic phase', True)
-    parameters.put('Digital Elevation Model', 'Copernicus 30m Global DEM (Auto Download)')    
+    parameters = {}
+    parameters['sourceBands'] = band
+    _externalDEM(parameters, external_dem)
 
-    return GPF.createProduct("Coherence", parameters, product)
+    return _createProduct("Coherence", parameters, product)
 
 def multi_look (product, band, Rg, Az):
     
@@ -377,17 +602,17 @@ def multi_look (product, band, Rg, Az):
     Rg:       number of pixels to apply multi looking in range direction
     Az:       number of pixels to apply multi looking in azimuth direction
     '''
-    parameters = HashMap()
-    parameters.put('nRgLooks', Rg)
-    parameters.put('nAzLooks', Az)
+    parameters = {}
+    parameters['nRgLooks'] = Rg
+    parameters['nAzLooks'] = Az
     if band == 'all':
         print('all source bands')
     else:
-        parameters.put('sourceBands', band)
-    parameters.put('outputIntensity', True)
-    parameters.put('grSquarePixel', True)
+        parameters['sourceBands'] = band
+    parameters['outputIntensity'] = True
+    parameters['grSquarePixel'] = True
     
-    return GPF.createProduct("Multilook", parameters, product)
+    return _createProduct("Multilook", parameters, product)
 
 def speckle_filter(product, band, filter_name, kernel_size):
 
@@ -407,23 +632,26 @@ def speckle_filter(product, band, filter_name, kernel_size):
                  'Lee Sigma' or 'IDAN'
     kernel_size: size of kernel
                  same size in each x and y direction
+
+    numpy_for_oriburi.speckle_filter runs 'BOXCAR', 'Lee' and 'Lee Sigma'
+    on band arrays with a cost independent of kernel_size
     '''
 
-    parameters = HashMap()
-    parameters.put('filter', filter_name)
-    parameters.put('filterSizeX', kernel_size)
-    parameters.put('filterSizeY', kernel_size)
+    parameters = {}
+    parameters['filter'] = filter_name
+    parameters['filterSizeX'] = kernel_size
+    parameters['filterSizeY'] = kernel_size
     if band == 'all':
         print('all source bands')
     else:
-        parameters.put('sourceBands', band)
+        parameters['sourceBands'] = band
 
-    return GPF.createProduct("Speckle-Filter", parameters, product)
+    return _createProduct("Speckle-Filter", parameters, product)
 
-def terrain_correction (product, band, dem_name, local_incidence_angle):
+def terrain_correction (product, band, dem_name, local_incidence_angle, external_dem=None):
 
     '''
-    [Usage]  terrain_correction(product, band, dem_name)\n
+    [Usage]  terrain_correction(product, band, dem_name, local_incidence_angle, external_dem)\n
 
     apply terrain correction\n
 
@@ -436,27 +664,84 @@ def terrain_correction (product, band, dem_name, local_incidence_angle):
     dem_name: name of dem (Auto Download)
               'CDEM' or 'Copernicus 30m Global DEM' or 'Copernicus 90m Global DEM' or
               'GETASSE30' or 'SRTM 1Sec Grid' or 'SRTM 1Sec HGT' or 'SRTM 3Sec'
+    external_dem: path of a local DEM GeoTIFF used instead of dem_name
+                  see dem_for_oriburi.prepareDEM
     '''
     
-    parameters = HashMap()
+    parameters = {}
     if band == 'all':
         print('all source bands')
     else:
-        parameters.put('sourceBands', band)
-
-    parameters.put('pixelSpacingInMeter', 10.0)
-    parameters.put('demName', dem_name)
-    parameters.put('demResamplingMethod', 'CUBIC_CONVOLUTION')
-    parameters.put('imageResamplingMethod', 'CUBIC_CONVOLUTION') #NEAREST_NEIGHBOR
-    parameters.put('nodataValueAtSea',False)
-    parameters.put('maskOutAreaWithoutElevation', False)
-    parameters.put('pixelSpacing(m)', 10)
+        parameters['sourceBands'] = band
+
+    parameters['pixelSpacingInMeter'] = 10.0
+    parameters['demName'] = dem_name
+    parameters['demResamplingMethod'] = 'CUBIC_CONVOLUTION'
+    parameters['imageResamplingMethod'] = 'CUBIC_CONVOLUTION' #NEAREST_NEIGHBOR
+    parameters['nodataValueAtSea'] = False
+    parameters['maskOutAreaWithoutElevation'] = False
     if local_incidence_angle == True:
-        parameters.put('saveLocalIncidenceAngle', True)
+        parameters['saveLocalIncidenceAngle'] = True
     else:
-        parameters.put('saveLocalIncidenceAngle', False)
+        parameters['saveLocalIncidenceAngle'] = False
+    _externalDEM(parameters, external_dem)
+
+    return _createProduct("Terrain-Correction", parameters, product)
+
+def tc_lookup (product, dem_name, external_dem=None):
+
+    '''
+    [Usage]  tc_lookup(product, dem_name, external_dem)\n
+
+    geometric lookup of terrain correction, computed once per stack\n
+
+    product:  reference product of a coregistered stack
+              multilooked in the same way as the products to geocode
+    dem_name: same as terrain_correction
+    external_dem: same as terrain_correction
+
+    returns terrain corrected product with the bands 'lookup_x' and 'lookup_y'
+    holding the 1-based source column and row of every map pixel (0 for no data)
+    save it as .dim and pass it to tc_apply
+    '''
+
+    import lookup_for_oriburi as lookup
+
+    for name, expression in lookup.LOOKUP_EXPRESSIONS.items():
+        if product.getBand(name) is None:
+            product.addBand(name, expression)
+
+    return terrain_correction(product, ','.join(lookup.LOOKUP_EXPRESSIONS), dem_name, False, external_dem)
+
+def tc_apply (product, bandNames, lookup_dim, save_dir, tile_size=1024):
+
+    '''
+    [Usage]  tc_apply(product, bandNames, lookup_dim, save_dir, tile_size)\n
+
+    geocode bands through a saved lookup instead of terrain correction\n
+
+    product:    product on the grid of the reference used for tc_lookup
+    bandNames:  list of bands to geocode
+    lookup_dim: /path/to/lookup.dim saved from tc_lookup
+    save_dir:   /path/to/save/directory/productname.dim
+    tile_size:  int for square tiles or (rows, cols) of the map grid
+    '''
 
-    return GPF.createProduct("Terrain-Correction", parameters, product)
+    import lookup_for_oriburi as lookup
+
+    # source window of a map tile, grown to the largest window needed
+    buf = [np.empty(0, np.float32)]
+    def read(bandName, x, y, w, h):
+        if buf[0].size < w * h:
+            buf[0] = np.empty(w * h, np.float32)
+        return readWindow(product, bandName, x, y, w, h, buf[0])
+
+    with trace.span('tc_apply', 'write', output=save_dir):
+        lookup.geocodeDim(read, bandNames, product.getSceneRasterWidth(), product.getSceneRasterHeight(),
+                          lookup_dim, save_dir, tile_size)
+
+    print('Product saved in\n', save_dir)
+    return
 
 def Linear2dB (product):
     
@@ -467,9 +752,9 @@ def Linear2dB (product):
 
     product:  target product
     '''
-    parameters = HashMap()
+    parameters = {}
 
-    return GPF.createProduct('LinearToFromdB', parameters, product)
+    return _createProduct('LinearToFromdB', parameters, product)
 
 def collocate (mProduct, sProduct):
     
@@ -483,24 +768,67 @@ def collocate (mProduct, sProduct):
                secondary images in list
     '''
     
-    parameters = HashMap()
+    parameters = {}
     if type(sProduct) == list:
-        sourceProducts = jpy.array('org.esa.snap.core.datamodel.Product',len(sProduct)+1)
-        sourceProducts[0] = mProduct
-        for i in range (len(sProduct)):
-            sourceProducts[i+1] = sProduct[i]
-        parameters.put('masterProductName', sourceProducts[0].getName())
+        sourceProducts = [mProduct] + sProduct
+        parameters['masterProductName'] = sourceProducts[0].getName()
         
     else:
-        sourceProducts = HashMap()
-        sourceProducts.put("master", mProduct)
-        sourceProducts.put("slave", sProduct)
+        sourceProducts = {}
+        sourceProducts["master"] = mProduct
+        sourceProducts["slave"] = sProduct
     
     
-    parameters.put('targetProductName', mProduct.getName()+'_collocate')
-    parameters.put('resamplingType', 'CUBIC_CONVOLUTION')
+    parameters['targetProductName'] = mProduct.getName()+'_collocate'
+    parameters['resamplingType'] = 'CUBIC_CONVOLUTION'
     
-    return GPF.createProduct('Collocate', parameters, sourceProducts)
+    return _createProduct('Collocate', parameters, sourceProducts)
+
+def footprint (product, n=5):
+
+    '''
+    [Usage]  footprint(product)\n
+
+    footprint of a product as WKT polygon\n
+
+    product:  target product
+    n:        number of points sampled along each edge
+    '''
+
+    PixelPos = session.jpy.get_type('org.esa.snap.core.datamodel.PixelPos')
+    geocoding = product.getSceneGeoCoding()
+    w = product.getSceneRasterWidth()
+    h = product.getSceneRasterHeight()
+
+    edge = [k/(n-1) for k in range(n-1)]
+    pixels = ([(0.5+t*(w-1), 0.5) for t in edge] + [(w-0.5, 0.5+t*(h-1)) for t in edge] +
+              [(w-0.5-t*(w-1), h-0.5) for t in edge] + [(0.5, h-0.5-t*(h-1)) for t in edge])
+    points = []
+    for x, y in pixels:
+        geo = geocoding.getGeoPos(PixelPos(x, y), None)
+        points.append('%f %f' %(geo.getLon(), geo.getLat()))
+    points.append(points[0])
+
+    return 'POLYGON((%s))' %', '.join(points)
+
+def batchDEM (products, tile_dir, cache_dir, quota=None):
+
+    '''
+    [Usage]  batchDEM(products, tile_dir, cache_dir, quota)\n
+
+    one cached external DEM covering all products of a batch\n
+
+    products:  list of products
+    tile_dir:  /path/to/dem/tiles/
+    cache_dir: /path/to/dem/cache/
+    quota:     disk quota of cache_dir in MB
+
+    returns path to pass as external_dem
+    '''
+
+    import dem_for_oriburi as dem
+
+    return dem.prepareDEM([footprint(p) for p in products], tile_dir, cache_dir, quota)
 
 def band_info (product):
 
@@ -535,6 +863,8 @@ def disp (product, band_name, vmin, vmax):
     vmax:     max value of band when display
     '''
 
+    import matplotlib.pyplot as plt
+
     band = product.getBand(band_name)
     w = band.getRasterWidth()
     h = band.getRasterHeight()
@@ -558,39 +888,199 @@ def disp (product, band_name, vmin, vmax):
     print('Max Pixel Value:', np.max(band_data))
     return plt.show()
 
-def save (product, save_dir):
+def save (product, save_dir, cog=None):
 
     '''
-    [Usage]  save(product, save_dir) \n
+    [Usage]  save(product, save_dir, cog) \n
 
     save product as GeoTIFF of BEAM-DIMAP\n
 
     product:  target product
     save_dir: /path/to/save/directory/productnam.tif or
               /path/to/save/directory/productnam.dim
+    cog:      creation options of cog_for_oriburi.cogOptions to save the .tif as
+              Cloud-Optimized GeoTIFF (tiled, compressed, with overviews)
+              True for the default options, None for a plain GeoTIFF
     '''
     if save_dir[-3::] == 'tif':
-        ProductIO.writeProduct(product, save_dir, 'GeoTIFF')
+        formatName = 'GeoTIFF'
     if save_dir[-3::] == 'dim':
-        ProductIO.writeProduct(product, save_dir, 'BEAM-DIMAP')
+        formatName = 'BEAM-DIMAP'
+
+    target = save_dir
+    if cog is not None and formatName == 'GeoTIFF':
+        # SNAP writes a BigTIFF first, GDAL rewrites it as COG
+        formatName = 'GeoTIFF-BigTIFF'
+        target = save_dir[:-4]+'_snap.tif'
+
+    if isinstance(product, Node):
+        graph = product.graph
+        graph.write(product, target, formatName)
+        graph.saveXml(save_dir[:-4]+'_graph.xml')
+        with trace.span('gpt', 'write', output=target, children=True, format=formatName):
+            graph.run(save_dir[:-4]+'_graph.xml')
+    else:
+        with trace.span('writeProduct', 'write', output=target, format=formatName):
+            session.ProductIO.writeProduct(product, target, formatName)
+
+    if target != save_dir:
+        import cog_for_oriburi
+        with trace.span('toCOG', 'write', output=save_dir):
+            cog_for_oriburi.toCOG(target, save_dir, None if cog is True else cog, remove=True)
 
     print('Product saved in\n', save_dir)
     return
 
+_writers = {'Pool': None, 'Workers': 2}
+
+def setWriters (workers):
+
+    '''
+    [Usage]  setWriters(workers)\n
+
+    number of products saveAsync writes at the same time (default 2)\n
+
+    takes effect for the writes submitted after the running ones finish
+    '''
+
+    pool = _writers['Pool']
+    _writers['Pool'] = None
+    _writers['Workers'] = int(workers)
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+def _writerPool ():
+    if _writers['Pool'] is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _writers['Pool'] = ThreadPoolExecutor(_writers['Workers'], thread_name_prefix='saveAsync')
+    return _writers['Pool']
+
+def printProgress (status):
+
+    '''
+    [Usage]  printProgress(status)\n
+
+    default progress report of saveAsync, every 10 s and at the end\n
+    '''
+
+    if status['Done'] or status['Seconds'] - status.get('Printed', 0) >= 10:
+        status['Printed'] = status['Seconds']
+        print('%s: %d/%d row tiles, %.1f tiles/s, %.1f MB/s' %(status['Output'], status['Tiles'], status['Total'],
+                                                               status['Tiles/s'], status['MB/s']))
+
+def _writeRows (product, target, formatName, rows, buffer_size, progress):
+    # compute row tiles of every band on this thread and write them on another one
+    # through two buffers, so that computing tile k+1 overlaps writing tile k
+    import time
+    import queue
+
+    writer = session.ProductIO.getProductWriter(formatName)
+    product.setProductWriter(writer)
+    writer.writeProductNodes(product, target)
+
+    w = product.getSceneRasterWidth()
+    bands = [product.getBand(name) for name in product.getBandNames()]
+    bands = [band for band in bands if writer.shouldWrite(band)]
+    if rows is None:
+        rows = max(1, buffer_size*1024*1024 // (4*w))
+    # row-major as the GPF writer: every band of a row tile before the next
+    # row tile, so that the tiles of the operators below are computed once
+    height = max([band.getRasterHeight() for band in bands], default=0)
+    windows = [(band, y, min(rows, band.getRasterHeight()-y)) for y in range(0, height, rows)
+               for band in bands if y < band.getRasterHeight()]
+
+    free = queue.Queue()
+    for _ in range(2):
+        free.put(np.empty(rows*w, np.float32))
+    written = queue.Queue()
+    status = {'Output': target, 'Tiles': 0, 'Total': len(windows), 'Bytes': 0, 'Seconds': 0.0,
+              'Tiles/s': 0.0, 'MB/s': 0.0, 'Done': False}
+    errors = []
+    t0 = time.perf_counter()
+
+    def write():
+        while True:
+            item = written.get()
+            if item is None:
+                return
+            band, y, h, buf = item
+            try:
+                if not errors:
+                    band.writePixels(0, y, w, h, buf[:w*h])
+                    status['Tiles'] += 1
+                    status['Bytes'] += 4*w*h
+                    status['Seconds'] = time.perf_counter() - t0
+                    status['Tiles/s'] = status['Tiles']/status['Seconds']
+                    status['MB/s'] = status['Bytes']/1024/1024/status['Seconds']
+                    if progress is not None:
+                        progress(status)
+            except Exception as e:
+                errors.append(e)
+            free.put(buf)
+
+    thread = threading.Thread(target=write, name='saveAsync-write')
+    thread.start()
+    try:
+        for band, y, h in windows:
+            buf = free.get()
+            if errors:
+                break
+            band.readPixels(0, y, w, h, buf[:w*h])
+            written.put((band, y, h, buf))
+    finally:
+        written.put(None)
+        thread.join()
+        writer.close()
+    if errors:
+        raise errors[0]
+
+    status['Done'] = True
+    if progress is not None:
+        progress(status)
+
+def saveAsync (product, save_dir, cog=None, rows=None, buffer_size=64, progress=printProgress):
+
+    '''
+    [Usage]  future = saveAsync(product, save_dir, cog, rows, buffer_size, progress)\n
+
+    save product in the background and return at once\n
+
+    product:     target product
+    save_dir:    /path/to/save/directory/productnam.dim or .tif, as in save
+    cog:         creation options of cog_for_oriburi.cogOptions, as in save
+    rows:        rows of one row tile, None to fill buffer_size
+    buffer_size: size of one of the two row tile buffers in MB
+    progress:    function called with a dict of Output, Tiles, Total, Bytes,
+                 Seconds, Tiles/s, MB/s and Done after every row tile
+                 None for no report
+
+    returns concurrent.futures.Future of save_dir
+
+    BEAM-DIMAP products are computed and written row tile by row tile with
+    double buffering; other formats and Graph nodes run save in the pool.
+    setWriters(n) sets the number of products written at the same time, so
+    that the chain of the next scene is computed while this one is written.
+    a product is written by one save or saveAsync at a time.
+
+    ex) futures = []
+        for i in files:
+            futures.append(saveAsync(chain(readProduct(path, i)), out+i[:-4]+'_tc.dim'))
+        [f.result() for f in futures]
+    '''
+
+    def run():
+        if isinstance(product, Node) or save_dir[-3::] != 'dim':
+            save(product, save_dir, cog)
+            return save_dir
+        with trace.span('saveAsync', 'write', output=save_dir, format='BEAM-DIMAP'):
+            _writeRows(product, save_dir, 'BEAM-DIMAP', rows, buffer_size, progress)
+        print('Product saved in\n', save_dir)
+        return save_dir
+
+    return _writerPool().submit(trace.bind(run))
+
 def extBandNames (product):
-    name = ",".join(product.getBandNames())
-
-    bands = []
-    j = ''
-    for i in name:
-        if i == ',':
-            bands.append(j)
-            j = ''
-            continue
-        else:
-            j = j+i
-    bands.append(j)
-    return bands
+    return [str(name) for name in product.getBandNames()]
 
 def extBand (product, bandName):
     
@@ -618,3 +1108,334 @@ def extBandForOriburi (product, bandName):
     band_array.shape = h,w
 
     return {'Band' : band_array, 'Product Name' : product.getName()}
+
+# ProductData.TYPE_* of SNAP and the NumPy type of the band data
+_DATA_TYPES = {10: np.int8, 11: np.int16, 12: np.int32, 20: np.uint8, 21: np.uint16, 22: np.uint32,
+               30: np.float32, 31: np.float64}
+
+def bandDtype (band):
+
+    '''
+    [Usage]  bandDtype(band)\n
+
+    NumPy type of the data of a band, float32 for scaled bands\n
+    '''
+
+    if band.isScalingApplied():
+        return np.dtype(np.float32)
+    return np.dtype(_DATA_TYPES.get(band.getDataType(), np.float32))
+
+def _readBuffer (dtype):
+    # readPixels fills int[], float[] or double[]; an int[] wraps uint32 above
+    # 2^31, a double[] holds every uint32 value exactly
+    if dtype == np.float64 or dtype == np.uint32:
+        return np.float64
+    if dtype.kind == 'f':
+        return np.float32
+    return np.int32
+
+def attachBands (name, shape, dtype):
+
+    '''
+    [Usage]  bands, shm = attachBands(name, shape, dtype)\n
+
+    (T, H, W) array of extBands(..., shared=True) in another process\n
+
+    name, shape, dtype: 'Shared Memory' name, shape and dtype of the result of extBands
+    call shm.close() when done
+    '''
+
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype, buffer=shm.buf), shm
+
+def extBands (products, bandNames, out=None, shared=False, workers=None, rows=512):
+
+    '''
+    [Usage]  extBands(products, bandNames, out, shared, workers, rows)\n
+
+    read bands of many products into one (T, H, W) array\n
+
+    products:  list of products, or one product for several of its bands
+    bandNames: name of the band in every product, or list of names, one per date
+    out:       preallocated (T, H, W) array (or np.memmap) to fill
+               None to allocate one in the native type of the bands
+    shared:    True to allocate it in multiprocessing.shared_memory, so that
+               worker processes attach to it without copies (attachBands)
+    workers:   number of threads reading different dates at the same time
+               None for the number of CPUs
+    rows:      rows read in one call, the integer bands are converted through
+               a buffer of this many rows
+
+    returns dict of 'Bands' (T, H, W) array, 'Product Names', 'Band Names' and
+            'Shared Memory' (SharedMemory to close and unlink, None if not shared)
+
+    ex) stack = extBands([readProduct(path, i) for i in files], 'Sigma0_VV', shared=True)
+        pool.map(func, [(stack['Shared Memory'].name, stack['Bands'].shape, stack['Bands'].dtype, t) for t in ...])
+    '''
+
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not isinstance(products, (list, tuple)):
+        products = [products]*(1 if isinstance(bandNames, str) else len(bandNames))
+    if isinstance(bandNames, str):
+        bandNames = [bandNames]*len(products)
+    if len(bandNames) != len(products):
+        raise ValueError('%d band names for %d products' %(len(bandNames), len(products)))
+
+    bands = [product.getBand(name) for product, name in zip(products, bandNames)]
+    for band, product, name in zip(bands, products, bandNames):
+        if band is None:
+            raise ValueError('%s has no band %s' %(product.getName(), name))
+    h, w = bands[0].getRasterHeight(), bands[0].getRasterWidth()
+    for band, product in zip(bands, products):
+        if (band.getRasterHeight(), band.getRasterWidth()) != (h, w):
+            raise ValueError('%s of %s does not match the grid %s' %(band.getName(), product.getName(), (h, w)))
+
+    shape = (len(bands), h, w)
+    shm = None
+    if out is None:
+        dtype = np.result_type(*[bandDtype(band) for band in bands])
+        if shared:
+            from multiprocessing import shared_memory
+            shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))*dtype.itemsize))
+            out = np.ndarray(shape, dtype, buffer=shm.buf)
+        else:
+            out = np.empty(shape, dtype)
+    elif out.shape != shape:
+        raise ValueError('out has the shape %s, not %s' %(out.shape, shape))
+
+    def read(t):
+        band = bands[t]
+        target = out[t]
+        direct = target.dtype in (np.float32, np.float64) and target.flags['C_CONTIGUOUS']
+        buf = None if direct else np.empty(min(rows, h)*w, _readBuffer(bandDtype(band)))
+        for y in range(0, h, rows):
+            n = min(rows, h - y)
+            if direct:
+                # float bands are read in place
+                band.readPixels(0, y, w, n, target[y:y+n].reshape(-1))
+            else:
+                band.readPixels(0, y, w, n, buf[:n*w])
+                target[y:y+n] = buf[:n*w].reshape(n, w)
+
+    try:
+        with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+            list(pool.map(trace.bind(read), range(len(bands))))
+    except BaseException:
+        if shm is not None:
+            # the segment is removed at once, its memory is freed with the
+            # last view, which the traceback of the failed read may still hold
+            out = None
+            shm.unlink()
+            try:
+                shm.close()
+            except BufferError:
+                pass
+        raise
+
+    return {'Bands': out, 'Product Names': [product.getName() for product in products],
+            'Band Names': list(bandNames), 'Shared Memory': shm}
+
+def readWindow (product, bandName, x, y, w, h, out=None):
+
+    '''
+    [Usage]  readWindow(product, bandName, x, y, w, h, out)\n
+
+    read a window of band data without reading the whole scene\n
+
+    product:  target product
+    bandName: name of target band data
+    x, y:     upper left pixel of the window (column, row)
+    w, h:     width and height of the window in pixels
+    out:      preallocated contiguous float32 buffer with at least w*h elements
+              new buffer is allocated when None
+
+    returns (h, w) view of out
+    '''
+
+    if out is None:
+        out = np.empty(w * h, np.float32)
+    buf = out.reshape(-1)[:w * h]
+    product.getBand(bandName).readPixels(x, y, w, h, buf)
+
+    return buf.reshape(h, w)
+
+def extTiles (product, bandName, tile_size=1024, halo=0):
+
+    '''
+    [Usage]  extTiles(product, bandName, tile_size, halo)\n
+
+    read band data block by block with bounded memory\n
+
+    product:   target product
+    bandName:  name of target band data
+    tile_size: int for square tiles or (rows, cols)
+    halo:      number of overlapping pixels added on each side of a tile
+
+    yields (row_off, col_off, tile)
+    row_off, col_off: position of tile[0, 0] in the scene
+    tile:             (h, w) float32 view including halo
+
+    the same buffer is reused for every tile, copy a tile to keep it
+    '''
+
+    bandData = product.getBand(bandName)
+    w = product.getSceneRasterWidth()
+    h = product.getSceneRasterHeight()
+
+    buf = np.empty(tileBufferSize(tile_size, halo), np.float32)
+    for _, _, _, _, y, x, th, tw in tileWindows(w, h, tile_size, halo):
+        tile = buf[:th * tw]
+        bandData.readPixels(x, y, tw, th, tile)
+        yield y, x, tile.reshape(th, tw)
+
+def setTileCache (size, parallelism=None):
+
+    '''
+    [Usage]  setTileCache(size, parallelism)\n
+
+    set JAI tile cache size and tile scheduler parallelism of the session\n
+
+    size:        tile cache size in MB
+                 None keeps the SNAP default
+    parallelism: number of threads computing tiles
+                 None keeps the SNAP default
+
+    applied at the start of the JVM, or at once if it is running
+    '''
+
+    session.configure(tile_cache=size, parallelism=parallelism)
+
+#%% graph
+
+
+class Node:
+
+    '''
+    target product of an operator recorded in a Graph\n
+
+    pass a Node to the functions above in place of a product
+    '''
+
+    def __init__(self, graph, node_id):
+        self.graph = graph
+        self.id = node_id
+
+class Graph:
+
+    '''
+    [Usage]  graph = Graph(q, c)\n
+
+    record a processing chain as a single SNAP graph and run it with gpt\n
+
+    gpt:      path to the gpt executable of SNAP
+    q:        number of threads of the tile scheduler (gpt -q)
+              None keeps the SNAP default
+    c:        tile cache size in MB (gpt -c)
+              None keeps the SNAP default
+
+    ex) graph = Graph(q=16, c=8192)
+        prod  = readProduct(path, product, graph)
+        split = TOPS_split(prod, 'VV', 'IW1', '1', '9')
+        ...
+        save(subset, '/path/to/save/directory/productname.dim')
+    '''
+
+    def __init__(self, gpt='gpt', q=None, c=None):
+        self.gpt = gpt
+        self.q = q
+        self.c = c
+        self.nodes = []
+
+    def add(self, operator, parameters, sourceProducts):
+
+        '''
+        record an operator and return its Node\n
+
+        operator:       operator name
+        parameters:     dict of operator parameters
+        sourceProducts: Node, list of Nodes or dict of source name and Node
+        '''
+
+        if isinstance(sourceProducts, dict):
+            sources = [(k, v.id) for k, v in sourceProducts.items()]
+        elif isinstance(sourceProducts, list):
+            sources = [('sourceProduct' if i == 0 else 'sourceProduct.%d' %i, sourceProducts[i].id)
+                       for i in range (len(sourceProducts))]
+        elif sourceProducts is None:
+            sources = []
+        else:
+            sources = [('sourceProduct', sourceProducts.id)]
+
+        node_id = operator
+        n = sum(1 for node in self.nodes if node['operator'] == operator)
+        if n > 0:
+            node_id = '%s(%d)' %(operator, n+1)
+
+        self.nodes.append({'id': node_id, 'operator': operator,
+                           'sources': sources, 'parameters': dict(parameters)})
+        return Node(self, node_id)
+
+    def read(self, file):
+        return self.add('Read', {'file': file}, None)
+
+    def write(self, node, file, formatName):
+        return self.add('Write', {'file': file, 'formatName': formatName}, node)
+
+    def toXml(self):
+
+        '''
+        SNAP graph XML of the recorded operators\n
+        '''
+
+        import xml.etree.ElementTree as ET
+
+        root = ET.Element('graph', id='Graph')
+        ET.SubElement(root, 'version').text = '1.0'
+        for node in self.nodes:
+            element = ET.SubElement(root, 'node', id=node['id'])
+            ET.SubElement(element, 'operator').text = node['operator']
+            sources = ET.SubElement(element, 'sources')
+            for name, refid in node['sources']:
+                ET.SubElement(sources, name, refid=refid)
+            parameters = ET.SubElement(element, 'parameters',
+                                       {'class': 'com.bc.ceres.binding.dom.XppDomElement'})
+            for key, value in node['parameters'].items():
+                if not key.isidentifier():
+                    raise ValueError("'%s' of %s is not an operator parameter name" %(key, node['operator']))
+                if isinstance(value, bool):
+                    value = 'true' if value else 'false'
+                ET.SubElement(parameters, key).text = str(value)
+        ET.indent(root)
+
+        return ET.tostring(root, encoding='unicode')
+
+    def saveXml(self, path):
+
+        '''
+        save the graph XML for reuse with gpt or the SNAP Graph Builder\n
+        '''
+
+        with open(path, 'w') as f:
+            f.write(self.toXml())
+        print('Graph saved in\n', path)
+
+    def run(self, path):
+
+        '''
+        run a saved graph with a single gpt process\n
+
+        path:     graph XML saved by saveXml
+        '''
+
+        import subprocess
+
+        command = [self.gpt, path]
+        if self.q is not None:
+            command += ['-q', str(self.q)]
+        if self.c is not None:
+            command += ['-c', '%dM' %int(self.c)]
+        print(' '.join(command))
+        subprocess.run(command, check=True)
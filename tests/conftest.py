@@ -0,0 +1,43 @@
+# Tests of the NumPy parts of the package, which need neither SNAP nor GDAL.
+# BEAM-DIMAP inputs are written with the esa_snappy stub of benchmarks/stub,
+# loaded under another name so that an installed esa_snappy is not shadowed.
+#
+# ex) python -m pytest tests
+
+import os
+import sys
+import importlib.util
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _stub():
+    spec = importlib.util.spec_from_file_location('esa_snappy_stub', os.path.join(ROOT, 'benchmarks', 'stub', 'esa_snappy.py'))
+    stub = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(stub)
+    return stub
+
+@pytest.fixture(scope='session')
+def stub():
+    return _stub()
+
+@pytest.fixture
+def write_dim(stub, tmp_path):
+
+    '''
+    write_dim(name, {band name: (H, W) array}, metadata) -> path of a .dim
+    '''
+
+    def write(name, arrays, metadata=None):
+        height, width = next(iter(arrays.values())).shape
+        bands = [stub.Band(band, width, height, lambda x, y, w, h, a=np.asarray(a, np.float32): a[y:y+h, x:x+w])
+                 for band, a in arrays.items()]
+        path = str(tmp_path / (name + '.dim'))
+        stub._writeDim(stub.Product(name, width, height, bands, metadata), path)
+        return path
+
+    return write
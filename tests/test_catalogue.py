@@ -0,0 +1,21 @@
+import catalogue_for_oriburi as catalogue
+
+
+SQUARE = [(0, 0), (2, 0), (2, 2), (0, 2)]
+
+def test_wkt_points():
+    assert catalogue.wktPoints('POLYGON ((126.5 37.1, 127.0 37.1, 127.0 37.6, 126.5 37.1))') == \
+        [(126.5, 37.1), (127.0, 37.1), (127.0, 37.6), (126.5, 37.1)]
+
+def test_point_in_polygon():
+    assert catalogue.pointInPolygon((1, 1), SQUARE)
+    assert not catalogue.pointInPolygon((3, 1), SQUARE)
+    assert not catalogue.pointInPolygon((1, -0.5), SQUARE)
+
+def test_polygons_intersect():
+    # crossing edges, containment, touching corner and disjoint polygons
+    assert catalogue.polygonsIntersect(SQUARE, [(1, 1), (3, 1), (3, 3), (1, 3)])
+    assert catalogue.polygonsIntersect(SQUARE, [(0.5, 0.5), (1, 0.5), (1, 1)])
+    assert catalogue.polygonsIntersect([(0.5, 0.5), (1, 0.5), (1, 1)], SQUARE)
+    assert catalogue.polygonsIntersect(SQUARE, [(2, 2), (3, 2), (3, 3)])
+    assert not catalogue.polygonsIntersect(SQUARE, [(3, 3), (4, 3), (4, 4)])
@@ -0,0 +1,64 @@
+import warnings
+
+import numpy as np
+import pytest
+
+import cube_for_oriburi as cubes
+import zarr_for_oriburi as zarr
+
+
+def _bands():
+    rng = np.random.default_rng(0)
+    bands = [rng.random((70, 90)).astype(np.float32) for _ in range(6)]
+    bands[1][10:20, 10:20] = np.nan
+    return bands
+
+@pytest.mark.parametrize('name, q', [('mean', None), ('median', None), ('std', None), ('min', None),
+                                     ('max', None), ('percentile', 90), ('count', None)])
+def test_reductions_match_numpy(name, q):
+    bands = _bands()
+    stack = np.stack(bands)
+    # a small memory ceiling gives many windows
+    result = cubes.arrayCube(bands).reduce(name, q, memory=1, workers=2)
+    if name == 'percentile':
+        expected = np.nanpercentile(stack, q, axis=0)
+    elif name == 'count':
+        expected = np.sum(np.isfinite(stack), axis=0)
+    else:
+        expected = getattr(np, 'nan' + name)(stack, axis=0)
+    np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+def test_unknown_reduction():
+    with pytest.raises(ValueError):
+        cubes.arrayCube(_bands()).reduce('mode')
+
+def test_change_ratio():
+    bands = _bands()
+    stack = np.stack(bands).astype(np.float64)
+    ratio = cubes.arrayCube(bands).changeRatio(slice(0, 3), slice(3, 6), workers=2)
+    np.testing.assert_allclose(ratio, np.nanmean(stack[3:], 0)/np.nanmean(stack[:3], 0), rtol=1e-5)
+
+    db = [10*np.log10(b) for b in bands]
+    ratio_db = cubes.arrayCube(db).changeRatio(slice(0, 3), slice(3, 6), dB=True, workers=2)
+    np.testing.assert_allclose(ratio_db, 10*np.log10(ratio), atol=1e-4)
+
+def test_windows_of_array_dim_and_store_cubes(write_dim, tmp_path):
+    bands = _bands()
+    store = str(tmp_path / 'stack.zarr')
+    for t, band in enumerate(bands):
+        zarr.appendDate(store, 'v', band, {'time': str(t)}, chunks=(1, 32, 32))
+    dims = [write_dim('d%d' %t, {'Sigma0_VV': band}) for t, band in enumerate(bands)]
+
+    stack = np.stack(bands)
+    for cube in (cubes.arrayCube(bands), cubes.dimCube(dims), cubes.dimCube(dims, 'Sigma0_VV'),
+                 cubes.storeCube(store, 'v')):
+        assert cube.shape == (6, 70, 90)
+        np.testing.assert_array_equal(cube[:, 5:40, 60:], stack[:, 5:40, 60:])
+        np.testing.assert_array_equal(cube[2], stack[2])
+    assert cubes.dimCube(dims).dates == ['d%d' %t for t in range(6)]
+
+def test_memory_ceiling():
+    with warnings.catch_warnings():
+        cube = cubes.Cube(None, (10**6, 100, 100))
+        with pytest.raises(MemoryError):
+            cube.windowShape(1, 4, 3)
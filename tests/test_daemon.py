@@ -0,0 +1,40 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import daemon_for_oriburi as daemon
+import trace_for_oriburi as trace
+
+
+def test_threads_of_a_job_write_to_the_job(monkeypatch):
+    monkeypatch.setattr(sys, 'stdout', daemon._ThreadOutput(sys.stdout))
+    monkeypatch.setattr(sys, 'stderr', daemon._ThreadOutput(sys.stderr))
+    monkeypatch.setattr(trace, '_bindings', [])
+    trace.addBinding(daemon._currentJob, daemon._setJob)
+    trace.addBinding(daemon._currentJob, daemon._setJob)
+    assert len(trace._bindings) == 1
+
+    jobs = [daemon.Job(str(k), 'S1_stack', []) for k in range(2)]
+    seen = {}
+
+    def run(job):
+        daemon._setJob(job)
+        try:
+            seen[job.id] = daemon.inJob()
+            with ThreadPoolExecutor(2) as pool:
+                for future in [pool.submit(trace.bind(print), 'tile %d of job %s' %(k, job.id)) for k in range(3)]:
+                    future.result()
+        finally:
+            daemon._setJob(None)
+
+    threads = [threading.Thread(target=run, args=(job,)) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for job in jobs:
+        lines = ''.join(job.text).split()
+        assert seen[job.id]
+        assert lines.count('job') == 3 and set(lines[4::5]) == {job.id}
+    assert not daemon.inJob()
@@ -0,0 +1,37 @@
+import numpy as np
+
+import dimap_for_oriburi as dimap
+
+
+def test_dim_bands_round_trip(write_dim):
+    vv = np.arange(12*20, dtype=np.float32).reshape(12, 20)
+    vh = -vv
+    dim = write_dim('product', {'Sigma0_VV': vv, 'Sigma0_VH': vh}, {'range_looks': '4'})
+
+    info = dimap.dimInfo(dim)
+    assert (info['Product Name'], info['Width'], info['Height']) == ('product', 20, 12)
+    assert dimap.dimBandNames(dim) == ['Sigma0_VV', 'Sigma0_VH']
+    np.testing.assert_array_equal(dimap.dimBand(dim, 'Sigma0_VH'), vh)
+    assert set(dimap.dimBands(dim)) == {'Sigma0_VV', 'Sigma0_VH'}
+    assert dimap.dimMetadata(dim)['range_looks'] == '4'
+
+def test_write_dim_on_the_grid_of_a_template(write_dim, tmp_path):
+    template = write_dim('template', {'Sigma0_VV': np.zeros((8, 9), np.float32)})
+    save_dir = str(tmp_path / 'out.dim')
+    bands = dimap.writeDim(template, save_dir, ['a', 'b'])
+    bands['a'][:] = 1
+    bands['b'][:] = 2
+    for band in bands.values():
+        band.flush()
+
+    assert dimap.dimInfo(save_dir)['Product Name'] == 'out'
+    assert dimap.dimBandNames(save_dir) == ['a', 'b']
+    assert (dimap.dimBand(save_dir, 'b') == 2).all()
+
+def test_header_byte_order(tmp_path):
+    hdr = tmp_path / 'band.hdr'
+    hdr.write_text('ENVI\nsamples = 3\nlines = 2\nbands = 1\ndata type = 4\nbyte order = 1\n'
+                   'band names = { a,\n b }\n')
+    entries = dimap.readHdr(str(hdr))
+    assert entries['band names'] == '{ a, b }'
+    assert dimap.hdrDtype(entries) == np.dtype('>f4')
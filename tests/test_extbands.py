@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+import snappy_for_oriburi as snappy
+
+
+class _Band:
+    # readPixels of SNAP converts the raster to the type of the Java array
+    def __init__(self, data, data_type, fail=False):
+        self.data, self.data_type, self.fail = data, data_type, fail
+
+    def getRasterHeight(self):
+        return self.data.shape[0]
+
+    def getRasterWidth(self):
+        return self.data.shape[1]
+
+    def isScalingApplied(self):
+        return False
+
+    def getDataType(self):
+        return self.data_type
+
+    def getName(self):
+        return 'band'
+
+    def readPixels(self, x, y, w, h, buf):
+        if self.fail:
+            raise IOError('read failed')
+        assert buf.dtype in (np.int32, np.float32, np.float64)
+        buf[...] = self.data[y:y+h, x:x+w].reshape(-1).astype(buf.dtype)
+
+class _Product:
+    def __init__(self, band):
+        self.band = band
+
+    def getBand(self, name):
+        return self.band
+
+    def getName(self):
+        return 'product'
+
+def test_uint32_bands_do_not_wrap():
+    data = np.array([[0, 2**31 - 1], [2**31, 2**32 - 1]], np.uint32)
+    stack = snappy.extBands([_Product(_Band(data, 22))], 'band', rows=1)
+    assert stack['Bands'].dtype == np.uint32
+    np.testing.assert_array_equal(stack['Bands'][0], data)
+
+    # with an int16 band the stack is int64, where a wrapped value stays negative
+    stack = snappy.extBands([_Product(_Band(data, 22)), _Product(_Band(data.astype(np.int16), 11))], 'band')
+    assert stack['Bands'].dtype == np.int64
+    np.testing.assert_array_equal(stack['Bands'][0], data)
+
+def test_shared_memory_is_removed_when_a_read_fails():
+    data = np.zeros((4, 4), np.float32)
+    created = []
+    from multiprocessing import shared_memory
+    original = shared_memory.SharedMemory
+
+    def tracked(*args, **kwargs):
+        created.append(original(*args, **kwargs))
+        return created[-1]
+
+    shared_memory.SharedMemory = tracked
+    try:
+        with pytest.raises(IOError):
+            snappy.extBands([_Product(_Band(data, 30)), _Product(_Band(data, 30, fail=True))], 'band', shared=True)
+    finally:
+        shared_memory.SharedMemory = original
+    assert len(created) == 1
+    assert not os.path.exists('/dev/shm/' + created[0].name.lstrip('/'))
@@ -0,0 +1,42 @@
+import numpy as np
+
+import lookup_for_oriburi as lookup
+
+
+def test_bilinear_is_exact_for_planes():
+    y, x = np.mgrid[0:9, 0:13].astype(np.float32)
+    window = 3*x - 2*y + 1
+    sx = np.array([[0, 0.5, 11.25, 12, 12.5, -0.1, np.nan]], np.float32)
+    sy = np.array([[0, 0.5, 7.75, 8, 1, 1, 1]], np.float32)
+    out = lookup.bilinear(window, sx, sy)
+    np.testing.assert_allclose(out[0, :4], 3*sx[0, :4] - 2*sy[0, :4] + 1, rtol=1e-6)
+    # outside the window or without source
+    assert np.isnan(out[0, 4:]).all()
+
+def test_lookup_window_is_one_based_and_clipped():
+    lx = np.array([[0, 2.5], [4.2, 10.0]], np.float32)
+    ly = np.array([[0, 1.0], [3.7, 6.9]], np.float32)
+    assert lookup.lookupWindow(lx, ly, 9, 20) == (1, 0, 8, 7)
+    assert lookup.lookupWindow(np.zeros((2, 2)), np.zeros((2, 2)), 9, 20) is None
+
+def test_apply_lookup_resamples_tile_by_tile():
+    height, width = 40, 50
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    source = 0.5*x + 0.25*y
+
+    # map grid of 30x35 pixels sampling the source at an offset, with a no-data corner
+    gy, gx = np.mgrid[0:30, 0:35].astype(np.float32)
+    lx = 1 + 3.3 + 1.2*gx
+    ly = 1 + 2.1 + 1.1*gy
+    lx[:4, :4] = 0
+
+    def read(bandName, x, y, w, h):
+        return source[y:y+h, x:x+w]
+
+    out = {'b': np.empty((30, 35), np.float32)}
+    lookup.applyLookup(lx, ly, read, ['b'], width, height, out, tile_size=(7, 9))
+
+    expected = 0.5*(lx - 1) + 0.25*(ly - 1)
+    expected[:4, :4] = np.nan
+    expected[(lx - 1 > width - 1) | (ly - 1 > height - 1)] = np.nan
+    np.testing.assert_allclose(out['b'], expected, rtol=1e-5)
@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+
+import dimap_for_oriburi as dimap
+import numpy_for_oriburi as engine
+
+
+def _complex(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    i = (0.1*rng.standard_normal((height, width))).astype(np.float32)
+    q = (0.1*rng.standard_normal((height, width))).astype(np.float32)
+    return i, q
+
+def _snapMultilook(i, q, rg, az):
+    # Multilook of SNAP with outputIntensity: block mean of i*i + q*q in double
+    h, w = i.shape[0]//az, i.shape[1]//rg
+    power = np.square(i.astype(np.float64)) + (0 if q is None else np.square(q.astype(np.float64)))
+    return power[0:h*az, 0:w*rg].reshape(h, az, w, rg).mean(axis=(1, 3)).astype(np.float32)
+
+def _snapdB(linear):
+    # LinearToFromdB of SNAP: 10*log10 in double
+    with np.errstate(divide='ignore', invalid='ignore'):
+        db = 10*np.log10(linear.astype(np.float64))
+    db[~(linear > 0)] = np.nan
+    return db.astype(np.float32)
+
+@pytest.mark.parametrize('rg, az', [(1, 1), (4, 1), (4, 2), (3, 5)])
+def test_radiometry_matches_snap_formulas(rg, az):
+    i, q = _complex(203, 317)
+    h, w = i.shape[0]//az, i.shape[1]//rg
+
+    linear = engine.radiometry(i, np.empty((h, w), np.float32), q, rg, az, chunk_rows=17)
+    reference = _snapMultilook(i, q, rg, az)
+    np.testing.assert_allclose(linear, reference, rtol=engine.LINEAR_RTOL, atol=0)
+
+    db = engine.radiometry(i, np.empty((h, w), np.float32), q, rg, az, dB=True, chunk_rows=17)
+    np.testing.assert_allclose(db, _snapdB(reference), rtol=0, atol=engine.DB_ATOL)
+
+def test_dB_of_no_data_is_nan():
+    band = np.array([[0, 1, 10], [100, 0, 1000]], np.float32)
+    db = engine.linear2dB(band, np.empty(band.shape, np.float32))
+    np.testing.assert_array_equal(np.isnan(db), band == 0)
+    np.testing.assert_allclose(db[band > 0], [0, 10, 20, 30], atol=engine.DB_ATOL)
+
+def test_radiometry_rejects_wrong_output_shape():
+    i, q = _complex(10, 10)
+    with pytest.raises(ValueError):
+        engine.radiometry(i, np.empty((10, 10), np.float32), q, 2, 1)
+
+def test_radiometry_reader_windows(write_dim):
+    i, q = _complex(64, 96, seed=1)
+    dim = write_dim('slc', {'i_IW1_VV': i, 'q_IW1_VV': q})
+    reader = engine.radiometryReader(dim, 4, 2, dB=True)
+    assert reader['Bands'] == ['Intensity_IW1_VV_db']
+    assert (reader['Width'], reader['Height']) == (24, 32)
+
+    full = _snapdB(_snapMultilook(i, q, 4, 2))
+    window = reader['Read']('Intensity_IW1_VV_db', 5, 7, 11, 13)
+    np.testing.assert_allclose(window, full[7:20, 5:16], atol=engine.DB_ATOL)
+
+def _naiveBox(band, kernel_size):
+    half = kernel_size//2
+    mean = np.empty(band.shape)
+    for y in range(band.shape[0]):
+        for x in range(band.shape[1]):
+            mean[y, x] = band[max(y-half, 0):y+half+1, max(x-half, 0):x+half+1].astype(np.float64).mean()
+    return mean
+
+def test_boxcar_matches_naive_mean():
+    band = np.random.default_rng(2).gamma(1, 1, (37, 41)).astype(np.float32)
+    out = engine.speckle_filter(band, 'BOXCAR', 5, tile_size=16, workers=2)
+    np.testing.assert_allclose(out, _naiveBox(band, 5), rtol=1e-5)
+
+@pytest.mark.parametrize('filter_name', ['BOXCAR', 'Lee', 'Lee Sigma'])
+def test_speckle_filter_does_not_depend_on_tiles(filter_name):
+    band = (4*np.random.default_rng(3).gamma(1, 1, (150, 170))).astype(np.float32)
+    whole = engine.speckle_filter(band, filter_name, 7, tile_size=1024)
+    tiled = engine.speckle_filter(band, filter_name, 7, tile_size=(33, 47), workers=3)
+    np.testing.assert_allclose(tiled, whole, rtol=1e-5, atol=1e-6)
+
+def test_speckle_filter_rejects_snap_only_filters():
+    with pytest.raises(ValueError):
+        engine.speckle_filter(np.ones((8, 8), np.float32), 'Refined Lee', 3)
+
+def test_sigma_range_has_unit_mean():
+    i1, i2 = engine.sigmaRange(1.0, 0.9)
+    u = np.linspace(i1, i2, 200001)
+    pdf = np.exp(-u)
+    assert i1 < 1 < i2
+    assert abs(np.sum(u*pdf)/np.sum(pdf) - 1) < 1e-2
+
+def _naiveCoherence(s1, s2, win_rg, win_az):
+    coh = np.empty(s1.shape)
+    for y in range(s1.shape[0]):
+        for x in range(s1.shape[1]):
+            rows = slice(max(y - win_az//2, 0), y - win_az//2 + win_az)
+            cols = slice(max(x - win_rg//2, 0), x - win_rg//2 + win_rg)
+            a, b = s1[rows, cols].astype(np.complex128), s2[rows, cols].astype(np.complex128)
+            coh[y, x] = abs(np.sum(a*np.conj(b))) / np.sqrt(np.sum(abs(a)**2)*np.sum(abs(b)**2))
+    return coh
+
+def test_coherence_matches_naive_estimate():
+    i1, q1 = _complex(30, 40, seed=4)
+    i2, q2 = _complex(30, 40, seed=5)
+    i2 = (0.7*i1 + 0.3*i2).astype(np.float32)
+    q2 = (0.7*q1 + 0.3*q2).astype(np.float32)
+    bands = {'i_VV_mst_12Jan2021': i1, 'q_VV_mst_12Jan2021': q1,
+             'i_VV_slv1_24Jan2021': i2, 'q_VV_slv1_24Jan2021': q2}
+    pairs = [('coh_VV_12Jan2021_24Jan2021', 'i_VV_mst_12Jan2021', 'q_VV_mst_12Jan2021',
+              'i_VV_slv1_24Jan2021', 'q_VV_slv1_24Jan2021')]
+    out = {pairs[0][0]: np.empty((30, 40), np.float32)}
+    engine.coherence(bands, pairs, out, win_rg=6, win_az=3, tile_size=(11, 13), workers=2)
+    naive = _naiveCoherence(i1 + 1j*q1, i2 + 1j*q2, 6, 3)
+    np.testing.assert_allclose(out[pairs[0][0]], naive, rtol=1e-4, atol=1e-5)
+
+def test_coherence_phase_screen_removes_fringes():
+    i, q = _complex(40, 60, seed=6)
+    s1 = i + 1j*q
+    phase = np.tile(np.linspace(0, 12*np.pi, 60, dtype=np.float32), (40, 1))
+    s2 = s1 * np.exp(-1j*phase)
+    bands = {'i_r': s1.real.astype(np.float32), 'q_r': s1.imag.astype(np.float32),
+             'i_s': s2.real.astype(np.float32), 'q_s': s2.imag.astype(np.float32)}
+    pairs = [('coh', 'i_r', 'q_r', 'i_s', 'q_s')]
+
+    fringes = {'coh': np.empty((40, 60), np.float32)}
+    engine.coherence(bands, pairs, fringes, 10, 3)
+    flat = {'coh': np.empty((40, 60), np.float32)}
+    engine.coherence(bands, pairs, flat, 10, 3, phase=phase)
+
+    assert fringes['coh'].mean() < 0.5
+    np.testing.assert_allclose(flat['coh'], 1, atol=1e-4)
+
+def test_coherence_pairs_of_a_stack(write_dim):
+    zero = np.zeros((4, 4), np.float32)
+    dim = write_dim('stack', {'i_IW1_VV_mst_12Jan2021': zero, 'q_IW1_VV_mst_12Jan2021': zero,
+                              'i_IW1_VV_slv1_24Jan2021': zero, 'q_IW1_VV_slv1_24Jan2021': zero,
+                              'Intensity_IW1_VV_mst_12Jan2021': zero})
+    assert engine.coherencePairs(dim) == [('coh_IW1_VV_12Jan2021_24Jan2021',
+                                           'i_IW1_VV_mst_12Jan2021', 'q_IW1_VV_mst_12Jan2021',
+                                           'i_IW1_VV_slv1_24Jan2021', 'q_IW1_VV_slv1_24Jan2021')]
+
+def test_coherence_dim_with_phase_product(write_dim, tmp_path):
+    i, q = _complex(20, 30, seed=7)
+    s1 = i + 1j*q
+    phase = np.tile(np.linspace(0, 8*np.pi, 30, dtype=np.float32), (20, 1))
+    s2 = s1 * np.exp(-1j*phase)
+    stack = write_dim('stack', {'i_VV_mst_12Jan2021': s1.real, 'q_VV_mst_12Jan2021': s1.imag,
+                                'i_VV_slv1_24Jan2021': s2.real, 'q_VV_slv1_24Jan2021': s2.imag})
+    save_dir = str(tmp_path / 'stack_coh.dim')
+
+    screen = write_dim('stack_phase', {'coh_VV_12Jan2021_24Jan2021': phase})
+    assert engine.coherenceDim(stack, save_dir, 10, 3, screen) == ['coh_VV_12Jan2021_24Jan2021']
+    np.testing.assert_allclose(dimap.dimBand(save_dir, 'coh_VV_12Jan2021_24Jan2021'), 1, atol=1e-4)
+
+    with pytest.raises(ValueError):
+        engine.coherenceDim(stack, save_dir, 10, 3, write_dim('other', {'a': phase, 'b': phase}))
+    with pytest.raises(ValueError):
+        engine.coherenceDim(stack, save_dir, 10, 3, write_dim('small', {'a': phase[:10]}))
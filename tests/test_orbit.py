@@ -0,0 +1,42 @@
+import orbit_for_oriburi as orbit
+
+
+def _eof(mission, orbit_type, start, stop):
+    return '%s_OPER_AUX_%s_OPOD_20210201T000000_V%s_%s.EOF' %(mission, orbit_type, start, stop)
+
+def _store(tmp_path, names):
+    for name in names:
+        (tmp_path / name).write_text('')
+    return orbit.loadOrbitIndex(str(tmp_path), aux_dir=str(tmp_path / 'auxdata'))
+
+def test_parse_names():
+    name = _eof('S1A', 'POEORB', '20201211T225942', '20201213T005942')
+    assert orbit.parseOrbitName(name) == ('S1A', 'POEORB', '20201211T225942', '20201213T005942')
+    assert orbit.parseOrbitName(name + '.zip')[1] == 'POEORB'
+    assert orbit.parseOrbitName('orbit_index.json') is None
+    assert orbit.sceneTimes('/data/S1A_IW_SLC__1SDV_20210112T093000_20210112T093027_036100_043B2E_ABCD.zip') == \
+        ('S1A', '20210112T093000', '20210112T093027')
+
+def test_find_orbit_covering_the_acquisition(tmp_path):
+    # daily precise orbits overlap, the latest one starting before the scene may end too early
+    orbits = _store(tmp_path, [_eof('S1A', 'POEORB', '20210110T225942', '20210112T005942'),
+                               _eof('S1A', 'POEORB', '20210111T225942', '20210113T005942'),
+                               _eof('S1A', 'POEORB', '20210112T225942', '20210114T005942'),
+                               _eof('S1A', 'RESORB', '20210115T090000', '20210115T123000'),
+                               _eof('S1B', 'POEORB', '20210111T225942', '20210113T005942')])
+
+    found = orbit.findOrbit(orbits, 'S1A', '20210112T093000', '20210112T093027')
+    assert found[0] == 'POEORB' and '_V20210111T225942_' in found[1]
+    # an acquisition across the end of one file takes the one before
+    found = orbit.findOrbit(orbits, 'S1A', '20210113T000000', '20210113T010000')
+    assert '_V20210112T225942_' in found[1]
+    assert orbit.findOrbit(orbits, 'S1A', '20210115T100000', '20210115T100030')[0] == 'RESORB'
+    assert orbit.findOrbit(orbits, 'S1B', '20210115T100000', '20210115T100030') is None
+
+def test_new_orbit_files_are_found_after_a_rescan(tmp_path):
+    orbits = _store(tmp_path, [_eof('S1A', 'POEORB', '20210110T225942', '20210112T005942')])
+    assert orbit.findOrbit(orbits, 'S1A', '20210120T093000', '20210120T093027') is None
+
+    (tmp_path / _eof('S1A', 'POEORB', '20210119T225942', '20210121T005942')).write_text('')
+    found = orbit.findOrbit(orbits, 'S1A', '20210120T093000', '20210120T093027')
+    assert found[0] == 'POEORB'
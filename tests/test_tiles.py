@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+import tiles_for_oriburi as tiles
+
+
+@pytest.mark.parametrize('tile_size, halo', [(16, 0), ((7, 11), 0), ((7, 11), 3), (100, 2)])
+def test_tile_cores_cover_the_raster_once(tile_size, halo):
+    width, height = 45, 31
+    count = np.zeros((height, width), int)
+    for row_off, col_off, rows, cols, y, x, h, w in tiles.tileWindows(width, height, tile_size, halo):
+        count[row_off:row_off+rows, col_off:col_off+cols] += 1
+        # the window holds the core plus the halo clipped at the border
+        assert y == max(row_off - halo, 0) and x == max(col_off - halo, 0)
+        assert y + h == min(row_off + rows + halo, height)
+        assert x + w == min(col_off + cols + halo, width)
+        assert h*w <= tiles.tileBufferSize(tile_size, halo)
+    assert (count == 1).all()
+
+def test_tile_shape():
+    assert tiles.tileShape(512) == (512, 512)
+    assert tiles.tileShape((256, 1024)) == (256, 1024)
@@ -0,0 +1,44 @@
+import sys
+import time
+import threading
+
+import trace_for_oriburi as trace
+
+
+def _busy(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+def test_concurrent_spans_count_their_own_cpu(tmp_path):
+    path = str(tmp_path / 'run.trace.jsonl')
+    trace.enable(path)
+    try:
+        def work(name, seconds):
+            with trace.span(name):
+                _busy(seconds)
+
+        threads = [threading.Thread(target=trace.bind(work), args=('busy', 0.3)),
+                   threading.Thread(target=trace.bind(work), args=('idle', 0.0))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        trace.disable()
+
+    cpu = {r['Name']: r['CPU'] for r in trace.readTrace(path)}
+    assert 0.25 < cpu['busy'] < 0.5
+    assert cpu['idle'] < 0.05
+
+def test_subprocess_span_counts_child_cpu(tmp_path):
+    import subprocess
+    path = str(tmp_path / 'run.trace.jsonl')
+    trace.enable(path)
+    try:
+        with trace.span('gpt', 'write', children=True):
+            subprocess.run([sys.executable, '-c', 'import time\nend = time.process_time() + 0.3\nwhile time.process_time() < end: pass'], check=True)
+    finally:
+        trace.disable()
+
+    assert trace.readTrace(path)[0]['CPU'] > 0.25
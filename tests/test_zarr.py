@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import zarr_for_oriburi as zarr
+
+
+def test_append_and_read_windows(tmp_path):
+    store = str(tmp_path / 'stack.zarr')
+    rng = np.random.default_rng(0)
+    dates = [rng.random((37, 29)).astype(np.float32) for _ in range(5)]
+    dates[2][:, :] = np.nan
+
+    for t, band in enumerate(dates):
+        time = '2021-01-%02dT00:00:00' %(t+1)
+        assert zarr.appendDate(store, 'Sigma0_VV', band, {'time': time, 'band': 'Sigma0_VV'}, chunks=(2, 16, 8)) == t
+    # the same date is not appended twice
+    assert zarr.appendDate(store, 'Sigma0_VV', dates[1], {'time': '2021-01-02T00:00:00', 'band': 'Sigma0_VV'}) == 1
+
+    info = zarr.storeInfo(store, 'Sigma0_VV')
+    assert info['Shape'] == (5, 37, 29) and info['Chunks'] == (2, 16, 8)
+    assert zarr.storeInfo(store) == ['Sigma0_VV']
+
+    cube = np.stack(dates)
+    np.testing.assert_array_equal(zarr.readWindow(store, 'Sigma0_VV', 0, 0, 37, 29), cube)
+    np.testing.assert_array_equal(zarr.readWindow(store, 'Sigma0_VV', 5, 3, 20, 17, slice(1, 4)), cube[1:4, 5:25, 3:20])
+    np.testing.assert_array_equal(zarr.readSeries(store, 'Sigma0_VV', 36, 28), cube[:, 36, 28])
+
+def test_append_rejects_another_grid(tmp_path):
+    store = str(tmp_path / 'stack.zarr')
+    zarr.appendDate(store, 'v', np.zeros((4, 4), np.float32), {'time': 'a'})
+    with pytest.raises(ValueError):
+        zarr.appendDate(store, 'v', np.zeros((4, 5), np.float32), {'time': 'b'})
+
+def test_band_names():
+    assert zarr.bandDate('Sigma0_VV_slv1_24Jan2021') == '2021-01-24'
+    assert zarr.bandDate('Sigma0_VV') is None
+    assert zarr.bandVariable('Sigma0_VV_slv1_24Jan2021_db') == 'Sigma0_VV_db'
+    assert zarr.bandVariable('Sigma0_VV_mst_12Jan2021') == 'Sigma0_VV'
@@ -0,0 +1,68 @@
+# ####################################################################
+# ####                                                               #
+# ####    tiles_for_oriburi                                          #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+#%% functions
+
+
+def tileShape (tile_size):
+
+    '''
+    [Usage]  tileShape(tile_size)\n
+
+    return tile size as (rows, cols)\n
+
+    tile_size: int for square tiles or (rows, cols)
+    '''
+
+    if isinstance(tile_size, (tuple, list)):
+        return int(tile_size[0]), int(tile_size[1])
+    return int(tile_size), int(tile_size)
+
+def tileWindows (width, height, tile_size, halo=0):
+
+    '''
+    [Usage]  tileWindows(width, height, tile_size, halo)\n
+
+    generate windows covering a raster block by block\n
+
+    width:     raster width in pixels
+    height:    raster height in pixels
+    tile_size: int for square tiles or (rows, cols)
+    halo:      number of overlapping pixels added on each side of a tile
+               windows are clipped at the raster border
+
+    yields (row_off, col_off, rows, cols, y, x, h, w)
+    row_off, col_off, rows, cols: core of the tile without halo
+    y, x, h, w:                   window to be read including halo
+    '''
+
+    rows, cols = tileShape(tile_size)
+    for row_off in range(0, height, rows):
+        core_h = min(rows, height - row_off)
+        y = max(row_off - halo, 0)
+        h = min(row_off + core_h + halo, height) - y
+        for col_off in range(0, width, cols):
+            core_w = min(cols, width - col_off)
+            x = max(col_off - halo, 0)
+            w = min(col_off + core_w + halo, width) - x
+            yield row_off, col_off, core_h, core_w, y, x, h, w
+
+def tileBufferSize (tile_size, halo=0):
+
+    '''
+    [Usage]  tileBufferSize(tile_size, halo)\n
+
+    number of elements needed to hold the largest window of tileWindows\n
+    '''
+
+    rows, cols = tileShape(tile_size)
+    return (rows + 2*halo) * (cols + 2*halo)
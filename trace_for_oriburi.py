@@ -0,0 +1,392 @@
+# ####################################################################
+# ####                                                               #
+# ####    trace_for_oriburi                                          #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Tracing of the snappy_for_oriburi wrappers. When tracing is enabled every
+# operator call, every save and every scene of the S1_* drivers appends one
+# JSON line with wall time, CPU time, JVM heap, JAI tile cache, bytes written
+# and scene id to a trace file. The trace file belongs to the thread that
+# enabled it, so that concurrent jobs of the daemon trace into their own
+# files; threads and worker processes of a run are handed the file with
+# bind() and enable(path, truncate=False). The trace file is turned into a
+# Chrome trace (chrome://tracing, ui.perfetto.dev) and a summary table of
+# the hottest stages at the end of the run.
+#
+# bind() also hands over the thread-local state registered with addBinding,
+# e.g. the output stream of a daemon job.
+#
+# GPF operators are lazy: the span of an operator covers its initialisation
+# only, the tiles of the whole chain are computed inside the span of the
+# write that pulls them.
+#
+# CPU time of a span is the CPU of the thread that runs it, so concurrent
+# spans do not count each other. The span of the gpt subprocess adds the
+# CPU of finished child processes instead; tiles computed by JVM threads
+# in-process are not attributed to any span.
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_local = threading.local()
+# (get, set) of other thread-local state handed over by bind()
+_bindings = []
+
+#%% functions
+
+
+def enable (path, truncate=True):
+
+    '''
+    [Usage]  enable(path, truncate)\n
+
+    start tracing the running thread into a JSON lines file\n
+
+    path:     /path/to/run.trace.jsonl
+    truncate: True to start a new trace, False to append to it
+              (a worker process joining the trace of its parent)
+
+    other threads trace into the same file with bind()
+    '''
+
+    path = os.path.abspath(path)
+    if truncate:
+        open(path, 'w').close()
+    _local.path = path
+    return path
+
+def disable ():
+
+    '''
+    [Usage]  disable()\n
+
+    stop tracing the running thread\n
+    '''
+
+    _local.path = None
+
+def tracePath ():
+
+    '''
+    [Usage]  tracePath()\n
+
+    path of the trace file of the running thread, None when tracing is disabled\n
+    '''
+
+    return getattr(_local, 'path', None)
+
+def addBinding (get, set):
+
+    '''
+    [Usage]  addBinding(get, set)\n
+
+    hand other thread-local state to the threads of bind()\n
+
+    get:      function returning the state of the calling thread
+    set:      function setting the state in the running thread
+
+    ex) the output of a job of daemon_for_oriburi
+    '''
+
+    if (get, set) not in _bindings:
+        _bindings.append((get, set))
+
+def bind (function):
+
+    '''
+    [Usage]  bind(function)\n
+
+    function running with the trace file and scene of the calling thread
+    and the state of addBinding\n
+
+    ex) pool.submit(bind(function), *args)
+    '''
+
+    path = tracePath()
+    scene_id = currentScene()
+    bindings = [(get, set, get()) for get, set in _bindings]
+
+    def bound(*args, **kwargs):
+        previous = tracePath(), currentScene()
+        states = [(set, get()) for get, set, _ in bindings]
+        _local.path, _local.scene = path, scene_id
+        for _, set, state in bindings:
+            set(state)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.path, _local.scene = previous
+            for set, state in states:
+                set(state)
+
+    return bound
+
+def _cpu (children=False):
+    # CPU of the running thread, or of the finished child processes (gpt)
+    if children:
+        t = os.times()
+        return t.children_user + t.children_system
+    return time.thread_time()
+
+def _jvmMemory ():
+    # heap and tile cache of the JVM, only if esa_snappy is already running
+    esa_snappy = sys.modules.get('esa_snappy')
+    if esa_snappy is None:
+        return {}
+    memory = {}
+    try:
+        runtime = esa_snappy.jpy.get_type('java.lang.Runtime').getRuntime()
+        memory['Heap MB'] = (float(runtime.totalMemory()) - float(runtime.freeMemory()))/1024/1024
+        memory['Heap Max MB'] = float(runtime.maxMemory())/1024/1024
+        cache = esa_snappy.jpy.get_type('javax.media.jai.JAI').getDefaultInstance().getTileCache()
+        memory['Tile Cache MB'] = float(cache.getCacheMemoryUsed())/1024/1024
+        memory['Tile Cache Max MB'] = float(cache.getMemoryCapacity())/1024/1024
+    except Exception:
+        pass
+    return memory
+
+def outputSize (save_dir):
+
+    '''
+    [Usage]  outputSize(save_dir)\n
+
+    bytes of an output file, with the .data directory of a .dim\n
+    '''
+
+    paths = [save_dir]
+    if save_dir.endswith('.dim'):
+        paths.append(save_dir[:-4] + '.data')
+    size = 0
+    for path in paths:
+        if os.path.isfile(path):
+            size += os.path.getsize(path)
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, f))
+                except OSError:
+                    pass
+    return size
+
+def _write (record):
+    path = tracePath()
+    if path is None:
+        return
+    line = json.dumps(record, default=str) + '\n'
+    with _lock, open(path, 'a') as f:
+        f.write(line)
+
+def currentScene ():
+
+    '''
+    [Usage]  currentScene()\n
+
+    scene id of the running thread, None outside of scene()\n
+    '''
+
+    return getattr(_local, 'scene', None)
+
+@contextmanager
+def span (name, kind='stage', output=None, children=False, **args):
+
+    '''
+    [Usage]  with span(name, kind, output, children, **args):\n
+
+    record one traced block\n
+
+    name:     e.g. the operator name
+    kind:     'operator' or 'write' or 'stage' or 'scene'
+    output:   path written in the block, its size is recorded as bytes written
+    children: True if the block waits for a subprocess (gpt), CPU is then
+              the CPU of the child processes finished in the block
+              False for the CPU of the running thread
+    args:     other values to keep with the record (JSON serialisable)
+
+    does nothing when tracing is disabled
+    '''
+
+    if tracePath() is None:
+        yield
+        return
+
+    start = time.time()
+    t0 = time.perf_counter()
+    c0 = _cpu(children)
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        record = {'Name': name, 'Kind': kind, 'Scene': currentScene(),
+                  'Start': start, 'Wall': time.perf_counter() - t0, 'CPU': _cpu(children) - c0,
+                  'Pid': os.getpid(), 'Tid': threading.get_ident()}
+        record.update(_jvmMemory())
+        if output is not None:
+            record['Output'] = output
+            record['Bytes'] = outputSize(output)
+        if args:
+            record['Args'] = args
+        if error is not None:
+            record['Error'] = error
+        _write(record)
+
+@contextmanager
+def scene (scene_id):
+
+    '''
+    [Usage]  with scene(scene_id):\n
+
+    attribute the spans of the running thread to a scene\n
+    '''
+
+    previous = currentScene()
+    _local.scene = str(scene_id)
+    try:
+        with span(str(scene_id), 'scene'):
+            yield
+    finally:
+        _local.scene = previous
+
+def readTrace (path):
+
+    '''
+    [Usage]  readTrace(path)\n
+
+    records of a trace file\n
+    '''
+
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # last line of a worker killed while writing
+                    pass
+    return records
+
+def chromeTrace (path, save_dir=None):
+
+    '''
+    [Usage]  chromeTrace(path, save_dir)\n
+
+    convert a trace file to the Chrome trace event format\n
+
+    path:     /path/to/run.trace.jsonl
+    save_dir: /path/to/run.trace.json
+              None for path with .json instead of .jsonl
+
+    open the result in chrome://tracing or https://ui.perfetto.dev
+    '''
+
+    if save_dir is None:
+        save_dir = path[:-1] if path.endswith('.jsonl') else path + '.json'
+
+    records = readTrace(path)
+    t0 = min([r['Start'] for r in records], default=0)
+    events = []
+    for r in records:
+        ts = (r['Start'] - t0)*1e6
+        args = {k: v for k, v in r.items() if k not in ('Name', 'Kind', 'Start', 'Wall', 'Pid', 'Tid')}
+        events.append({'name': r['Name'], 'cat': r['Kind'], 'ph': 'X', 'ts': ts, 'dur': r['Wall']*1e6,
+                       'pid': r['Pid'], 'tid': r['Tid'], 'args': args})
+        if 'Heap MB' in r:
+            events.append({'name': 'JVM', 'ph': 'C', 'ts': ts + r['Wall']*1e6, 'pid': r['Pid'],
+                           'args': {'Heap MB': r['Heap MB'], 'Tile Cache MB': r.get('Tile Cache MB', 0)}})
+
+    with open(save_dir, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return save_dir
+
+def summary (records, top=20):
+
+    '''
+    [Usage]  summary(records, top)\n
+
+    hottest stages of a run, by total wall time\n
+
+    records:  records of readTrace
+    top:      number of rows
+
+    returns list of dict with Name, Kind, Calls, Wall, CPU, Mean, Max, Bytes and Scenes
+    '''
+
+    rows = {}
+    for r in records:
+        if r['Kind'] == 'scene':
+            continue
+        row = rows.setdefault((r['Name'], r['Kind']), {'Name': r['Name'], 'Kind': r['Kind'], 'Calls': 0,
+                                                       'Wall': 0.0, 'CPU': 0.0, 'Max': 0.0, 'Bytes': 0,
+                                                       'Scenes': set()})
+        row['Calls'] += 1
+        row['Wall'] += r['Wall']
+        row['CPU'] += r['CPU']
+        row['Max'] = max(row['Max'], r['Wall'])
+        row['Bytes'] += r.get('Bytes', 0)
+        if r.get('Scene') is not None:
+            row['Scenes'].add(r['Scene'])
+
+    rows = sorted(rows.values(), key=lambda row: row['Wall'], reverse=True)[0:top]
+    for row in rows:
+        row['Mean'] = row['Wall']/row['Calls']
+        row['Scenes'] = len(row['Scenes'])
+    return rows
+
+def printSummary (records, top=20):
+
+    '''
+    [Usage]  printSummary(records, top)\n
+
+    print the summary table of a run\n
+    '''
+
+    scenes = [r for r in records if r['Kind'] == 'scene']
+    total = sum(r['Wall'] for r in scenes) or sum(r['Wall'] for r in records if r['Kind'] != 'scene')
+    peak = max([r.get('Heap MB', 0) for r in records], default=0)
+
+    print('\n%-32s %-8s %6s %10s %10s %9s %9s %6s %10s' %('Stage', 'Kind', 'Calls', 'Wall [s]', 'CPU [s]',
+                                                        'Mean [s]', 'Max [s]', 'Share', 'Written'))
+    for row in summary(records, top):
+        print('%-32s %-8s %6d %10.1f %10.1f %9.2f %9.2f %5.1f%% %8.1fMB' %(row['Name'][0:32], row['Kind'], row['Calls'],
+                                                                          row['Wall'], row['CPU'], row['Mean'], row['Max'],
+                                                                          100*row['Wall']/total if total else 0,
+                                                                          row['Bytes']/1024/1024))
+    print('Scenes: %d  Scene time: %.1f s  Peak JVM heap: %.0f MB' %(len(scenes), sum(r['Wall'] for r in scenes), peak))
+
+def finish (path=None, top=20):
+
+    '''
+    [Usage]  finish(path, top)\n
+
+    stop tracing, then write the Chrome trace and print the summary table of a run\n
+
+    path:     trace file, None for the enabled one
+
+    returns path of the Chrome trace
+    '''
+
+    path = path or tracePath()
+    disable()
+    if path is None or not os.path.exists(path):
+        return None
+    records = readTrace(path)
+    printSummary(records, top)
+    save_dir = chromeTrace(path)
+    print('Trace saved in\n', path, '\n', save_dir)
+    return save_dir
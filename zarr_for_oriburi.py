@@ -0,0 +1,288 @@
+# ####################################################################
+# ####                                                               #
+# ####    zarr_for_oriburi                                           #
+# ####                                                               #
+# ####    Copyright(c) Seungjun Lee                                  #
+# ####                   Yonsei Univ. (Seoul, South Korea)           #
+# ####                   Department of Earth System Science          #
+# ####                                                               #
+# ####    Version: 1.0                                               #
+# ####                                                               #
+# ####################################################################
+
+# Time-series store of geocoded stacks in the Zarr v2 layout, written with
+# NumPy and zlib only. Every variable (e.g. Sigma0_VV) is a (time, y, x)
+# float32 array of zlib-compressed chunks, one file per chunk, which the
+# zarr and xarray packages can open as well. The metadata of every date
+# (acquisition time, band name, orbit) is kept in the .zattrs of the
+# variable. Appending a date writes only the chunks of that date (and the
+# last, incomplete time chunk); chunks that are all NaN are not written.
+# A store is written by one process at a time.
+
+import os
+import re
+import json
+import zlib
+import datetime
+
+import numpy as np
+
+import dimap_for_oriburi as dimap
+
+_DATE = re.compile(r'(\d{2})([A-Z][a-z]{2})(\d{4})')
+
+#%% functions
+
+
+def _writeJson (path, obj):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def _readJson (path):
+    with open(path) as f:
+        return json.load(f)
+
+def _chunkKey (t, cy, cx):
+    return '%d.%d.%d' %(t, cy, cx)
+
+def storeInfo (store, variable=None):
+
+    '''
+    [Usage]  storeInfo(store, variable)\n
+
+    variables of a store, or shape, chunks and dates of one variable\n
+
+    store:    /path/to/stack.zarr
+    variable: name of the variable, None for the list of variables
+    '''
+
+    if variable is None:
+        return sorted(name for name in os.listdir(store)
+                      if os.path.exists(os.path.join(store, name, '.zarray')))
+
+    array = _readJson(os.path.join(store, variable, '.zarray'))
+    attrs = _readJson(os.path.join(store, variable, '.zattrs'))
+    return {'Shape': tuple(array['shape']), 'Chunks': tuple(array['chunks']),
+            'Dates': attrs['dates']}
+
+def createVariable (store, variable, height, width, chunks=(1, 512, 512), level=5, attrs=None):
+
+    '''
+    [Usage]  createVariable(store, variable, height, width, chunks, level, attrs)\n
+
+    create an empty (time, y, x) float32 variable in a store\n
+
+    store:    /path/to/stack.zarr, created if missing
+    variable: name of the variable
+    height:   number of rows of the map grid
+    width:    number of columns of the map grid
+    chunks:   (time, y, x) chunk shape
+              (1, 512, 512) never rewrites a chunk on append
+    level:    zlib compression level
+    attrs:    dict of attributes of the grid, e.g. map info and CRS
+    '''
+
+    os.makedirs(os.path.join(store, variable), exist_ok=True)
+    if not os.path.exists(os.path.join(store, '.zgroup')):
+        _writeJson(os.path.join(store, '.zgroup'), {'zarr_format': 2})
+
+    _writeJson(os.path.join(store, variable, '.zarray'),
+               {'zarr_format': 2, 'shape': [0, int(height), int(width)],
+                'chunks': [int(c) for c in chunks], 'dtype': '<f4',
+                'compressor': {'id': 'zlib', 'level': int(level)},
+                'fill_value': 'NaN', 'order': 'C', 'filters': None,
+                'dimension_separator': '.'})
+    attrs = dict(attrs or {})
+    attrs['_ARRAY_DIMENSIONS'] = ['time', 'y', 'x']
+    attrs['dates'] = []
+    _writeJson(os.path.join(store, variable, '.zattrs'), attrs)
+
+def _readChunk (path, chunks):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return np.full(chunks, np.nan, np.float32)
+    return np.frombuffer(zlib.decompress(data), '<f4').reshape(chunks)
+
+def _writeChunk (path, chunk, level):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(zlib.compress(np.ascontiguousarray(chunk, '<f4').tobytes(), level))
+    os.replace(path + '.tmp', path)
+
+def appendDate (store, variable, band, date, chunks=(1, 512, 512), level=5, attrs=None):
+
+    '''
+    [Usage]  appendDate(store, variable, band, date, chunks, level, attrs)\n
+
+    append one geocoded date to a variable, row of chunks by row of chunks\n
+
+    store:    /path/to/stack.zarr
+    variable: name of the variable, created on the first append
+    band:     (H, W) band, e.g. np.memmap of dimap_for_oriburi.dimBand
+    date:     dict of metadata of the date, at least 'time' (ISO 8601)
+              a date whose 'time' and 'band' are already stored is skipped
+    chunks:   chunk shape of a new variable
+    level:    zlib compression level of a new variable
+    attrs:    attributes of the grid of a new variable
+
+    returns time index of the date
+    '''
+
+    path = os.path.join(store, variable)
+    if not os.path.exists(os.path.join(path, '.zarray')):
+        createVariable(store, variable, band.shape[0], band.shape[1], chunks, level, attrs)
+    array = _readJson(os.path.join(path, '.zarray'))
+    meta = _readJson(os.path.join(path, '.zattrs'))
+
+    for t, stored in enumerate(meta['dates']):
+        if stored.get('time') == date.get('time') and stored.get('band') == date.get('band'):
+            print('%s %s is already in %s' %(variable, date.get('time'), store))
+            return t
+
+    T, H, W = array['shape']
+    ct, cy, cx = array['chunks']
+    level = array['compressor']['level']
+    if band.shape != (H, W):
+        raise ValueError('%s does not match the grid %s of %s' %(band.shape, (H, W), variable))
+
+    t = T
+    tc, tt = divmod(t, ct)
+    for y in range(0, H, cy):
+        rows = np.asarray(band[y:y+cy], np.float32)
+        for x in range(0, W, cx):
+            block = rows[:, x:x+cx]
+            key = os.path.join(path, _chunkKey(tc, y//cy, x//cx))
+            if tt == 0:
+                if np.isnan(block).all():
+                    continue
+                chunk = np.full((ct, cy, cx), np.nan, np.float32)
+            else:
+                # only the last, incomplete time chunk is rewritten
+                chunk = _readChunk(key, (ct, cy, cx)).copy()
+            chunk[tt, :block.shape[0], :block.shape[1]] = block
+            _writeChunk(key, chunk, level)
+
+    # the new date becomes visible only after all of its chunks are written
+    meta['dates'].append(date)
+    _writeJson(os.path.join(path, '.zattrs'), meta)
+    array['shape'][0] = t + 1
+    _writeJson(os.path.join(path, '.zarray'), array)
+
+    return t
+
+def readWindow (store, variable, y, x, h, w, times=None):
+
+    '''
+    [Usage]  readWindow(store, variable, y, x, h, w, times)\n
+
+    read a spatial window across dates, touching only the chunks it covers\n
+
+    store:    /path/to/stack.zarr
+    variable: name of the variable
+    y, x:     upper left pixel of the window (row, column)
+    h, w:     height and width of the window
+    times:    slice of time indexes, None for all dates
+
+    returns (T, h, w) float32 array in the order the dates were appended
+    '''
+
+    array = _readJson(os.path.join(store, variable, '.zarray'))
+    T, H, W = array['shape']
+    ct, cy, cx = array['chunks']
+    t0, t1, _ = (times or slice(None)).indices(T)
+
+    out = np.full((t1 - t0, h, w), np.nan, np.float32)
+    for tc in range(t0//ct, -(-t1//ct)):
+        for yc in range(y//cy, (y + h - 1)//cy + 1):
+            for xc in range(x//cx, (x + w - 1)//cx + 1):
+                chunk = _readChunk(os.path.join(store, variable, _chunkKey(tc, yc, xc)), (ct, cy, cx))
+                ta, tb = max(t0, tc*ct), min(t1, (tc+1)*ct)
+                ya, yb = max(y, yc*cy), min(y + h, (yc+1)*cy)
+                xa, xb = max(x, xc*cx), min(x + w, (xc+1)*cx)
+                out[ta-t0:tb-t0, ya-y:yb-y, xa-x:xb-x] = \
+                    chunk[ta-tc*ct:tb-tc*ct, ya-yc*cy:yb-yc*cy, xa-xc*cx:xb-xc*cx]
+
+    return out
+
+def readSeries (store, variable, y, x):
+
+    '''
+    [Usage]  readSeries(store, variable, y, x)\n
+
+    time series of one pixel\n
+
+    returns (T,) float32 array
+    '''
+
+    return readWindow(store, variable, y, x, 1, 1)[:, 0, 0]
+
+def bandDate (bandName):
+
+    '''
+    [Usage]  bandDate(bandName)\n
+
+    acquisition date of a stack band name such as Sigma0_VV_slv1_24Jan2021\n
+
+    returns 'YYYY-MM-DD' or None
+    '''
+
+    found = _DATE.findall(bandName)
+    if len(found) == 0:
+        return None
+    return datetime.datetime.strptime(''.join(found[-1]), '%d%b%Y').strftime('%Y-%m-%d')
+
+def bandVariable (bandName):
+
+    '''
+    [Usage]  bandVariable(bandName)\n
+
+    variable of a stack band name, Sigma0_VV_slv1_24Jan2021_db -> Sigma0_VV_db\n
+    '''
+
+    return re.sub(r'_(mst|slv\d*)_\d{2}[A-Z][a-z]{2}\d{4}', '', bandName)
+
+def appendDim (store, dim, chunks=(1, 512, 512), level=5):
+
+    '''
+    [Usage]  appendDim(store, dim, chunks, level)\n
+
+    append every band of a geocoded BEAM-DIMAP product to a store\n
+
+    store:    /path/to/stack.zarr
+    dim:      /path/to/geocoded.dim of S1_Geocode.py
+              bands of a batched stack are appended as separate dates
+    chunks:   chunk shape of new variables
+    level:    zlib compression level of new variables
+
+    returns list of (variable, time index)
+    '''
+
+    reference = dimap.dimMetadata(dim)
+    secondaries = dimap.dimSecondaryMetadata(dim)
+    info = dimap.dimInfo(dim)
+
+    appended = []
+    for band in info['Bands']:
+        if band['Virtual'] or band['Header'] is None:
+            continue
+        hdr = dimap.readHdr(band['Header'])
+        date = bandDate(band['Name'])
+        metadata = reference
+        for secondary in secondaries:
+            first = secondary.get('first_line_time', '')
+            if date is not None and first[0:11].upper() == \
+                    datetime.datetime.strptime(date, '%Y-%m-%d').strftime('%d-%b-%Y').upper():
+                metadata = secondary
+        entry = {'time': date or metadata.get('first_line_time'), 'band': band['Name'],
+                 'product': info['Product Name'], 'first_line_time': metadata.get('first_line_time'),
+                 'mission': metadata.get('MISSION'), 'pass': metadata.get('PASS'),
+                 'abs_orbit': metadata.get('ABS_ORBIT'), 'rel_orbit': metadata.get('REL_ORBIT')}
+        attrs = {'map info': hdr.get('map info'), 'crs': hdr.get('coordinate system string')}
+        variable = bandVariable(band['Name'])
+        t = appendDate(store, variable, dimap._memmap(band, 'r'), entry, chunks, level, attrs)
+        appended.append((variable, t))
+
+    print('Appended %d bands to %s' %(len(appended), store))
+    return appended